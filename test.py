@@ -8,12 +8,78 @@ __license__ = "MIT"
 __version__ = "1.0"
 __email__ = "rok@reveelapp.io"
 
-import argparse
-import dateutil.parser
+import array
+import asyncore
+import base64
+import BaseHTTPServer
+import binascii
+import bisect
+import calendar
+import collections
+import datetime
+import hashlib
+import httplib
 import json
-import requests
+import math
+import os
+import Queue
+import random
+import re
+import socket
+import SocketServer
+import StringIO
 import sys
+import threading
+import time
+import traceback
 import urlparse
+import zlib
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class LazyModule(object):
+    """
+    Stands in for a module and imports it on first attribute access. A
+    dotted name binds the top package like import a.b does. Optional
+    modules that aren't installed report available() False.
+    """
+    def __init__(self, name, optional=False):
+        self.name = name
+        self.optional = optional
+        self.module = None
+        self.missing = False
+
+    def available(self):
+        """
+        Import the module if needed and return True when it is installed.
+        """
+        if self.module is None and not self.missing:
+            try:
+                self.module = __import__(self.name)
+            except ImportError:
+                if not self.optional:
+                    raise
+                self.missing = True
+        return self.module is not None
+
+    def __getattr__(self, attribute):
+        if attribute in ("name", "optional", "module", "missing") or \
+            not self.available():
+            raise AttributeError(attribute)
+        return getattr(self.module, attribute)
+
+# Heavy modules are imported on first use, so commands like probe that
+# don't need them start fast
+argparse = LazyModule("argparse")
+csv = LazyModule("csv")
+dateutil = LazyModule("dateutil.parser")
+multiprocessing = LazyModule("multiprocessing")
+numpy = LazyModule("numpy", optional=True)
+requests = LazyModule("requests")
+sqlite3 = LazyModule("sqlite3")
+xml = LazyModule("xml.sax.saxutils")
 
 # Terminal colors
 TERMINAL_HEADER = "\033[95m"
@@ -25,114 +91,1654 @@ TERMINAL_ENDC = "\033[0m"
 TERMINAL_BOLD = "\033[1m"
 TERMINAL_UNDERLINE = "\033[4m"
 
+# HTTP transport defaults
+HTTP_METHODS = ("GET", "HEAD", "OPTIONS", "POST", "PUT", "PATCH", "DELETE")
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_ENGINE_CONNECTIONS = 1000
+
+DEFAULT_STREAM_CHUNK = 65536
+
+# Test suite defaults
+DEFAULT_SUITE_WORKERS = 8
+
+# Trace defaults, exchanges kept in memory and body bytes kept per exchange
+DEFAULT_TRACE_SIZE = 32
+DEFAULT_TRACE_BYTES = 1024
+
+# Conditional GET cache defaults, entries kept and headers of a cached
+# response that a 304 response doesn't replace
+DEFAULT_CACHE_SIZE = 1024
+CACHE_ENTITY_HEADERS = ("content-encoding", "content-length", \
+    "content-type", "transfer-encoding")
+
+# Recording and replay defaults
+RECORD_BATCH = 256
+DEFAULT_REPLAY_SPEED = "1"
+REPLAY_PATH_PATTERN = re.compile(r"^/tasks/([^/]+)\.json(.*)$")
+REPLAY_FIELDS = ("route", "count", "errors", "status_diff", "body_diff", \
+    "recorded_p50_ms", "replayed_p50_ms", "recorded_p99_ms", \
+    "replayed_p99_ms")
+
+# Reference server, reached in process through REFERENCE_URL
+REFERENCE_URL = "http://reference.invalid/"
+DEFAULT_SERVE_PORT = 8080
+REFERENCE_TASK_PATTERN = re.compile(r"^/tasks/([^/]+)\.json$")
+REFERENCE_INT_PATTERN = re.compile(r"^\s*([+-]?\d+)")
+REFERENCE_DEADLINE_PATTERN = re.compile(r"^\d{4}-(0[1-9]|1[0-2])-" + \
+    r"(0[1-9]|[12]\d|3[01])([T ]([01]\d|2[0-3]):[0-5]\d(:[0-5]\d" + \
+    r"([.,]\d+)?)?([zZ]|[+-]([01]\d|2[0-3]):?[0-5]\d)?)?$")
+REFERENCE_ALLOW_LIST = "GET,HEAD,OPTIONS,POST"
+REFERENCE_ALLOW_TASK = "OPTIONS,GET,PUT,PATCH,DELETE"
+REFERENCE_TITLE_ERROR = "Title must be a string between 4 and 64 characters"
+REFERENCE_DESCRIPTION_ERROR = "Description must be a string between 0 " + \
+    "and 255 characters"
+REFERENCE_DEADLINE_ERROR = "Date must be ISO8601 formatted string!"
+REFERENCE_BODY_ERROR = "Body must be a JSON object"
+
+# Fuzz command defaults. Every field of a case is valid or, with the
+# remaining share, of one of the kinds. Deadlines are valid in all the
+# variants and invalid in all the others
+FUZZ_METHODS = ("POST", "PUT", "PATCH")
+FUZZ_KINDS = ("length", "unicode", "type", "missing")
+FUZZ_VALID_SHARE = 0.5
+FUZZ_MISSING = object()
+FUZZ_WRONG_TYPES = (None, 0, 12345, 1.5, True, False, [], ["Task"], {}, \
+    {"title": "Task"})
+FUZZ_UNICODE_ALPHABET = (u"a", u"\u00e9", u"\u00df", u"\u4e2d", u"\u0301", \
+    u"\U0001f600", u"\u200b", u"\"", u"\\", u"\n")
+FUZZ_DEADLINE_FORMATS = ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S", \
+    "%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%Sz", "%Y-%m-%dT%H:%M:%S.%f", \
+    "%Y-%m-%dT%H:%M:%S+01:00", "%Y-%m-%dT%H:%M:%S.%f-05:30", \
+    "%Y-%m-%dT%H:%M:%S-0530", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M+02:00")
+FUZZ_INVALID_DEADLINES = ("", "2015/09/11", "2015-13-01", "2015-9-11", \
+    "2015-09-11T", "2015-09-11T25:00", "2015-09-11T09:00:00+25:00", \
+    "11.09.2015", "tomorrow")
+FUZZ_UNICODE_DEADLINES = (u"\uff12\uff10\uff11\uff15-09-11", \
+    u"2015\u201009\u201011", u"2015-09-11T09:00:00\u2212 01:00")
+FUZZ_DEDUP_SIZE = 1000000
+FUZZ_DEDUP_ATTEMPTS = 100
+FUZZ_SHRINK_STEPS = 200
+DEFAULT_FUZZ_CASES = 10000
+DEFAULT_FUZZ_WORKERS = 16
+DEFAULT_FUZZ_FAILURES = 20
+
+# Probe command defaults, the timeout applies to every socket operation
+DEFAULT_PROBE_TIMEOUT = 1.0
+
+# Resource sampler defaults
+DEFAULT_SAMPLE_INTERVAL = 1.0
+
+# Result sink defaults, records are written in batches
+DEFAULT_SINK_BATCH = 256
+DEFAULT_SINK_INTERVAL = 0.5
+RESULT_FIELDS = ("endpoint", "title", "status", "reason", "status_code", \
+    "requests", "latency_ms", "start", "duration_ms", "trace")
+
+# Compression benchmark defaults, link speeds are in kbit/s and the
+# reference server compresses bodies from the threshold on like the
+# compression middleware of Express
+COMPRESSION_ENCODINGS = ("identity", "gzip", "deflate")
+DEFAULT_COMPRESSION_PAGE_SIZES = "1,10,100,1000"
+DEFAULT_COMPRESSION_LINKS = "500,2000,10000"
+DEFAULT_COMPRESSION_SAMPLES = 10
+COMPRESSION_LEVEL = 6
+COMPRESSION_THRESHOLD = 1024
+COMPRESSION_FIELDS = ("request", "page_size", "encoding", "served", \
+    "source", "tasks", "identity_bytes", "wire_bytes", "ratio", "ttlb_ms", \
+    "decompress_ms")
+
+# Crawl command defaults
+DEFAULT_CRAWL_PAGE_SIZE = 100
+DEFAULT_CRAWL_CONCURRENCY = 8
+CRAWL_FIELDS = ("page", "tasks", "x_count", "latency_ms", "duplicates", \
+    "order_violations")
+
+# Pipelining command defaults, only GET and HEAD requests are pipelined
+DEFAULT_PIPELINE_DEPTHS = "1,8,32,128"
+DEFAULT_PIPELINE_REQUESTS = 10000
+DEFAULT_PIPELINE_MIX = "GET /tasks.json?pageSize=10=50," + \
+    "GET /tasks/:id.json=40,HEAD /tasks.json=10"
+PIPELINE_TASKS = 1000
+PIPELINE_FIELDS = ("depth", "connections", "requests", "errors", "elapsed", \
+    "req_per_s", "p50_ms", "p90_ms", "p99_ms", "max_ms", "opened", \
+    "closes", "fallbacks", "final_depth")
+
+# Deadline parsing, the API returns YYYY-MM-DDTHH:MM:SS+HH:MM
+DEADLINE_PATTERN = re.compile(r"^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):" + \
+    r"(\d{2})([+-])(\d{2}):(\d{2})$")
+DEADLINE_CACHE = {}
+DEADLINE_CACHE_SIZE = 100000
+NUMPY_MIN_TASKS = 64
+
+# Load mode defaults
+DEFAULT_LOAD_WORKERS = 8
+DEFAULT_LOAD_DURATION = 10.0
+TASK_PATH_PATTERN = re.compile(r"^/tasks/[^/]+\.json$")
+
+# Open-loop mode defaults, the route mix is "METHOD url=weight,..."
+DEFAULT_OPEN_LOOP_MIX = "GET /tasks.json?pageSize=10=50," + \
+    "GET /tasks/:id.json=30,HEAD /tasks.json=5,POST /tasks.json=10," + \
+    "PATCH /tasks/:id.json=5"
+OPEN_LOOP_TASKS = 1000
+OPEN_LOOP_POLL = 0.01
+
+# Workload profiles, operations on single tasks pick ids from a key
+# distribution
+WORKLOAD_OPERATIONS = {
+    "GET": ("GET", "/tasks/:id.json"),
+    "LIST": ("GET", "/tasks.json"),
+    "POST": ("POST", "/tasks.json"),
+    "PUT": ("PUT", "/tasks/:id.json"),
+    "PATCH": ("PATCH", "/tasks/:id.json"),
+    "DELETE": ("DELETE", "/tasks/:id.json")
+}
+WORKLOAD_PROFILES = {
+    "read-only": "GET=100",
+    "read-mostly": "GET=95,PATCH=5",
+    "update-heavy": "GET=50,PATCH=50",
+    "mixed": "GET=70,LIST=5,PATCH=10,PUT=5,POST=5,DELETE=5",
+    "write-heavy": "GET=20,PATCH=30,PUT=20,POST=20,DELETE=10"
+}
+KEY_DISTRIBUTIONS = ("uniform", "zipfian", "latest")
+ZIPFIAN_THETA = 0.99
+DEFAULT_WORKLOAD_RECORDS = 1000
+DEFAULT_WORKLOAD_PAGE_SIZE = 10
+
+# Latency histogram buckets per doubling of latency, about 4% resolution
+HISTOGRAM_BUCKETS_PER_DOUBLING = 16
+LATENCY_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+# Task validation limits, the server rejects titles of 64 and descriptions
+# of 255 characters
+TITLE_MIN_LENGTH = 4
+TITLE_MAX_LENGTH = 63
+DESCRIPTION_MIN_LENGTH = 0
+DESCRIPTION_MAX_LENGTH = 254
+
+# Seed command defaults
+DEFAULT_SEED_COUNT = 10000
+DEFAULT_SEED_CONNECTIONS = 64
+DEFAULT_SEED_BATCH = 10000
+SEED_EPOCH = datetime.datetime(2015, 1, 1)
+SEED_DEADLINE_SPAN = 3 * 365 * 24 * 3600
+SEED_TEXT_WORDS = 4096
+
+# Words of generated task texts
+SEED_WORDS = ("task", "meeting", "report", "review", "call", "email", \
+    "draft", "plan", "budget", "release", "deploy", "fix", "update", \
+    "client", "project", "invoice", "design", "test", "write", "read", \
+    "prepare", "send", "check", "order", "schedule", "book", "buy", \
+    "clean", "pants", "morning", "weekly", "monthly", "urgent", "team")
+
+# Pagination benchmark defaults
+DEFAULT_PAGE_SIZES = "10,100,1000"
+DEFAULT_PAGE_POINTS = 20
+DEFAULT_PAGE_SAMPLES = 3
+DEFAULT_SUPERLINEAR_EXPONENT = 1.1
+PAGINATION_FIELDS = ("page_size", "page", "offset", "tasks", "bytes", \
+    "latency_ms")
+
+# Search benchmark defaults
+DEFAULT_SEARCH_SIZES = "10000,100000"
+DEFAULT_SEARCH_SELECTIVITIES = "0.00001,0.0001,0.001,0.01,0.1,0.5"
+DEFAULT_SEARCH_SAMPLES = 20
+SEARCH_FIELDS = ("corpus_size", "db_size", "term", "selectivity", \
+    "matches", "p50_ms", "p90_ms", "max_ms", "queries_per_s", "errors", \
+    "error")
+
+# Benchmark gate defaults, a workload regresses when its median latency
+# grows by more than the threshold and the change is significant
+BENCH_WORKLOADS = ("list", "page", "search", "get", "patch", "post")
+BENCH_SAMPLES = 200
+BENCH_WARMUP = 20
+BENCH_TASKS = 1000
+BENCH_PAGE_SIZE = 10
+BENCH_SEARCH_TERM = "report"
+BENCH_THRESHOLD = 0.1
+BENCH_ALPHA = 0.01
+BENCH_CONFIDENCE = 0.95
+BENCH_BOOTSTRAP_ROUNDS = 1000
+BENCH_FIELDS = ("workload", "samples", "errors", "median_ms", "p90_ms", \
+    "baseline_ms", "ratio", "ci_low", "ci_high", "p_value", "verdict")
+
+def format_header(text):
+    """
+    Return test header.
+    """
+    line = "------------------------------------------------------------------"
+    return line + "\n" + TERMINAL_HEADER + TERMINAL_BOLD + text + \
+        TERMINAL_ENDC + "\n" + line
+
+def format_fail(reason):
+    """
+    Return fail status with reason for failure.
+    """
+    return "Status: " + TERMINAL_TEST_FAIL + "Fail" + TERMINAL_ENDC + "\n" + \
+        "Reason: " + reason
+
+def format_success():
+    """
+    Return success status.
+    """
+    return "Status: " + TERMINAL_TEST_SUCCEEDED + "Success" + TERMINAL_ENDC
+
+def format_info(text):
+    """
+    Return text with info prefix.
+    """
+    return TERMINAL_INFO + "[" + TERMINAL_UNDERLINE + \
+        "INFO" + TERMINAL_ENDC + TERMINAL_INFO + "]" + \
+        TERMINAL_ENDC + " " + text
+
+def format_error(text):
+    """
+    Return text with error prefix.
+    """
+    return TERMINAL_ERROR + "[" + TERMINAL_UNDERLINE + \
+        "ERROR" + TERMINAL_ENDC + TERMINAL_ERROR + "]" + \
+        TERMINAL_ENDC + " " + text
+
 def print_header(text):
     """
-    Print test header.
+    Print header.
     """
-    print "------------------------------------------------------------------"
-    print TERMINAL_HEADER + TERMINAL_BOLD + text + TERMINAL_ENDC
-    print "------------------------------------------------------------------"
+    print format_header(text)
 
 def print_fail(reason):
     """
-    Print fail status with reason for failure.
+    Print fail status with reason for failure, or record it when a test is
+    running.
     """
-    print "Status: " + TERMINAL_TEST_FAIL + "Fail" + TERMINAL_ENDC
-    print "Reason: " + reason
+    if current_record() is not None:
+        finish_test("fail", reason)
+    else:
+        print format_fail(reason)
 
 def print_success():
     """
-    Print success status.
+    Print success status, or record it when a test is running.
     """
-    print "Status: " + TERMINAL_TEST_SUCCEEDED + "Success" + TERMINAL_ENDC
+    if current_record() is not None:
+        finish_test("success")
+    else:
+        print format_success()
 
 def print_info(text):
     """
     Prints text with info prefix.
     """
-    print TERMINAL_INFO + "[" + TERMINAL_UNDERLINE + \
-        "INFO" + TERMINAL_ENDC + TERMINAL_INFO + "]" + \
-        TERMINAL_ENDC + " " + text
+    record = current_record()
+    if record is not None:
+        record["log"].append(format_info(text))
+    else:
+        print format_info(text)
 
 def print_error(text):
     """
     Prints text with error prefix.
     """
-    print TERMINAL_ERROR + "[" + TERMINAL_UNDERLINE + \
-        "ERROR" + TERMINAL_ENDC + TERMINAL_ERROR + "]" + \
-        TERMINAL_ENDC + " " + text
+    record = current_record()
+    if record is not None:
+        record["log"].append(format_error(text))
+    else:
+        print format_error(text)
+
+def start_test(title):
+    """
+    Start the result record of a test run by the current thread.
+    """
+    RESULTS.record = {
+        "title": title,
+        "status": None,
+        "reason": None,
+        "status_code": None,
+        "requests": 0,
+        "latency_ms": 0.0,
+        "start": time.time(),
+        "duration_ms": None,
+        "log": []
+    }
 
-def print_test_summary(failed, succeeded):
+def current_record():
     """
-    Print test summary.
+    Return the result record of the current thread or None.
     """
+    return getattr(RESULTS, "record", None)
+
+def annotate_test(status_code, elapsed):
+    """
+    Add a response to the result record of the current thread.
+    """
+    record = current_record()
+    if record is not None:
+        record["status_code"] = status_code
+        record["requests"] += 1
+        record["latency_ms"] += elapsed * 1000.0
+
+def finish_test(status, reason=None):
+    """
+    Finish the result record of the current thread and pass it to the sink.
+    """
+    record = RESULTS.record
+    RESULTS.record = None
+    record["status"] = status
+    record["reason"] = reason
+    record["duration_ms"] = (time.time() - record["start"]) * 1000.0
+    if status == "fail" and TRACE is not None:
+        record["trace"] = TRACE.dump()
+    SINK.add(record)
+
+class ResultSink(object):
+    """
+    Collects test records and writes them in batches.
+    """
+    def __init__(self, batch_size=DEFAULT_SINK_BATCH, \
+        interval=DEFAULT_SINK_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.buffer = []
+        self.flushed = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        """
+        Buffer record, write the buffer when it is full or old.
+        """
+        with self.lock:
+            self.buffer.append(record)
+            if len(self.buffer) < self.batch_size and \
+                time.time() - self.flushed < self.interval:
+                return
+            self.write(self.buffer)
+            self.buffer = []
+            self.flushed = time.time()
+
+    def flush(self):
+        """
+        Write buffered records.
+        """
+        with self.lock:
+            if self.buffer:
+                self.write(self.buffer)
+                self.buffer = []
+            self.flushed = time.time()
+
+    def close(self):
+        """
+        Write buffered records and release the output.
+        """
+        self.flush()
+
+    def write(self, records):
+        """
+        Write records to the output.
+        """
+        raise NotImplementedError
+
+class TerminalSink(ResultSink):
+    """
+    Writes records as colored text to stdout.
+    """
+    def write(self, records):
+        lines = []
+        for record in records:
+            lines.append(format_header(record["title"]))
+            lines.extend(record["log"])
+            if record["status"] == "success":
+                lines.append(format_success())
+            else:
+                lines.append(format_fail(record["reason"]))
+                lines.extend(record.get("trace", ()))
+        lines.append("")
+        sys.stdout.write("\n".join(lines))
+        sys.stdout.flush()
+
+class JSONLinesSink(ResultSink):
+    """
+    Writes records as one JSON object per line, '-' is stdout.
+    """
+    def __init__(self, path, **kwargs):
+        ResultSink.__init__(self, **kwargs)
+        self.path = path
+        self.stream = sys.stdout if path == "-" else open(path, "w")
+
+    def write(self, records):
+        lines = []
+        for record in records:
+            lines.append(json.dumps(collections.OrderedDict((field, \
+                record[field]) \
+                for field in RESULT_FIELDS if field in record)))
+        lines.append("")
+        self.stream.write("\n".join(lines))
+        self.stream.flush()
+
+    def close(self):
+        ResultSink.close(self)
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+class JUnitSink(ResultSink):
+    """
+    Writes records as a JUnit XML test suite when closed.
+    """
+    def __init__(self, path, name="node-challenge", **kwargs):
+        ResultSink.__init__(self, **kwargs)
+        self.path = path
+        self.name = name
+        self.cases = []
+        self.failures = 0
+        self.time = 0.0
+
+    def write(self, records):
+        for record in records:
+            seconds = record["duration_ms"] / 1000.0
+            self.time += seconds
+            case = "  <testcase classname=%s name=%s time=\"%.6f\"" % \
+                (xml.sax.saxutils.quoteattr(record.get("endpoint", \
+                self.name)), xml.sax.saxutils.quoteattr(record["title"]), \
+                seconds)
+            if record["status"] == "success":
+                self.cases.append(case + "/>")
+                continue
+            self.failures += 1
+            reason = record["reason"]
+            if record["status_code"] is not None:
+                reason += " (status code %d)" % (record["status_code"])
+            trace = "\n".join(record.get("trace", ()))
+            self.cases.append(case + ">\n    <failure message=%s>%s" % \
+                (xml.sax.saxutils.quoteattr(reason), \
+                xml.sax.saxutils.escape(trace)) + "</failure>\n  </testcase>")
+
+    def close(self):
+        ResultSink.close(self)
+        with open(self.path, "w") as output:
+            output.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n")
+            output.write("<testsuite name=%s tests=\"%d\" failures=\"%d\" " % \
+                (xml.sax.saxutils.quoteattr(self.name), len(self.cases), \
+                self.failures) + "errors=\"0\" time=\"%.6f\">\n" % (self.time))
+            for case in self.cases:
+                output.write(case + "\n")
+            output.write("</testsuite>\n")
+
+class MultiSink(object):
+    """
+    Passes records to several sinks.
+    """
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def add(self, record, terminal=True):
+        """
+        Pass record on, without terminal sinks it is only kept in files.
+        """
+        for sink in self.sinks:
+            if terminal or not isinstance(sink, TerminalSink):
+                sink.add(record)
+
+    def flush(self):
+        """
+        Flush every sink.
+        """
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        """
+        Close every sink.
+        """
+        for sink in self.sinks:
+            sink.close()
+
+class ListSink(ResultSink):
+    """
+    Keeps records in memory.
+    """
+    def __init__(self, **kwargs):
+        ResultSink.__init__(self, **kwargs)
+        self.records = []
+
+    def write(self, records):
+        self.records.extend(records)
+
+RESULTS = threading.local()
+SINK = MultiSink([TerminalSink()])
+
+def configure_sink(quiet=False, jsonl=None, junit=None):
+    """
+    Replace the shared result sink. Quiet drops the terminal output.
+    """
+    global SINK
+    sinks = []
+    if not quiet:
+        sinks.append(TerminalSink())
+    if jsonl is not None:
+        sinks.append(JSONLinesSink(jsonl))
+    if junit is not None:
+        sinks.append(JUnitSink(junit))
+    SINK = MultiSink(sinks)
+    return SINK
+
+def print_test_summary(failed, succeeded, connections=None):
+    """
+    Print test summary. Connections are (opened, reused) counts, by default
+    those of the shared transport.
+    """
+    SINK.flush()
     print "------------------------------------------------------------------"
     print TERMINAL_BOLD + TERMINAL_TEST_FAIL + "Failed: " + str(failed) + \
         TERMINAL_TEST_SUCCEEDED + " Succeeded: " + str(succeeded) + \
         TERMINAL_ENDC
+    if connections is None and TRANSPORT is not None:
+        connections = TRANSPORT.connection_stats()
+    if connections is not None:
+        print "Connections opened: %d reused: %d" % connections
+    if STREAM_STATS.bytes:
+        print "Streamed: %.2f MB Parse throughput: %.2f MB/s" % \
+            (STREAM_STATS.bytes / 1000000.0, STREAM_STATS.throughput())
+    print_latency_summary(LATENCY)
+    print_cache_summary(CACHE)
     print "------------------------------------------------------------------"
 
-def run_request(base_url, url, method="GET", data=None, verbose=False):
+def print_latency_summary(recorder):
+    """
+    Print latency percentiles and throughput for every route.
+    """
+    histograms = recorder.snapshot()
+    if not histograms:
+        return
+    print "%-26s %8s %9s %8s %8s %8s %8s %8s" % ("Route", "Count", \
+        "Req/s", "p50 ms", "p90 ms", "p99 ms", "p99.9 ms", "max ms")
+    for key in sorted(histograms.keys()):
+        histogram = histograms[key]
+        values = [histogram.percentile(p) * 1000.0 \
+            for p in LATENCY_PERCENTILES]
+        print "%-26s %8d %9.1f %8.2f %8.2f %8.2f %8.2f %8.2f" % \
+            tuple([key, histogram.count, histogram.throughput()] + values + \
+            [histogram.max * 1000.0])
+
+class LatencyHistogram(object):
+    """
+    Log bucketed latency histogram that can be merged with others.
+    """
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.start = None
+        self.end = None
+
+    def record(self, seconds, end=None):
+        """
+        Record one latency in seconds of a request completed at end.
+        """
+        if end is None:
+            end = time.time()
+        micros = max(seconds * 1000000.0, 1.0)
+        index = int(math.log(micros, 2) * HISTOGRAM_BUCKETS_PER_DOUBLING)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if self.start is None or end - seconds < self.start:
+            self.start = end - seconds
+        if self.end is None or end > self.end:
+            self.end = end
+
+    def merge(self, other):
+        """
+        Add counts of other histogram into this one.
+        """
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        if other.start is not None and \
+            (self.start is None or other.start < self.start):
+            self.start = other.start
+        if other.end is not None and \
+            (self.end is None or other.end > self.end):
+            self.end = other.end
+
+    def percentile(self, percent):
+        """
+        Return latency in seconds at percentile, bounded by the maximum.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = max(int(math.ceil(percent / 100.0 * self.count)), 1)
+        seen = 0
+        for index in sorted(self.buckets.keys()):
+            seen += self.buckets[index]
+            if seen >= rank:
+                upper = 2.0 ** (float(index + 1) / \
+                    HISTOGRAM_BUCKETS_PER_DOUBLING) / 1000000.0
+                return min(upper, self.max)
+        return self.max
+
+    def since(self, earlier):
+        """
+        Return histogram of the latencies recorded after earlier, a copy of
+        this histogram, was taken. The maximum is bucket precise.
+        """
+        interval = LatencyHistogram()
+        for index, count in self.buckets.items():
+            count -= earlier.buckets.get(index, 0)
+            if count > 0:
+                interval.buckets[index] = count
+                interval.count += count
+        interval.total = self.total - earlier.total
+        if interval.buckets:
+            interval.max = min(2.0 ** (float(max(interval.buckets) + 1) / \
+                HISTOGRAM_BUCKETS_PER_DOUBLING) / 1000000.0, self.max)
+        return interval
+
+    def throughput(self):
+        """
+        Return requests per second between first start and last completion.
+        """
+        if self.start is None or self.end <= self.start:
+            return 0.0
+        return self.count / (self.end - self.start)
+
+class LatencyRecorder(object):
+    """
+    Thread safe latency histograms keyed by method and route template.
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, method, url, seconds):
+        """
+        Record latency of a request to url.
+        """
+        key = method + " " + route_template(url)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def merge(self, other):
+        """
+        Merge histograms of another recorder or snapshot dict.
+        """
+        if isinstance(other, LatencyRecorder):
+            other = other.snapshot()
+        with self.lock:
+            for key, histogram in other.items():
+                self.histograms.setdefault(key, \
+                    LatencyHistogram()).merge(histogram)
+
+    def reset(self):
+        """
+        Drop all histograms.
+        """
+        with self.lock:
+            self.histograms = {}
+
+    def snapshot(self):
+        """
+        Return copy of histograms keyed by method and route.
+        """
+        copy = {}
+        with self.lock:
+            for key, histogram in self.histograms.items():
+                copy[key] = LatencyHistogram()
+                copy[key].merge(histogram)
+        return copy
+
+# Latency of every request sent through run_request
+LATENCY = LatencyRecorder()
+
+class Transport(object):
+    """
+    Pooled keep-alive HTTP transport shared by all requests.
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, \
+            pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if REFERENCE is not None:
+            self.session.mount(REFERENCE_URL, ReferenceAdapter(REFERENCE))
+        self.adapter = adapter
+        self.methods = {
+            "GET": self.session.get,
+            "HEAD": self.session.head,
+            "OPTIONS": self.session.options,
+            "POST": self.session.post,
+            "PUT": self.session.put,
+            "PATCH": self.session.patch,
+            "DELETE": self.session.delete
+        }
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def request(self, method, url, data=None, timeout=None, stream=False, \
+        headers=None):
+        """
+        Send request over a pooled connection and return the response.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        with self.lock:
+            self.requests += 1
+        return self.methods[method](url, data=data, timeout=timeout, \
+            stream=stream, headers=headers)
+
+    def connection_stats(self):
+        """
+        Return (opened, reused) connection counts.
+        """
+        pools = self.adapter.poolmanager.pools
+        opened = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+        return (opened, max(self.requests - opened, 0))
+
+# Shared transport, created on first request
+TRANSPORT = None
+
+def configure_transport(pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, \
+    engine="pool", connections=DEFAULT_ENGINE_CONNECTIONS):
+    """
+    Replace shared transport with a new pooled or async one.
+    """
+    global TRANSPORT
+    if engine == "async":
+        TRANSPORT = PrefetchTransport(AsyncEngine(connections=connections, \
+            timeout=timeout))
+    else:
+        TRANSPORT = Transport(pool_size=pool_size, timeout=timeout)
+    return TRANSPORT
+
+def get_transport():
+    """
+    Return shared transport, creating it with defaults if needed.
+    """
+    if TRANSPORT is None:
+        configure_transport()
+    return TRANSPORT
+
+class CacheStats(object):
+    """
+    Conditional GET outcomes of one route.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.changed = 0
+        self.saved = 0
+        self.received = 0
+        self.hit_latency = LatencyHistogram()
+        self.miss_latency = LatencyHistogram()
+
+class ResponseCache(object):
+    """
+    LRU cache of GET responses keyed by URL. Cached responses are
+    revalidated with If-None-Match and served again on 304.
+    """
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.routes = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, url):
+        """
+        Return cached response of url or None.
+        """
+        with self.lock:
+            return self.entries.get(url)
+
+    def store(self, url, response):
+        """
+        Keep response of url as most recently used, evicting the least
+        recently used entries above size.
+        """
+        with self.lock:
+            self.entries.pop(url, None)
+            self.entries[url] = response
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, url, cached, response, elapsed):
+        """
+        Account response to a GET of url sent with the ETag of cached, if
+        any, and return the response to use, the cached one on 304.
+        """
+        key = route_template(url)
+        with self.lock:
+            stats = self.routes.get(key)
+            if stats is None:
+                stats = self.routes[key] = CacheStats()
+        if cached is not None and response.status_code == 304:
+            headers = requests.structures.CaseInsensitiveDict(cached.headers)
+            for name, value in response.headers.items():
+                if name.lower() not in CACHE_ENTITY_HEADERS:
+                    headers[name] = value
+            hit = EngineResponse(cached.status_code, cached.reason, headers, \
+                cached.content)
+            self.store(url, hit)
+            with self.lock:
+                stats.hits += 1
+                stats.saved += len(cached.content)
+                stats.hit_latency.record(elapsed)
+            hit.elapsed = elapsed
+            return hit
+        content = response.content
+        with self.lock:
+            stats.misses += 1
+            if cached is not None:
+                stats.changed += 1
+            stats.received += len(content)
+            stats.miss_latency.record(elapsed)
+        if response.status_code == 200 and "ETag" in response.headers:
+            self.store(url, EngineResponse(response.status_code, \
+                response.reason, requests.structures.CaseInsensitiveDict( \
+                response.headers), content))
+        elif cached is not None:
+            with self.lock:
+                self.entries.pop(url, None)
+        return response
+
+    def snapshot(self):
+        """
+        Return route stats and (entries, evictions) counts.
+        """
+        with self.lock:
+            return dict(self.routes), (len(self.entries), self.evictions)
+
+# Conditional GET cache of run_request, None when caching is off
+CACHE = None
+
+def configure_cache(size=None):
+    """
+    Cache up to size GET responses, None turns caching off.
+    """
+    global CACHE
+    CACHE = None if size is None else ResponseCache(size)
+    return CACHE
+
+def print_cache_summary(cache):
+    """
+    Print hits, misses, bytes saved and latency of revalidated and full
+    GET responses by route.
+    """
+    if cache is None:
+        return
+    routes, (entries, evictions) = cache.snapshot()
+    if not routes:
+        return
+    print "Response cache entries: %d evictions: %d" % (entries, evictions)
+    print "%-26s %7s %7s %7s %6s %10s %10s %9s %9s" % ("Route", "Hits", \
+        "Misses", "Changed", "Hit %", "Saved KB", "Recv KB", "Hit p50", \
+        "Miss p50")
+    for key in sorted(routes.keys()):
+        stats = routes[key]
+        total = stats.hits + stats.misses
+        print "%-26s %7d %7d %7d %6.1f %10.1f %10.1f %9.2f %9.2f" % (key, \
+            stats.hits, stats.misses, stats.changed, \
+            100.0 * stats.hits / total if total else 0.0, \
+            stats.saved / 1000.0, stats.received / 1000.0, \
+            stats.hit_latency.percentile(50.0) * 1000.0, \
+            stats.miss_latency.percentile(50.0) * 1000.0)
+
+class TraceBuffer(object):
+    """
+    Keeps the last request/response exchanges in a ring buffer with bodies
+    truncated to a byte limit. Exchanges are formatted only when dumped.
+    """
+    def __init__(self, size=DEFAULT_TRACE_SIZE, limit=DEFAULT_TRACE_BYTES):
+        self.entries = collections.deque(maxlen=size)
+        self.limit = limit
+        self.sequence = 0
+        self.dumped = 0
+        self.lock = threading.Lock()
+
+    def truncate(self, body):
+        """
+        Return (head, size) of body, the head at most limit bytes long.
+        """
+        if body is None:
+            return None
+        return (body[:self.limit], len(body))
+
+    def record(self, method, url, data=None, response=None, elapsed=None, \
+        error=None, stream=False):
+        """
+        Keep exchange, dropping the oldest one when the buffer is full.
+        """
+        status_code = None
+        headers = None
+        body = None
+        if response is not None:
+            status_code = response.status_code
+            headers = response.headers
+            if not stream:
+                body = self.truncate(response.content)
+        with self.lock:
+            self.sequence += 1
+            self.entries.append((self.sequence, \
+                threading.current_thread().name, method, url, \
+                self.truncate(data), status_code, headers, body, stream, \
+                elapsed, error))
+
+    def format_body(self, body):
+        """
+        Return truncated body as text.
+        """
+        head, size = body
+        if size > len(head):
+            return "%s... (%d bytes)" % (head, size)
+        return head
+
+    def format_entry(self, entry):
+        """
+        Return lines describing one exchange.
+        """
+        sequence, thread, method, url, data, status_code, headers, body, \
+            stream, elapsed, error = entry
+        lines = ["Trace #%d %s %s %s" % (sequence, thread, method, url)]
+        if data is not None:
+            lines.append("  Request body=%s" % (self.format_body(data)))
+        if error is not None:
+            lines.append("  Error: %s" % (error))
+            return lines
+        lines.append("  Response code=%d time=%.2f ms" % \
+            (status_code, elapsed * 1000.0))
+        lines.append("  Response headers=%s" % (headers))
+        if stream:
+            lines.append("  Response body=<streamed>")
+        else:
+            lines.append("  Response body=%s" % (self.format_body(body)))
+        return lines
+
+    def dump(self):
+        """
+        Return lines of the exchanges kept since the previous dump.
+        """
+        with self.lock:
+            entries = [entry for entry in self.entries \
+                if entry[0] > self.dumped]
+            self.dumped = self.sequence
+        lines = []
+        for entry in entries:
+            lines.extend(self.format_entry(entry))
+        return lines
+
+TRACE = None
+
+def configure_trace(size=None, limit=DEFAULT_TRACE_BYTES):
+    """
+    Keep the last size exchanges for dumps on failure, None turns tracing
+    off.
+    """
+    global TRACE
+    TRACE = None if size is None else TraceBuffer(size, limit)
+    return TRACE
+
+def body_hash(content):
+    """
+    Return hash of response body. Ids are left out of JSON bodies, they
+    differ between servers that received the same requests.
+    """
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return "%08x" % (binascii.crc32(content) & 0xffffffff)
+    if isinstance(body, dict):
+        body.pop("id", None)
+    elif isinstance(body, list):
+        for task in body:
+            if isinstance(task, dict):
+                task.pop("id", None)
+    content = json.dumps(body, sort_keys=True, separators=(",", ":"))
+    return "%08x" % (binascii.crc32(content) & 0xffffffff)
+
+class TrafficRecorder(object):
+    """
+    Appends exchanges to a trace file as JSON lines. Lines are written in
+    batches with single appends so processes can share the file.
+    """
+    def __init__(self, path, batch_size=RECORD_BATCH):
+        self.output = open(path, "a", 0)
+        self.batch_size = batch_size
+        self.buffer = []
+        self.lanes = {}
+        self.lock = threading.Lock()
+
+    def record(self, method, url, data=None, response=None, elapsed=None, \
+        error=None, stream=False):
+        """
+        Buffer exchange, the lane identifies the thread that sent it.
+        """
+        parsed = urlparse.urlparse(url)
+        path = parsed.path
+        if parsed.query:
+            path += "?" + parsed.query
+        entry = collections.OrderedDict()
+        entry["t"] = round(time.time() - (elapsed or 0.0), 6)
+        entry["method"] = method
+        entry["template"] = route_template(url)
+        entry["url"] = path
+        entry["body"] = data
+        entry["status"] = None
+        entry["ms"] = None
+        entry["hash"] = None
+        if response is not None:
+            entry["status"] = response.status_code
+            entry["ms"] = round(elapsed * 1000.0, 3)
+            if not stream:
+                entry["hash"] = body_hash(response.content)
+                if method == "POST" and response.status_code == 200:
+                    try:
+                        entry["id"] = response.json()["id"]
+                    except (ValueError, KeyError, TypeError):
+                        pass
+        thread = threading.current_thread().name
+        with self.lock:
+            lane = self.lanes.setdefault(thread, len(self.lanes))
+            entry["lane"] = "%d.%d" % (os.getpid(), lane)
+            self.buffer.append(json.dumps(entry, separators=(",", ":")))
+            if len(self.buffer) >= self.batch_size:
+                self.write()
+
+    def write(self):
+        """
+        Append buffered lines, the lock must be held.
+        """
+        if self.buffer:
+            self.output.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+
+    def flush(self):
+        """
+        Append buffered lines.
+        """
+        with self.lock:
+            self.write()
+
+    def close(self):
+        """
+        Append buffered lines and close the file.
+        """
+        with self.lock:
+            self.write()
+            self.output.close()
+
+RECORDER = None
+
+def configure_recorder(path=None):
+    """
+    Record exchanges to the trace file at path, None turns recording off.
+    """
+    global RECORDER
+    RECORDER = None if path is None else TrafficRecorder(path)
+    return RECORDER
+
+def trace_exchange(method, url, data=None, response=None, elapsed=None, \
+    error=None, stream=False):
+    """
+    Pass exchange to the trace buffer and the recorder when they are on.
+    """
+    if TRACE is not None:
+        TRACE.record(method, url, data, response, elapsed, error, stream)
+    if RECORDER is not None:
+        RECORDER.record(method, url, data, response, elapsed, error, stream)
+
+def dump_trace(reason):
+    """
+    Print reason and the traced exchanges that led to it.
+    """
+    if TRACE is None:
+        return
+    lines = TRACE.dump()
+    if lines:
+        sys.stdout.write("\n".join([format_error(reason)] + lines) + "\n")
+
+def run_request(base_url, url, method="GET", data=None, verbose=False, \
+    timeout=None, stream=False, headers=None):
     """
-    Run HTTP request and return the result.
+    Run HTTP request with extra headers and return the result. With stream
+    the body is left unread for iter_content.
     """
-    if method not in ("GET", "HEAD", "OPTIONS", "POST", "PUT", "PATCH", \
-        "DELETE"):
+    if method not in HTTP_METHODS:
         if verbose:
             print_error("Unknown method")
         return None
     full_url = urlparse.urljoin(base_url, url)
+    cacheable = CACHE is not None and method == "GET" and not stream
+    cached = CACHE.lookup(full_url) if cacheable else None
+    if cached is not None:
+        headers = dict(headers or {})
+        headers["If-None-Match"] = cached.headers["ETag"]
     if verbose:
         print_info("Request url=%s" % (full_url))
         print_info("Request method=%s" % (method))
+        if headers:
+            print_info("Request headers=%s" % (headers))
         if data is not None:
             print_info("Request body=%s" % (data))
     try:
-        response = None
-        if method == "DELETE":
-            response = requests.delete(full_url, data=data)
-        elif method == "HEAD":
-            response = requests.head(full_url, data=data)
-        elif method == "OPTIONS":
-            response = requests.options(full_url, data=data)
-        elif method == "POST":
-            response = requests.post(full_url, data=data)
-        elif method == "PUT":
-            response = requests.put(full_url, data=data)
-        elif method == "PATCH":
-            response = requests.patch(full_url, data=data)
-        else:
-            response = requests.get(full_url, data=data)
+        start = time.time()
+        response = get_transport().request(method, full_url, data=data, \
+            timeout=timeout, stream=stream, headers=headers)
+        elapsed = time.time() - start
+        if isinstance(response, EngineResponse) and \
+            response.elapsed is not None:
+            elapsed = response.elapsed
+        if cacheable:
+            if verbose and cached is not None and \
+                response.status_code == 304:
+                print_info("Response not modified, served from cache")
+            response = CACHE.update(full_url, cached, response, elapsed)
+        LATENCY.record(method, full_url, elapsed)
+        annotate_test(response.status_code, elapsed)
+        trace_exchange(method, full_url, data, response, elapsed, \
+            stream=stream)
         if verbose:
             print_info("Response code=%d" % (response.status_code))
-            print_info("Response body=%s" % (response.content))
+            if stream:
+                print_info("Response body=<streamed>")
+            else:
+                print_info("Response body=%s" % (response.content))
             print_info("Response headers=%s" % (response.headers))
         return response
     except requests.exceptions.ConnectionError:
+        trace_exchange(method, full_url, data, error="Network problem occurred")
         if verbose:
             print_error("Network problem occurred")
         return None
     except requests.exceptions.HTTPError:
+        trace_exchange(method, full_url, data, error="Invalid HTTP response")
         if verbose:
             print_error("Invalid HTTP response")
         return None
     except requests.exceptions.URLRequired:
+        trace_exchange(method, full_url, data, error="Invalid request URL")
         if verbose:
             print_error("Invalid request URL")
         return None
     except requests.exceptions.TooManyRedirects:
+        trace_exchange(method, full_url, data, error="Too many redirects")
         if verbose:
             print_error("Too many redirects")
         return None
     except requests.exceptions.Timeout:
+        trace_exchange(method, full_url, data, error="Connection timed out")
         if verbose:
             print_error("Connection timed out")
         return None
     except requests.exceptions.MissingSchema:
+        trace_exchange(method, full_url, data, error="Invalid request URL")
         if verbose:
             print_error("Invalid request URL")
         return None
 
+class EngineResponse(object):
+    """
+    Response returned by the async engine, shaped like requests.Response.
+    """
+    def __init__(self, status_code, reason, headers, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.elapsed = None
+
+    def json(self):
+        """
+        Return response body decoded from JSON.
+        """
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        """
+        Iterate over body in chunks.
+        """
+        for start in xrange(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+class HTTPResponseParser(object):
+    """
+    Incremental parser for a stream of HTTP/1.1 responses.
+    """
+    def __init__(self):
+        self.methods = collections.deque()
+        self.buffer = ""
+        self.reset()
+
+    def reset(self):
+        """
+        Prepare for the next response head.
+        """
+        self.state = "head"
+        self.status = None
+        self.headers = None
+        self.body = []
+        self.remaining = 0
+
+    def expect(self, method):
+        """
+        Register method of the next request sent on this stream.
+        """
+        self.methods.append(method)
+
+    def start(self, head):
+        """
+        Parse response head and pick the body framing.
+        """
+        lines = head.split("\r\n")
+        parts = lines[0].split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise ValueError("Invalid status line %r" % (lines[0]))
+        self.status = (int(parts[1]), parts[2] if len(parts) > 2 else "")
+        self.headers = requests.structures.CaseInsensitiveDict()
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            self.headers[name.strip()] = value.strip()
+        method = self.methods[0] if self.methods else "GET"
+        code = self.status[0]
+        if method == "HEAD" or code in (204, 304) or 100 <= code < 200:
+            self.state = "done"
+        elif "chunked" in self.headers.get("transfer-encoding", "").lower():
+            self.state = "chunk_size"
+        elif "content-length" in self.headers:
+            self.remaining = int(self.headers["content-length"])
+            self.state = "length" if self.remaining > 0 else "done"
+        else:
+            self.state = "close"
+
+    def finish(self):
+        """
+        Return completed response and reset for the next one.
+        """
+        if self.methods:
+            self.methods.popleft()
+        response = EngineResponse(self.status[0], self.status[1], \
+            self.headers, "".join(self.body))
+        self.reset()
+        return response
+
+    def take(self):
+        """
+        Move up to remaining bytes from buffer into body.
+        """
+        chunk = self.buffer[:self.remaining]
+        self.buffer = self.buffer[len(chunk):]
+        self.body.append(chunk)
+        self.remaining -= len(chunk)
+
+    def feed(self, data):
+        """
+        Feed received bytes and return list of completed responses.
+        """
+        self.buffer += data
+        done = []
+        while True:
+            if self.state == "head":
+                end = self.buffer.find("\r\n\r\n")
+                if end < 0:
+                    break
+                head = self.buffer[:end]
+                self.buffer = self.buffer[end + 4:]
+                self.start(head)
+            elif self.state == "done":
+                done.append(self.finish())
+            elif self.state == "length":
+                self.take()
+                if self.remaining > 0:
+                    break
+                self.state = "done"
+            elif self.state == "chunk_size":
+                end = self.buffer.find("\r\n")
+                if end < 0:
+                    break
+                self.remaining = int(self.buffer[:end].split(";")[0], 16)
+                self.buffer = self.buffer[end + 2:]
+                self.state = "chunk_data" if self.remaining > 0 else "trailer"
+            elif self.state == "chunk_data":
+                self.take()
+                if self.remaining > 0:
+                    break
+                self.state = "chunk_end"
+            elif self.state == "chunk_end":
+                if len(self.buffer) < 2:
+                    break
+                self.buffer = self.buffer[2:]
+                self.state = "chunk_size"
+            elif self.state == "trailer":
+                end = self.buffer.find("\r\n")
+                if end < 0:
+                    break
+                line = self.buffer[:end]
+                self.buffer = self.buffer[end + 2:]
+                if line == "":
+                    self.state = "done"
+            else:
+                self.body.append(self.buffer)
+                self.buffer = ""
+                break
+        return done
+
+    def eof(self):
+        """
+        Handle end of stream and return response delimited by it, if any.
+        """
+        if self.state == "close":
+            return [self.finish()]
+        return []
+
+    def idle(self):
+        """
+        Return True when no response is partially received.
+        """
+        return self.state == "head" and self.buffer == ""
+
+def build_request(method, path, host, data=None, headers=None):
+    """
+    Serialize HTTP/1.1 request with keep-alive and extra headers.
+    """
+    if data is None:
+        data = ""
+    elif isinstance(data, unicode):
+        data = data.encode("utf-8")
+    lines = [
+        "%s %s HTTP/1.1" % (method, path),
+        "Host: %s" % (host),
+        "Accept-Encoding: identity",
+        "Connection: keep-alive"
+    ]
+    for name, value in (headers or {}).items():
+        lines.append("%s: %s" % (name, value))
+    if data or method in ("POST", "PUT", "PATCH"):
+        lines.append("Content-Length: %d" % (len(data)))
+    return "\r\n".join(lines) + "\r\n\r\n" + data
+
+class EngineRequest(object):
+    """
+    Request queued in the async engine.
+    """
+    def __init__(self, method, url, data, callback, timeout, headers=None):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise requests.exceptions.URLRequired("Invalid request URL")
+        self.method = method
+        self.address = (parts.hostname, parts.port or 80)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        self.payload = build_request(method, path, parts.netloc, data, \
+            headers)
+        self.callback = callback
+        self.timeout = timeout
+        self.started = None
+        self.retried = False
+
+class EngineConnection(asyncore.dispatcher):
+    """
+    Non-blocking keep-alive connection driven by the async engine.
+    """
+    def __init__(self, engine, address):
+        asyncore.dispatcher.__init__(self, map=engine.map)
+        self.engine = engine
+        self.address = address
+        self.parser = HTTPResponseParser()
+        self.out = ""
+        self.current = None
+        self.used = 0
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connect(engine.resolve(address))
+
+    def send_request(self, request):
+        """
+        Start sending request on this connection.
+        """
+        self.current = request
+        self.used += 1
+        request.started = time.time()
+        self.parser.expect(request.method)
+        self.out = request.payload
+
+    def writable(self):
+        return self.connecting or bool(self.out)
+
+    def readable(self):
+        return True
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        sent = self.send(self.out)
+        self.out = self.out[sent:]
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        try:
+            responses = self.parser.feed(data)
+        except ValueError:
+            self.fail(requests.exceptions.HTTPError("Invalid HTTP response"))
+            return
+        for response in responses:
+            self.complete(response)
+
+    def complete(self, response):
+        """
+        Deliver response and return connection to the idle pool.
+        """
+        request = self.current
+        self.current = None
+        keep = response.headers.get("connection", "").lower() != "close"
+        if keep:
+            self.engine.release(self)
+        else:
+            self.engine.discard(self)
+        if request is not None:
+            self.engine.deliver(request, response, None)
+
+    def handle_close(self):
+        for response in self.parser.eof():
+            self.complete(response)
+        request = self.current
+        self.current = None
+        self.engine.discard(self)
+        if request is None:
+            return
+        if self.used > 1 and self.parser.idle() and not request.retried:
+            # Server closed a stale keep-alive connection, send again
+            request.retried = True
+            self.engine.queue.appendleft(request)
+        else:
+            self.engine.deliver(request, None, \
+                requests.exceptions.ConnectionError( \
+                "Network problem occurred"))
+
+    def handle_error(self):
+        self.fail(requests.exceptions.ConnectionError( \
+            "Network problem occurred"))
+
+    def fail(self, error):
+        """
+        Close connection and fail the request in flight.
+        """
+        request = self.current
+        self.current = None
+        self.engine.discard(self)
+        if request is not None:
+            self.engine.deliver(request, None, error)
+
+class AsyncEngine(object):
+    """
+    Single threaded request engine multiplexing many keep-alive sockets.
+    """
+    def __init__(self, connections=DEFAULT_ENGINE_CONNECTIONS, \
+        timeout=DEFAULT_TIMEOUT):
+        self.connections = connections
+        self.timeout = timeout
+        self.map = {}
+        self.queue = collections.deque()
+        self.idle = {}
+        self.busy = set()
+        self.addresses = {}
+        self.opened = 0
+        self.reused = 0
+        raise_file_limit(connections + 64)
+
+    def resolve(self, address):
+        """
+        Return cached numeric address for host and port.
+        """
+        if address not in self.addresses:
+            info = socket.getaddrinfo(address[0], address[1], \
+                socket.AF_INET, socket.SOCK_STREAM)
+            self.addresses[address] = info[0][4]
+        return self.addresses[address]
+
+    def submit(self, method, url, data=None, callback=None, timeout=None, \
+        headers=None):
+        """
+        Queue request, callback(response, error) is called on completion.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        self.queue.append(EngineRequest(method, url, data, callback, timeout, \
+            headers))
+
+    def release(self, connection):
+        """
+        Return connection to the idle pool.
+        """
+        self.busy.discard(connection)
+        self.idle.setdefault(connection.address, []).append(connection)
+
+    def discard(self, connection):
+        """
+        Close connection and forget it.
+        """
+        self.busy.discard(connection)
+        idle = self.idle.get(connection.address)
+        if idle is not None and connection in idle:
+            idle.remove(connection)
+        connection.close()
+
+    def deliver(self, request, response, error):
+        """
+        Hand result to request callback.
+        """
+        if response is not None:
+            response.elapsed = time.time() - request.started
+        if request.callback is not None:
+            request.callback(response, error)
+
+    def dispatch(self):
+        """
+        Assign queued requests to idle or new connections.
+        """
+        while self.queue:
+            request = self.queue[0]
+            idle = self.idle.get(request.address)
+            if idle:
+                connection = idle.pop()
+                self.reused += 1
+            elif len(self.map) < self.connections:
+                try:
+                    connection = EngineConnection(self, request.address)
+                except (socket.error, socket.gaierror):
+                    self.queue.popleft()
+                    self.deliver(request, None, \
+                        requests.exceptions.ConnectionError( \
+                        "Network problem occurred"))
+                    continue
+                self.opened += 1
+            else:
+                return
+            self.queue.popleft()
+            self.busy.add(connection)
+            connection.send_request(request)
+
+    def expire(self):
+        """
+        Fail requests that ran longer than their timeout.
+        """
+        now = time.time()
+        for connection in list(self.busy):
+            request = connection.current
+            if request is not None and request.timeout is not None and \
+                now - request.started > request.timeout:
+                connection.fail(requests.exceptions.Timeout( \
+                    "Connection timed out"))
+
+    def step(self, timeout=0.05):
+        """
+        Dispatch queued requests and wait up to timeout seconds for socket
+        events.
+        """
+        self.dispatch()
+        if self.map:
+            asyncore.loop(timeout=timeout, use_poll=True, map=self.map, \
+                count=1)
+        elif timeout > 0:
+            time.sleep(timeout)
+        self.expire()
+
+    def run(self):
+        """
+        Run event loop until all submitted requests completed.
+        """
+        while self.queue or self.busy:
+            self.step()
+
+    def request(self, method, url, data=None, timeout=None, stream=False, \
+        headers=None):
+        """
+        Send single request and wait for its response. Bodies are always
+        read in full, stream is accepted for compatibility.
+        """
+        result = []
+        def callback(response, error):
+            result.append((response, error))
+        self.submit(method, url, data=data, callback=callback, \
+            timeout=timeout, headers=headers)
+        self.run()
+        response, error = result[0]
+        if error is not None:
+            raise error
+        return response
+
+    def connection_stats(self):
+        """
+        Return (opened, reused) connection counts.
+        """
+        return (self.opened, self.reused)
+
+def raise_file_limit(needed):
+    """
+    Raise soft open file limit so the engine can hold many sockets.
+    """
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        if hard != resource.RLIM_INFINITY:
+            needed = min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
 def verify_allow(value, expected):
     """
     Verify Allow header methods.
@@ -150,16 +1756,46 @@ def verify_allow(value, expected):
             return False
     return True
 
+def parse_deadline(value):
+    """
+    Return deadline as seconds since epoch. The strict API format
+    YYYY-MM-DDTHH:MM:SS+HH:MM is parsed directly, anything else with
+    dateutil. Results are cached.
+    """
+    epoch = DEADLINE_CACHE.get(value)
+    if epoch is not None:
+        return epoch
+    match = DEADLINE_PATTERN.match(value)
+    if match is not None:
+        year, month, day, hour, minute, second, sign, off_hour, off_minute = \
+            match.groups()
+        offset = int(off_hour) * 3600 + int(off_minute) * 60
+        epoch = calendar.timegm((int(year), int(month), int(day), \
+            int(hour), int(minute), int(second))) - \
+            (offset if sign == "+" else -offset)
+    else:
+        date = dateutil.parser.parse(value)
+        if date.utcoffset() is not None:
+            date = date - date.utcoffset()
+        epoch = calendar.timegm(date.timetuple()) + \
+            date.microsecond / 1000000.0
+    if len(DEADLINE_CACHE) >= DEADLINE_CACHE_SIZE:
+        DEADLINE_CACHE.clear()
+    DEADLINE_CACHE[value] = epoch
+    return epoch
+
 def verify_order(tasks):
     """
-    Verify tasks array order.
+    Verify tasks array order, latest deadline first.
     """
     if len(tasks) < 2:
         return True
-    for i, task in enumerate(tasks[1:]):
-        previous_date = dateutil.parser.parse(tasks[i-1]["deadline"])
-        current_date = dateutil.parser.parse(task["deadline"])
-        if previous_date < current_date:
+    deadlines = [parse_deadline(task["deadline"]) for task in tasks]
+    if len(deadlines) >= NUMPY_MIN_TASKS and numpy.available():
+        deadlines = numpy.array(deadlines, dtype=numpy.float64)
+        return bool(numpy.all(deadlines[:-1] >= deadlines[1:]))
+    for previous, current in zip(deadlines, deadlines[1:]):
+        if previous < current:
             return False
     return True
 
@@ -178,7 +1814,7 @@ def head_test(title, base_url, url, count=0, verbose=False):
     """
     Test HEAD request.
     """
-    print_header(title)
+    start_test(title)
     response = run_request(base_url, url, method="HEAD", verbose=verbose)
     if response is None:
         print_fail("HTTP request didn't succeed")
@@ -208,45 +1844,51 @@ def test_fail(title, base_url, url, messages=1, code=404, method="GET", \
     """
     Test failed request.
     """
-    print_header(title)
+    start_test(title)
     response = run_request(base_url, url, method=method, data=data, \
         verbose=verbose)
-    if response is None:
-        print_fail("HTTP request didn't succeed")
-        return (1, 0)
-    elif response.status_code != code:
-        print_fail("Status code %d != %d" % (response.status_code, code))
-        return (1, 0)
-    elif not isinstance(response.json(), dict):
-        print_fail("Response body is not a JSON object. Body=%s" % \
-            (json.dumps(response.json())))
-        return (1, 0)
-    elif "errorCode" not in response.json():
-        print_fail("ErrorCode property doesn't exist in response")
+    reason = error_problem(response, messages, code)
+    if reason is not None:
+        print_fail(reason)
         return (1, 0)
-    elif "errorMessages" not in response.json():
-        print_fail("ErrorMessages property doesn't exist in response")
-        return (1, 0)
-    elif response.json()["errorCode"] != code:
-        print_fail("ErrorCode %d != %d" % (response.json()["errorCode"], code))
-        return (1, 0)
-    elif not isinstance(response.json()["errorMessages"], list):
-        print_fail("ErrorMessages is not an array. errorMessages=%s" % \
-            (json.dumps(response.json()["errorMessages"])))
-        return (1, 0)
-    elif len(response.json()["errorMessages"]) != messages:
-        print_fail("Unexpected number of errors. %d != %d" % \
-            (len(response.json()["errorMessages"]), messages))
-        return (1, 0)
-    else:
-        print_success()
-        return (0, 1)
+    print_success()
+    return (0, 1)
+
+def error_problem(response, messages=1, code=404):
+    """
+    Return why response isn't an error response with code and the number
+    of error messages, None when it is.
+    """
+    if response is None:
+        return "HTTP request didn't succeed"
+    if response.status_code != code:
+        return "Status code %d != %d" % (response.status_code, code)
+    try:
+        body = response.json()
+    except ValueError:
+        return "Response body is not JSON. Body=%s" % (response.content)
+    if not isinstance(body, dict):
+        return "Response body is not a JSON object. Body=%s" % \
+            (json.dumps(body))
+    elif "errorCode" not in body:
+        return "ErrorCode property doesn't exist in response"
+    elif "errorMessages" not in body:
+        return "ErrorMessages property doesn't exist in response"
+    elif body["errorCode"] != code:
+        return "ErrorCode %d != %d" % (body["errorCode"], code)
+    elif not isinstance(body["errorMessages"], list):
+        return "ErrorMessages is not an array. errorMessages=%s" % \
+            (json.dumps(body["errorMessages"]))
+    elif len(body["errorMessages"]) != messages:
+        return "Unexpected number of errors. %d != %d" % \
+            (len(body["errorMessages"]), messages)
+    return None
 
 def options_test(title, base_url, url, allow_value, verbose=False):
     """
     Test OPTIONS request.
     """
-    print_header(title)
+    start_test(title)
     response = run_request(base_url, url, method="OPTIONS", verbose=verbose)
     if response is None:
         print_fail("HTTP request didn't succeed")
@@ -273,7 +1915,7 @@ def get_test(title, base_url, url, x_count, tasks_count, ids=None, \
     """
     Test GET request.
     """
-    print_header(title)
+    start_test(title)
     response = run_request(base_url, url, method="GET", verbose=verbose)
     if response is None:
         print_fail("HTTP request didn't succeed")
@@ -281,13 +1923,14 @@ def get_test(title, base_url, url, x_count, tasks_count, ids=None, \
     elif response.status_code != 200:
         print_fail("Status code %d != 200" % (response.status_code))
         return (1, 0)
-    elif not isinstance(response.json(), list):
+    tasks = response.json()
+    if not isinstance(tasks, list):
         print_fail("Response body is not an array. Body=%s" % \
-            (json.dumps(response.json())))
+            (json.dumps(tasks)))
         return (1, 0)
-    elif len(response.json()) != tasks_count:
+    elif len(tasks) != tasks_count:
         print_fail("JSON array length missmatch %d != %d" % \
-            (tasks_count, len(response.json())))
+            (tasks_count, len(tasks)))
         return (1, 0)
     elif response.headers["x-count"] is None:
         print_fail("X-Count value is undefined")
@@ -296,10 +1939,189 @@ def get_test(title, base_url, url, x_count, tasks_count, ids=None, \
         print_fail("X-Count value %d != %d" % \
             (int(response.headers["x-count"]), x_count))
         return (1, 0)
-    elif len(response.json()) != 0 and not verify_order(response.json()):
+    elif len(tasks) != 0 and not verify_order(tasks):
+        print_fail("Task array out of order")
+        return (1, 0)
+    elif ids is not None and not verify_ids(tasks, ids):
+        print_fail("Task array content not as expected")
+        return (1, 0)
+    else:
+        print_success()
+        return (0, 1)
+
+class TaskArrayParser(object):
+    """
+    Incremental parser yielding elements of a JSON array as bytes arrive.
+    """
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.state = "start"
+
+    def feed(self, data):
+        """
+        Feed received bytes and return list of completed elements.
+        """
+        buf = self.buffer + data
+        position = 0
+        elements = []
+        while self.state != "end":
+            while position < len(buf) and buf[position] in " \t\r\n":
+                position += 1
+            if position >= len(buf):
+                break
+            char = buf[position]
+            if self.state == "start":
+                if char != "[":
+                    raise ValueError("Response body is not an array")
+                position += 1
+                self.state = "first"
+            elif self.state in ("first", "element"):
+                if char == "]" and self.state == "first":
+                    position += 1
+                    self.state = "end"
+                    continue
+                try:
+                    element, end = self.decoder.raw_decode(buf, position)
+                except ValueError:
+                    # Element is not complete yet
+                    break
+                elements.append(element)
+                position = end
+                self.state = "separator"
+            else:
+                if char == ",":
+                    self.state = "element"
+                elif char == "]":
+                    self.state = "end"
+                else:
+                    raise ValueError("Unexpected %r in array" % (char))
+                position += 1
+        self.buffer = buf[position:]
+        return elements
+
+    def close(self):
+        """
+        Verify the array was complete.
+        """
+        if self.state != "end" or self.buffer.strip():
+            raise ValueError("Truncated JSON array")
+
+class StreamVerifier(object):
+    """
+    Checks deadline order and ids of tasks one at a time.
+    """
+    def __init__(self, ids=None):
+        self.expected = ids
+        self.count = 0
+        self.ordered = True
+        self.ids_match = True
+        self.previous = None
+
+    def add(self, task):
+        """
+        Check next task against the previous one and expected ids.
+        """
+        deadline = parse_deadline(task["deadline"])
+        if self.previous is not None and self.previous < deadline:
+            self.ordered = False
+        self.previous = deadline
+        if self.expected is not None and (self.count >= len(self.expected) \
+            or self.expected[self.count] != task["id"]):
+            self.ids_match = False
+        self.count += 1
+
+    def ids_complete(self):
+        """
+        Return True when all tasks had the expected ids.
+        """
+        return self.expected is None or \
+            (self.ids_match and self.count == len(self.expected))
+
+class StreamStats(object):
+    """
+    Thread safe totals of streamed bytes and parse time.
+    """
+    def __init__(self):
+        self.bytes = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, size, seconds):
+        """
+        Add streamed response size and time spent reading and parsing it.
+        """
+        with self.lock:
+            self.bytes += size
+            self.seconds += seconds
+
+    def throughput(self):
+        """
+        Return parse throughput in MB/s.
+        """
+        if self.seconds <= 0:
+            return 0.0
+        return self.bytes / 1000000.0 / self.seconds
+
+# Totals of all streamed list responses
+STREAM_STATS = StreamStats()
+
+def stream_tasks(response, verifier, chunk_size=DEFAULT_STREAM_CHUNK):
+    """
+    Parse streamed task array into verifier, return (bytes, seconds).
+    """
+    parser = TaskArrayParser()
+    size = 0
+    start = time.time()
+    for chunk in response.iter_content(chunk_size):
+        size += len(chunk)
+        for task in parser.feed(chunk):
+            verifier.add(task)
+    parser.close()
+    elapsed = time.time() - start
+    STREAM_STATS.record(size, elapsed)
+    return (size, elapsed)
+
+def stream_get_test(title, base_url, url, x_count, tasks_count, ids=None, \
+    verbose=False):
+    """
+    Test GET request, parsing the task array while it is received.
+    """
+    start_test(title)
+    response = run_request(base_url, url, method="GET", verbose=verbose, \
+        stream=True)
+    if response is None:
+        print_fail("HTTP request didn't succeed")
+        return (1, 0)
+    elif response.status_code != 200:
+        print_fail("Status code %d != 200" % (response.status_code))
+        return (1, 0)
+    verifier = StreamVerifier(ids)
+    try:
+        size, elapsed = stream_tasks(response, verifier)
+    except ValueError as error:
+        print_fail("Response body is not a task array. %s" % (error))
+        return (1, 0)
+    except requests.exceptions.RequestException:
+        print_fail("HTTP request didn't succeed")
+        return (1, 0)
+    if verbose:
+        print_info("Streamed %d bytes in %.3fs" % (size, elapsed))
+    if verifier.count != tasks_count:
+        print_fail("JSON array length missmatch %d != %d" % \
+            (tasks_count, verifier.count))
+        return (1, 0)
+    elif response.headers.get("x-count") is None:
+        print_fail("X-Count value is undefined")
+        return (1, 0)
+    elif int(response.headers["x-count"]) != x_count:
+        print_fail("X-Count value %d != %d" % \
+            (int(response.headers["x-count"]), x_count))
+        return (1, 0)
+    elif not verifier.ordered:
         print_fail("Task array out of order")
         return (1, 0)
-    elif ids is not None and not verify_ids(response.json(), ids):
+    elif not verifier.ids_complete():
         print_fail("Task array content not as expected")
         return (1, 0)
     else:
@@ -310,7 +2132,7 @@ def post_test(title, base_url, url, task, verbose=False):
     """
     Test POST request.
     """
-    print_header(title)
+    start_test(title)
     response = run_request(base_url, url, method="POST", \
         data=json.dumps(task), verbose=verbose)
     if response is None:
@@ -355,7 +2177,7 @@ def index_test(title, base_url, url, task_id, verbose=False):
     """
     Test GET request for specific task.
     """
-    print_header(title)
+    start_test(title)
     response = run_request(base_url, url, method="GET", verbose=verbose)
     if response is None:
         print_fail("HTTP request didn't succeed")
@@ -391,7 +2213,7 @@ def put_test(title, base_url, url, task, task_id, verbose=False):
     """
     Test PUT request.
     """
-    print_header(title)
+    start_test(title)
     response = run_request(base_url, url, method="PUT", \
         data=json.dumps(task), verbose=verbose)
     if response is None:
@@ -440,7 +2262,7 @@ def patch_test(title, base_url, url, task, task_id, verbose=False):
     """
     Test PATCH request.
     """
-    print_header(title)
+    start_test(title)
     response = run_request(base_url, url, method="PATCH", \
         data=json.dumps(task), verbose=verbose)
     if response is None:
@@ -491,7 +2313,7 @@ def delete_test(title, base_url, url, task_id, verbose=False):
     """
     Test DELETE request.
     """
-    print_header(title)
+    start_test(title)
     response = run_request(base_url, url, method="DELETE", verbose=verbose)
     if response is None:
         print_fail("HTTP request didn't succeed")
@@ -528,91 +2350,155 @@ def delete_test(title, base_url, url, task_id, verbose=False):
             print_success()
             return (0, 1)
 
-def main():
+class Ref(object):
     """
-    Main function for test client.
+    Placeholder for the id of a task created by an earlier test case.
     """
-    # Setup flags
-    parser = argparse.ArgumentParser(description='node-challenge test client', \
-        epilog='Example: ./test.py http://127.0.0.1:8080/')
-    parser.add_argument('endpoint', help='server endpoint')
-    parser.add_argument('--verbose', '-v', \
-        help='print verbose information during execution', action='store_true')
-    parser.add_argument('--version', action='version', \
-        version='%(prog)s ' + __version__, help='display version information')
-    # Parse command line arguments
-    args = parser.parse_args(sys.argv[1:])
-    # Test counters
+    def __init__(self, name, template=None):
+        self.name = name
+        self.template = template
+
+    def resolve(self, ids):
+        """
+        Return task id, or template filled with it.
+        """
+        task_id = ids.get(self.name)
+        if self.template is None:
+            return task_id
+        return self.template % (task_id)
+
+def resolve_refs(value, ids):
+    """
+    Replace Ref placeholders in value, lists and dicts with task ids.
+    """
+    if isinstance(value, Ref):
+        return value.resolve(ids)
+    elif isinstance(value, list):
+        return [resolve_refs(item, ids) for item in value]
+    elif isinstance(value, tuple):
+        return tuple(resolve_refs(item, ids) for item in value)
+    elif isinstance(value, dict):
+        return dict((key, resolve_refs(item, ids)) \
+            for key, item in value.items())
+    return value
+
+class Case(object):
+    """
+    Test case of the suite. It runs after the cases named in after.
+    """
+    def __init__(self, name, checker, title, url, args=(), kwargs=None, \
+        after=()):
+        self.name = name
+        self.checker = checker
+        self.title = title
+        self.url = url
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.after = after
+
+    def run(self, base_url, ids, verbose=False):
+        """
+        Run checker with task ids of earlier cases filled in.
+        """
+        kwargs = resolve_refs(self.kwargs, ids)
+        kwargs["verbose"] = verbose
+        url = resolve_refs(self.url, ids)
+        return self.checker(self.title, base_url, url, \
+            *resolve_refs(self.args, ids), **kwargs)
+
+def suite_worker(cases, done, base_url, ids, verbose):
+    """
+    Run cases from queue and report (case, result) to done queue. Output of
+    a case goes to the result sink as one record.
+    """
+    while True:
+        case = cases.get()
+        if case is None:
+            return
+        try:
+            result = case.run(base_url, ids, verbose=verbose)
+        except Exception as error:
+            if current_record() is None:
+                start_test(case.title)
+            print_fail("Test raised %s: %s" % (type(error).__name__, error))
+            result = (1, 0)
+        done.put((case, result))
+
+def run_suite(suite, base_url, workers=DEFAULT_SUITE_WORKERS, verbose=False):
+    """
+    Run test cases, independent ones in parallel, and return
+    (failed, succeeded).
+    """
+    names = set(case.name for case in suite)
+    for case in suite:
+        for name in case.after:
+            if name not in names:
+                raise ValueError("Case %s runs after unknown case %s" % \
+                    (case.name, name))
+    cases = Queue.Queue()
+    done = Queue.Queue()
+    ids = {}
+    threads = []
+    for _ in range(max(workers, 1)):
+        thread = threading.Thread(target=suite_worker, \
+            args=(cases, done, base_url, ids, verbose))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
     failed_tests = 0
     succeeded_tests = 0
-    # Test HEAD with empty database
-    fail, succeed = head_test("Empty database HEAD request", args.endpoint, \
-        "/tasks.json", verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test OPTIONS with /tasks.json path
-    fail, succeed = options_test("OPTIONS request for /tasks.json", \
-        args.endpoint, "/tasks.json", ["GET", "HEAD", "OPTIONS", "POST"], \
-        verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test GET /tasks.json with no entries
-    fail, succeed = get_test("Empty GET request for /tasks.json", \
-        args.endpoint, "/tasks.json", 0, 0, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test GET /tasks.json?q=test with no entries
-    fail, succeed = get_test("Empty GET request for /tasks.json?q=test", \
-        args.endpoint, "/tasks.json?q=test", 0, 0, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test GET /tasks.json?pageSize=13 with no entries
-    fail, succeed = get_test("Empty GET request for /tasks.json?pageSize=13", \
-        args.endpoint, "/tasks.json?pageSize=13", 0, 0, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test POST /tasks.json with a valid object
+    finished = set()
+    pending = list(suite)
+    running = 0
+    try:
+        while pending or running:
+            ready = [case for case in pending \
+                if all(name in finished for name in case.after)]
+            for case in ready:
+                pending.remove(case)
+                cases.put(case)
+                running += 1
+            if running == 0:
+                raise ValueError("Cyclic dependencies between %s" % \
+                    (", ".join(case.name for case in pending)))
+            case, result = done.get()
+            running -= 1
+            failed_tests += result[0]
+            succeeded_tests += result[1]
+            if len(result) == 3:
+                ids[case.name] = result[2]
+            finished.add(case.name)
+    finally:
+        for _ in threads:
+            cases.put(None)
+        for thread in threads:
+            thread.join()
+    return (failed_tests, succeeded_tests)
+
+def build_suite(list_test=get_test):
+    """
+    Return test cases of the conformance suite.
+    """
     valid_task = {
         "title": "Task1",
         "description": "Task description 1",
         "deadline": "2015-09-11T09:00:00+01:00"
     }
-    fail, succeed, task_id = post_test("Valid POST request", args.endpoint, \
-        "/tasks.json", valid_task, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    valid_task["id"] = task_id
-    # Test POST /tasks.json with an invalid objects
     invalid_task1 = {
         "title": "Tas",
         "description": "Task description 1",
         "deadline": "2015-09-11T09:00:00+01:00"
     }
-    fail, succeed = test_fail("Invalid POST request 1", args.endpoint, \
-        "/tasks.json", data=json.dumps(invalid_task1), method="POST", \
-        messages=1, code=400, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
     invalid_task2 = {
         "title": "A very long title that doesn't repeat in order to " + \
             "be bigger than 64 characters.",
         "description": "Task description 1",
         "deadline": "2015-09-11T09:00:00+01:00"
     }
-    fail, succeed = test_fail("Invalid POST request 2", args.endpoint, \
-        "/tasks.json", data=json.dumps(invalid_task2), method="POST", \
-        messages=1, code=400, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
     invalid_task3 = {
         "title": "Task1",
         "deadline": "2015-09-11T09:00:00+01:00"
     }
-    fail, succeed = test_fail("Invalid POST request 3", args.endpoint, \
-        "/tasks.json", data=json.dumps(invalid_task3), method="POST", \
-        messages=1, code=400, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
     invalid_task4 = {
         "title": "Task1",
         "description": "A very long task description that repeats in " + \
@@ -624,177 +2510,4354 @@ def main():
             " characters.",
         "deadline": "2015-09-11T09:00:00+01:00"
     }
-    fail, succeed = test_fail("Invalid POST request 4", args.endpoint, \
-        "/tasks.json", data=json.dumps(invalid_task4), method="POST", \
-        messages=1, code=400, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
     invalid_task5 = {
         "title": "Task1",
         "description": "Task description 1",
         "deadline": "2015/09/11"
     }
-    fail, succeed = test_fail("Invalid POST request 5", args.endpoint, \
-        "/tasks.json", data=json.dumps(invalid_task5), method="POST", \
-        messages=1, code=400, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
     invalid_task6 = {
         "title": "Task1",
         "description": "Task description 1",
         "deadline": ""
     }
-    fail, succeed = test_fail("Invalid POST request 6", args.endpoint, \
-        "/tasks.json", data=json.dumps(invalid_task6), method="POST", \
-        messages=1, code=400, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test POST /tasks.json with two additional tasks
     valid_task2 = {
         "title": "Task2",
         "description": "Task description 2",
         "deadline": "2015-09-12T09:00:00+01:00"
     }
-    fail, succeed, task_id = post_test("Valid POST request 2", \
-        args.endpoint, "/tasks.json", valid_task2, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    valid_task2["id"] = task_id
     valid_task3 = {
         "title": "Task3",
         "description": "",
         "deadline": "2015-09-13T09:00:00+01:00"
     }
-    fail, succeed, task_id = post_test("POST request with empty description", \
-        args.endpoint, "/tasks.json", valid_task3, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    valid_task3["id"] = task_id
-    # Test HEAD /tasks.json with 3 tasks
-    fail, succeed = head_test("HEAD request with 3 tasks", args.endpoint, \
-        "/tasks.json", count=3, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test GET /tasks.json deadline order
-    fail, succeed = get_test("Test GET request order", args.endpoint, \
-        "/tasks.json", 3, 3, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test GET /tasks.json?page=2&pageSize=1 pagination
-    fail, succeed = get_test("Test GET pagination", args.endpoint, \
-        "/tasks.json?page=2&pageSize=1", 3, 1, ids=[valid_task2["id"]], \
-        verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test GET /tasks.json?q=task1 search
-    fail, succeed = get_test("Test GET search", args.endpoint, \
-        "/tasks.json?q=task1", 1, 1, ids=[valid_task["id"]], \
-        verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test GET /tasks/ID.json
-    fail, succeed = index_test("Task GET request", args.endpoint, \
-        "/tasks/" + str(valid_task3["id"]) + ".json", valid_task3["id"], \
-        verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test GET /tasks/BAD_ID.json
-    fail, succeed = test_fail("Task GET with bad id", args.endpoint, \
-        "/tasks/982.json", method="GET", messages=1, code=404, \
-        verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test OPTIONS /tasks/ID.json
-    fail, succeed = options_test("Task OPTIONS request", args.endpoint, \
-        "/tasks/" + str(valid_task["id"]) + ".json", \
-        ["GET", "OPTIONS", "PUT", "PATCH", "DELETE"], verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test OPTIONS /tasks/BAD_ID.json
-    fail, succeed = test_fail("Task OPTIONS with bad id", args.endpoint, \
-        "/tasks/88.json", method="OPTIONS", messages=1, code=404, \
-        verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test PUT /tasks/ID.json
     put_task = {
         "title": "Task3.1",
         "description": "",
         "deadline": "2015-09-13T09:00:00+01:00"
     }
-    fail, succeed = put_test("Valid PUT request", args.endpoint, \
-        "/tasks/" + str(valid_task3["id"]) + ".json", put_task, \
-        valid_task3["id"], verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test PUT /tasks/ID.json with missing property
     invalid_put = {
         "title": "Task3.1",
         "deadline": "2015-09-13T09:00:00+01:00"
     }
-    fail, succeed = test_fail("Task PUT with missing property", \
-        args.endpoint, "/tasks/" + str(valid_task3["id"]) + ".json", \
-        data=json.dumps(invalid_put), method="PUT", messages=1, code=400, \
-        verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test PUT /tasks/ID.json with invalid property
     invalid_put2 = {
         "title": "T",
         "description": "",
         "deadline": "2015-09-13T09:00:00+01:00"
     }
-    fail, succeed = test_fail("Task PUT with invalid property", \
-        args.endpoint, "/tasks/" + str(valid_task3["id"]) + ".json", \
-        data=json.dumps(invalid_put2), method="PUT", messages=1, code=400, \
-        verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test PUT /tasks/BAD_ID.json
-    fail, succeed = test_fail("Task PUT with bad id", args.endpoint, \
-        "/tasks/88.json", data=json.dumps(put_task), method="PUT", \
-        messages=1, code=404, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test PATCH /tasks/ID.json
     patch_task = {
         "title": "Task2.1"
     }
-    fail, succeed = patch_test("Valid PATCH request", args.endpoint, \
-        "/tasks/" + str(valid_task2["id"]) + ".json", patch_task, \
-        valid_task2["id"], verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test PATCH /tasks/ID.json with invalid property
     invalid_patch = {
         "title": "T"
     }
-    fail, succeed = test_fail("Task PATCH with invalid property", \
-        args.endpoint, "/tasks/" + str(valid_task2["id"]) + ".json", \
-        data=json.dumps(invalid_patch), method="PATCH", messages=1, \
-        code=400, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test PATCH /tasks/BAD_ID.json
-    fail, succeed = test_fail("Task PATCH with bad id", args.endpoint, \
-        "/tasks/88.json", data=json.dumps(patch_task), method="PATCH", \
-        messages=1, code=404, verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test DELETE /tasks/ID.json
-    fail, succeed = delete_test("Valid DELETE request", args.endpoint, \
-        "/tasks/" + str(valid_task2["id"]) + ".json", valid_task2["id"], \
-        verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Test DELETE /tasks/BAD_ID.json
-    fail, succeed = test_fail("Task DELETE with bad id", args.endpoint, \
-        "/tasks/88.json", method="DELETE", messages=1, code=404, \
-        verbose=args.verbose)
-    failed_tests += fail
-    succeeded_tests += succeed
-    # Print summary
-    print_test_summary(failed_tests, succeeded_tests)
+    task1_url = Ref("post1", "/tasks/%s.json")
+    task2_url = Ref("post2", "/tasks/%s.json")
+    task3_url = Ref("post3", "/tasks/%s.json")
+    # Checks of the empty database run before any POST
+    empty = ("empty_head", "empty_get", "empty_search", "empty_page")
+    posts = ("post1", "invalid_post1", "invalid_post2", "invalid_post3", \
+        "invalid_post4", "invalid_post5", "invalid_post6", "post2", "post3")
+    # Checks of the three task database run before any update
+    snapshot = ("head3", "get_order", "get_page", "get_search")
+    return [
+        Case("empty_head", head_test, "Empty database HEAD request", \
+            "/tasks.json"),
+        Case("options", options_test, "OPTIONS request for /tasks.json", \
+            "/tasks.json", (["GET", "HEAD", "OPTIONS", "POST"],)),
+        Case("empty_get", list_test, "Empty GET request for /tasks.json", \
+            "/tasks.json", (0, 0)),
+        Case("empty_search", list_test, \
+            "Empty GET request for /tasks.json?q=test", \
+            "/tasks.json?q=test", (0, 0)),
+        Case("empty_page", list_test, \
+            "Empty GET request for /tasks.json?pageSize=13", \
+            "/tasks.json?pageSize=13", (0, 0)),
+        Case("post1", post_test, "Valid POST request", "/tasks.json", \
+            (valid_task,), after=empty),
+        Case("invalid_post1", test_fail, "Invalid POST request 1", \
+            "/tasks.json", kwargs={"data": json.dumps(invalid_task1), \
+            "method": "POST", "messages": 1, "code": 400}, after=empty),
+        Case("invalid_post2", test_fail, "Invalid POST request 2", \
+            "/tasks.json", kwargs={"data": json.dumps(invalid_task2), \
+            "method": "POST", "messages": 1, "code": 400}, after=empty),
+        Case("invalid_post3", test_fail, "Invalid POST request 3", \
+            "/tasks.json", kwargs={"data": json.dumps(invalid_task3), \
+            "method": "POST", "messages": 1, "code": 400}, after=empty),
+        Case("invalid_post4", test_fail, "Invalid POST request 4", \
+            "/tasks.json", kwargs={"data": json.dumps(invalid_task4), \
+            "method": "POST", "messages": 1, "code": 400}, after=empty),
+        Case("invalid_post5", test_fail, "Invalid POST request 5", \
+            "/tasks.json", kwargs={"data": json.dumps(invalid_task5), \
+            "method": "POST", "messages": 1, "code": 400}, after=empty),
+        Case("invalid_post6", test_fail, "Invalid POST request 6", \
+            "/tasks.json", kwargs={"data": json.dumps(invalid_task6), \
+            "method": "POST", "messages": 1, "code": 400}, after=empty),
+        Case("post2", post_test, "Valid POST request 2", "/tasks.json", \
+            (valid_task2,), after=empty),
+        Case("post3", post_test, "POST request with empty description", \
+            "/tasks.json", (valid_task3,), after=empty),
+        Case("head3", head_test, "HEAD request with 3 tasks", \
+            "/tasks.json", kwargs={"count": 3}, after=posts),
+        Case("get_order", list_test, "Test GET request order", \
+            "/tasks.json", (3, 3), after=posts),
+        Case("get_page", list_test, "Test GET pagination", \
+            "/tasks.json?page=2&pageSize=1", (3, 1), \
+            {"ids": [Ref("post2")]}, after=posts),
+        Case("get_search", list_test, "Test GET search", \
+            "/tasks.json?q=task1", (1, 1), {"ids": [Ref("post1")]}, \
+            after=posts),
+        Case("get_task", index_test, "Task GET request", task3_url, \
+            (Ref("post3"),), after=("post3",)),
+        Case("get_bad_id", test_fail, "Task GET with bad id", \
+            "/tasks/982.json", kwargs={"method": "GET", "messages": 1, \
+            "code": 404}),
+        Case("options_task", options_test, "Task OPTIONS request", \
+            task1_url, (["GET", "OPTIONS", "PUT", "PATCH", "DELETE"],), \
+            after=("post1",)),
+        Case("options_bad_id", test_fail, "Task OPTIONS with bad id", \
+            "/tasks/88.json", kwargs={"method": "OPTIONS", "messages": 1, \
+            "code": 404}),
+        Case("put", put_test, "Valid PUT request", task3_url, \
+            (put_task, Ref("post3")), after=snapshot + ("get_task",)),
+        Case("invalid_put", test_fail, "Task PUT with missing property", \
+            task3_url, kwargs={"data": json.dumps(invalid_put), \
+            "method": "PUT", "messages": 1, "code": 400}, after=("post3",)),
+        Case("invalid_put2", test_fail, "Task PUT with invalid property", \
+            task3_url, kwargs={"data": json.dumps(invalid_put2), \
+            "method": "PUT", "messages": 1, "code": 400}, after=("post3",)),
+        Case("put_bad_id", test_fail, "Task PUT with bad id", \
+            "/tasks/88.json", kwargs={"data": json.dumps(put_task), \
+            "method": "PUT", "messages": 1, "code": 404}),
+        Case("patch", patch_test, "Valid PATCH request", task2_url, \
+            (patch_task, Ref("post2")), after=snapshot),
+        Case("invalid_patch", test_fail, "Task PATCH with invalid property", \
+            task2_url, kwargs={"data": json.dumps(invalid_patch), \
+            "method": "PATCH", "messages": 1, "code": 400}, \
+            after=("post2",)),
+        Case("patch_bad_id", test_fail, "Task PATCH with bad id", \
+            "/tasks/88.json", kwargs={"data": json.dumps(patch_task), \
+            "method": "PATCH", "messages": 1, "code": 404}),
+        Case("delete", delete_test, "Valid DELETE request", task2_url, \
+            (Ref("post2"),), after=snapshot + ("patch", "invalid_patch")),
+        Case("delete_bad_id", test_fail, "Task DELETE with bad id", \
+            "/tasks/88.json", kwargs={"method": "DELETE", "messages": 1, \
+            "code": 404})
+    ]
+
+# Request method issued by each checker
+CHECK_METHODS = {
+    head_test: "HEAD",
+    options_test: "OPTIONS",
+    get_test: "GET",
+    index_test: "GET",
+    post_test: "POST",
+    put_test: "PUT",
+    patch_test: "PATCH",
+    delete_test: "DELETE"
+}
+
+def check_requests(checker, args, kwargs):
+    """
+    Return (method, url, data) of requests a checker issues, in order.
+    """
+    full_url = urlparse.urljoin(args[1], args[2])
+    if checker is test_fail:
+        return [(kwargs.get("method", "GET"), full_url, kwargs.get("data"))]
+    data = None
+    if checker in (post_test, put_test, patch_test):
+        data = json.dumps(args[3])
+    issued = [(CHECK_METHODS[checker], full_url, data)]
+    if checker is delete_test:
+        issued.append(("GET", full_url, None))
+    return issued
+
+class PrefetchTransport(object):
+    """
+    Serves checkers responses fetched concurrently by the async engine.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.results = {}
+
+    def store(self, key, response, error):
+        """
+        Keep result of a prefetched request.
+        """
+        self.results.setdefault(key, collections.deque()).append( \
+            error if error is not None else response)
+
+    def submit_chain(self, chain):
+        """
+        Submit requests one after another on completion of the previous.
+        """
+        if not chain:
+            return
+        method, url, data = chain[0]
+        def callback(response, error):
+            self.store((method, url, data), response, error)
+            self.submit_chain(chain[1:])
+        self.engine.submit(method, url, data=data, callback=callback)
+
+    def prefetch(self, checks):
+        """
+        Fetch requests of all checks concurrently.
+        """
+        for checker, args, kwargs in checks:
+            self.submit_chain(check_requests(checker, args, kwargs))
+        self.engine.run()
+
+    def request(self, method, url, data=None, timeout=None, stream=False, \
+        headers=None):
+        """
+        Return prefetched response or send the request now.
+        """
+        results = self.results.get((method, url, data))
+        if results:
+            result = results.popleft()
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return self.engine.request(method, url, data=data, timeout=timeout, \
+            headers=headers)
+
+    def connection_stats(self):
+        """
+        Return (opened, reused) connection counts.
+        """
+        return self.engine.connection_stats()
+
+def run_async_checks(checks):
+    """
+    Run checkers, prefetching their requests concurrently when the shared
+    transport is the async engine.
+    """
+    transport = get_transport()
+    if isinstance(transport, PrefetchTransport):
+        transport.prefetch(checks)
+    return [checker(*args, **kwargs) for checker, args, kwargs in checks]
+
+def run_async_conformance(base_url, clients, verbose=False):
+    """
+    Run task checks for many concurrent clients.
+    """
+    failed_tests = 0
+    succeeded_tests = 0
+    checks = []
+    tasks = []
+    for client in range(clients):
+        task = {
+            "title": "Client task %d" % (client),
+            "description": "Client task description %d" % (client),
+            "deadline": "2015-09-11T09:00:00+01:00"
+        }
+        invalid_task = {
+            "title": "Tas",
+            "description": "Client task description %d" % (client),
+            "deadline": "2015-09-11T09:00:00+01:00"
+        }
+        tasks.append(task)
+        checks.append((post_test, ("Client %d POST request" % (client), \
+            base_url, "/tasks.json", task), {"verbose": verbose}))
+        checks.append((test_fail, ("Client %d invalid POST request" % \
+            (client), base_url, "/tasks.json"), {"data": \
+            json.dumps(invalid_task), "method": "POST", "messages": 1, \
+            "code": 400, "verbose": verbose}))
+        checks.append((options_test, ("Client %d OPTIONS request" % \
+            (client), base_url, "/tasks.json", ["GET", "HEAD", "OPTIONS", \
+            "POST"]), {"verbose": verbose}))
+    for index, result in enumerate(run_async_checks(checks)):
+        failed_tests += result[0]
+        succeeded_tests += result[1]
+        if len(result) == 3 and result[2] is not None:
+            tasks[index // 3]["id"] = result[2]
+    created = [task for task in tasks if "id" in task]
+    checks = []
+    for task in created:
+        url = "/tasks/" + str(task["id"]) + ".json"
+        checks.append((index_test, ("Client task %d GET request" % \
+            (task["id"]), base_url, url, task["id"]), {"verbose": verbose}))
+        checks.append((options_test, ("Client task %d OPTIONS request" % \
+            (task["id"]), base_url, url, ["GET", "OPTIONS", "PUT", "PATCH", \
+            "DELETE"]), {"verbose": verbose}))
+        checks.append((patch_test, ("Client task %d PATCH request" % \
+            (task["id"]), base_url, url, {"description": "Patched"}, \
+            task["id"]), {"verbose": verbose}))
+    for result in run_async_checks(checks):
+        failed_tests += result[0]
+        succeeded_tests += result[1]
+    checks = []
+    for task in created:
+        checks.append((delete_test, ("Client task %d DELETE request" % \
+            (task["id"]), base_url, "/tasks/" + str(task["id"]) + ".json", \
+            task["id"]), {"verbose": verbose}))
+    for result in run_async_checks(checks):
+        failed_tests += result[0]
+        succeeded_tests += result[1]
+    return (failed_tests, succeeded_tests)
+
+def route_template(url):
+    """
+    Return route template for request url, e.g. /tasks/:id.json.
+    """
+    path = urlparse.urlparse(url).path
+    if TASK_PATH_PATTERN.match(path):
+        return "/tasks/:id.json"
+    return path
+
+class LoadStats(object):
+    """
+    Thread safe request and error counters keyed by method and route.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def record(self, method, url, ok):
+        """
+        Count one request and whether it failed.
+        """
+        key = (method, route_template(url))
+        with self.lock:
+            count = self.counts.setdefault(key, [0, 0])
+            count[0] += 1
+            if not ok:
+                count[1] += 1
+
+    def totals(self, index):
+        """
+        Return counts summed by method (index 0) or route (index 1).
+        """
+        totals = {}
+        with self.lock:
+            for key, count in self.counts.items():
+                total = totals.setdefault(key[index], [0, 0])
+                total[0] += count[0]
+                total[1] += count[1]
+        return totals
+
+def load_request(base_url, url, stats, method="GET", data=None):
+    """
+    Run request for load mode, count it and return JSON body or None.
+    """
+    response = run_request(base_url, url, method=method, data=data)
+    ok = response is not None and response.status_code == 200
+    stats.record(method, url, ok)
+    if not ok:
+        dump_trace("%s %s failed" % (method, url))
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+def run_lifecycle(base_url, stats, number):
+    """
+    Run POST, GET, PUT, PATCH and DELETE on a task of its own.
+    """
+    task = {
+        "title": "Load task %d" % (number),
+        "description": "Load task description %d" % (number),
+        "deadline": "2015-09-11T09:00:00+01:00"
+    }
+    created = load_request(base_url, "/tasks.json", stats, method="POST", \
+        data=json.dumps(task))
+    if created is None or "id" not in created:
+        return False
+    url = "/tasks/" + str(created["id"]) + ".json"
+    load_request(base_url, url, stats, method="GET")
+    task["title"] = "Load task %d.1" % (number)
+    load_request(base_url, url, stats, method="PUT", data=json.dumps(task))
+    load_request(base_url, url, stats, method="PATCH", \
+        data=json.dumps({"description": "Patched %d" % (number)}))
+    return load_request(base_url, url, stats, method="DELETE") is not None
+
+class LoadCounter(object):
+    """
+    Hands out lifecycle numbers until the duration or iterations run out.
+    """
+    def __init__(self, duration=None, iterations=None):
+        self.deadline = None
+        if duration is not None:
+            self.deadline = time.time() + duration
+        self.iterations = iterations
+        self.issued = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        """
+        Return next lifecycle number or None when the run is over.
+        """
+        with self.lock:
+            if self.iterations is not None and \
+                self.issued >= self.iterations:
+                return None
+            if self.deadline is not None and time.time() >= self.deadline:
+                return None
+            self.issued += 1
+            return self.issued
+
+def load_worker(base_url, stats, counter):
+    """
+    Run lifecycles until the counter is exhausted.
+    """
+    while True:
+        number = counter.next()
+        if number is None:
+            return
+        run_lifecycle(base_url, stats, number)
+
+def print_load_summary(stats, elapsed, lifecycles):
+    """
+    Print requests per second by route and by method.
+    """
+    print_header("Load summary")
+    print "Lifecycles: %d Time: %.2fs" % (lifecycles, elapsed)
+    for label, index in (("Route", 1), ("Method", 0)):
+        totals = stats.totals(index)
+        print "%-20s %10s %8s %10s" % (label, "Requests", "Errors", "Req/s")
+        for key in sorted(totals.keys()):
+            requests_count, errors = totals[key]
+            print "%-20s %10d %8d %10.1f" % (key, requests_count, errors, \
+                requests_count / elapsed if elapsed > 0 else 0.0)
+    print_latency_summary(LATENCY)
+    print_cache_summary(CACHE)
+    print "------------------------------------------------------------------"
+
+def run_load(base_url, workers=DEFAULT_LOAD_WORKERS, duration=None, \
+    iterations=None):
+    """
+    Replay the task lifecycle concurrently on a pool of worker threads.
+    """
+    if duration is None and iterations is None:
+        duration = DEFAULT_LOAD_DURATION
+    stats = LoadStats()
+    counter = LoadCounter(duration=duration, iterations=iterations)
+    threads = []
+    start = time.time()
+    for _ in range(workers):
+        thread = threading.Thread(target=load_worker, \
+            args=(base_url, stats, counter))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    print_load_summary(stats, time.time() - start, counter.issued)
+    return stats
+
+def parse_mix(text):
+    """
+    Parse a weighted route mix such as "GET /tasks.json=80,POST
+    /tasks.json=20" into (method, url, weight) tuples. :id in a url stands
+    for an existing task.
+    """
+    routes = []
+    for part in text.split(","):
+        route, _, weight = part.strip().rpartition("=")
+        method, _, url = route.strip().partition(" ")
+        method = method.upper()
+        if method not in HTTP_METHODS or not url.startswith("/"):
+            raise ValueError("invalid route %s in mix" % (part.strip()))
+        try:
+            weight = float(weight)
+        except ValueError:
+            raise ValueError("invalid weight in %s" % (part.strip()))
+        if weight <= 0:
+            raise ValueError("weight of %s must be positive" % (route))
+        routes.append((method, url.strip(), weight))
+    return routes
+
+def open_loop_ids(engine, base_url, count, seed):
+    """
+    Return ids of up to count existing tasks, seeding tasks when the server
+    has fewer.
+    """
+    ids = []
+    try:
+        response = engine.request("GET", urlparse.urljoin(base_url, \
+            "/tasks.json?pageSize=%d" % (count)))
+        if response.status_code == 200:
+            ids = [task["id"] for task in response.json()]
+    except (requests.exceptions.RequestException, ValueError, KeyError, \
+        TypeError):
+        pass
+    if len(ids) < count:
+        seed_http(base_url, TaskGenerator(seed).tasks(count - len(ids)), \
+            on_insert=lambda task, task_id: ids.append(task_id))
+    return ids
+
+class OpenLoopStats(object):
+    """
+    Outcome of an open-loop run. Latency is taken from the scheduled send
+    time, service time from the actual one. Callbacks run on the engine
+    thread.
+    """
+    def __init__(self):
+        self.service = LatencyRecorder()
+        self.lag = LatencyHistogram()
+        self.start = None
+        self.elapsed = 0.0
+        self.sent = 0
+        self.completed = 0
+        self.errors = 0
+        self.last_sent = None
+        self.last_completed = None
+
+    def record(self, method, url, scheduled, response, error):
+        """
+        Record completion of a request scheduled at scheduled.
+        """
+        now = time.time()
+        self.completed += 1
+        self.last_completed = now
+        LATENCY.record(method, url, now - scheduled)
+        if response is None or response.status_code >= 400:
+            self.errors += 1
+        if response is not None and response.elapsed is not None:
+            sent = now - response.elapsed
+            self.service.record(method, url, response.elapsed)
+            self.lag.record(max(sent - scheduled, 0.0))
+            if self.last_sent is None or sent > self.last_sent:
+                self.last_sent = sent
+
+def run_open_loop(base_url, rate, mix, duration=DEFAULT_LOAD_DURATION, \
+    connections=DEFAULT_ENGINE_CONNECTIONS, timeout=DEFAULT_TIMEOUT, seed=0):
+    """
+    Send requests of the weighted route mix at a constant rate on the async
+    engine regardless of how fast responses arrive. Returns stats.
+    """
+    engine = AsyncEngine(connections=connections, timeout=timeout)
+    ids = []
+    if any(":id" in url for _, url, _ in mix):
+        ids = open_loop_ids(engine, base_url, OPEN_LOOP_TASKS, seed)
+    random_generator = random.Random(seed)
+    generator = TaskGenerator(seed)
+    weights = []
+    total_weight = 0.0
+    for _, _, weight in mix:
+        total_weight += weight
+        weights.append(total_weight)
+    stats = OpenLoopStats()
+    def created(response, error):
+        if response is not None and response.status_code == 200:
+            try:
+                ids.append(response.json()["id"])
+            except (ValueError, KeyError, TypeError):
+                pass
+    total = int(rate * duration)
+    sent = 0
+    start = stats.start = time.time()
+    while True:
+        now = time.time()
+        while sent < total and start + sent / rate <= now:
+            scheduled = start + sent / rate
+            sent += 1
+            method, url, _ = mix[bisect.bisect_right(weights, \
+                random_generator.random() * total_weight)]
+            if ":id" in url:
+                if not ids:
+                    stats.record(method, url, scheduled, None, None)
+                    continue
+                index = random_generator.randrange(len(ids))
+                task_id = ids[index]
+                if method == "DELETE":
+                    ids[index] = ids[-1]
+                    ids.pop()
+                url = url.replace(":id", str(task_id))
+            data = None
+            if method in ("POST", "PUT"):
+                data = json.dumps(generator.task())
+            elif method == "PATCH":
+                data = json.dumps({"description": generator.text( \
+                    generator.length(DESCRIPTION_MIN_LENGTH, \
+                    DESCRIPTION_MAX_LENGTH))})
+            def callback(response, error, method=method, url=url, \
+                scheduled=scheduled):
+                stats.record(method, url, scheduled, response, error)
+                if method == "POST":
+                    created(response, error)
+            engine.submit(method, urlparse.urljoin(base_url, url), \
+                data=data, callback=callback)
+        if sent >= total and not engine.queue and not engine.busy:
+            break
+        wait = OPEN_LOOP_POLL
+        if sent < total:
+            wait = min(wait, max(start + sent / rate - time.time(), 0.0))
+        engine.step(wait)
+    stats.sent = sent
+    stats.elapsed = time.time() - start
+    return stats
+
+def print_open_loop_summary(stats, rate, duration):
+    """
+    Print intended and achieved rates and latency from the scheduled send
+    time by route.
+    """
+    print_header("Open-loop summary")
+    print "Intended rate: %.1f req/s Requests: %d Scheduled over: %.2fs " % \
+        (rate, stats.sent, duration) + "Finished after: %.2fs" % \
+        (stats.elapsed)
+    sent_rate = 0.0
+    if stats.last_sent is not None and stats.last_sent > stats.start:
+        sent_rate = stats.lag.count / (stats.last_sent - stats.start)
+    completed_rate = 0.0
+    if stats.last_completed is not None and \
+        stats.last_completed > stats.start:
+        completed_rate = stats.completed / \
+            (stats.last_completed - stats.start)
+    print "Achieved send rate: %.1f req/s Completion rate: %.1f req/s " % \
+        (sent_rate, completed_rate) + "Errors: %d" % (stats.errors)
+    print "Send lag p50: %.2f ms p99: %.2f ms max: %.2f ms" % \
+        (stats.lag.percentile(50.0) * 1000.0, \
+        stats.lag.percentile(99.0) * 1000.0, stats.lag.max * 1000.0)
+    print "Latency from scheduled send time:"
+    print_latency_summary(LATENCY)
+    print "Service time from actual send time:"
+    print_latency_summary(stats.service)
+    print "------------------------------------------------------------------"
+
+def parse_profile(text):
+    """
+    Parse a workload profile name or "OPERATION=weight,..." into
+    (operation, weight) tuples.
+    """
+    text = WORKLOAD_PROFILES.get(text, text)
+    operations = []
+    for part in text.split(","):
+        operation, _, weight = part.strip().partition("=")
+        operation = operation.strip().upper()
+        if operation not in WORKLOAD_OPERATIONS:
+            raise ValueError("unknown operation %s in profile" % (operation))
+        try:
+            weight = float(weight)
+        except ValueError:
+            raise ValueError("invalid weight in %s" % (part.strip()))
+        if weight <= 0:
+            raise ValueError("weight of %s must be positive" % (operation))
+        operations.append((operation, weight))
+    return operations
+
+class ZipfianGenerator(object):
+    """
+    Zipfian distributed ranks, rank 0 the most frequent. Uses the method of
+    Gray et al., "Quickly generating billion-record synthetic databases",
+    with the zeta constant kept up to date as items come and go.
+    """
+    def __init__(self, items, theta=ZIPFIAN_THETA):
+        self.theta = theta
+        self.alpha = 1.0 / (1.0 - theta)
+        self.zeta2 = 1.0 + 0.5 ** theta
+        self.items = 0
+        self.zetan = 0.0
+        self.eta = 0.0
+        self.resize(items)
+
+    def resize(self, items):
+        """
+        Change number of items.
+        """
+        while self.items < items:
+            self.items += 1
+            self.zetan += 1.0 / self.items ** self.theta
+        while self.items > items:
+            self.zetan -= 1.0 / self.items ** self.theta
+            self.items -= 1
+        if self.zetan > self.zeta2:
+            self.eta = (1.0 - (2.0 / self.items) ** (1.0 - self.theta)) / \
+                (1.0 - self.zeta2 / self.zetan)
+
+    def next(self, random_generator):
+        """
+        Return next rank.
+        """
+        u = random_generator.random()
+        uz = u * self.zetan
+        if uz < 1.0:
+            return 0
+        if uz < self.zeta2:
+            return 1
+        rank = int(self.items * (self.eta * u - self.eta + 1.0) ** self.alpha)
+        return min(rank, self.items - 1)
+
+class KeySpace(object):
+    """
+    Thread safe task ids in insertion order. Ids are picked uniformly,
+    zipfian with the oldest tasks hottest or latest with the newest tasks
+    hottest.
+    """
+    def __init__(self, ids, distribution="zipfian", theta=ZIPFIAN_THETA):
+        self.ids = sorted(ids)
+        self.distribution = distribution
+        self.zipfian = None
+        if distribution != "uniform":
+            self.zipfian = ZipfianGenerator(len(self.ids), theta)
+        self.lock = threading.Lock()
+
+    def choose(self, random_generator, remove=False):
+        """
+        Return an id or None when there are no tasks. Removed ids are no
+        longer handed out.
+        """
+        with self.lock:
+            if not self.ids:
+                return None
+            if self.zipfian is None:
+                index = random_generator.randrange(len(self.ids))
+            else:
+                index = self.zipfian.next(random_generator)
+                if self.distribution == "latest":
+                    index = len(self.ids) - 1 - index
+            task_id = self.ids[index]
+            if remove:
+                del self.ids[index]
+                if self.zipfian is not None:
+                    self.zipfian.resize(len(self.ids))
+            return task_id
+
+    def add(self, task_id):
+        """
+        Add id of a new task.
+        """
+        with self.lock:
+            self.ids.append(task_id)
+            if self.zipfian is not None:
+                self.zipfian.resize(len(self.ids))
+
+    def size(self):
+        """
+        Return number of ids.
+        """
+        return len(self.ids)
+
+def workload_keys(base_url, records, workers=DEFAULT_LOAD_WORKERS, seed=0):
+    """
+    Return ids of up to records existing tasks, inserting tasks with
+    concurrent POST requests when the server has fewer.
+    """
+    ids = []
+    response = run_request(base_url, "/tasks.json?pageSize=%d" % (records))
+    if response is not None and response.status_code == 200:
+        try:
+            ids = [task["id"] for task in response.json()]
+        except (ValueError, KeyError, TypeError):
+            ids = []
+    tasks = Queue.Queue()
+    for task in TaskGenerator(seed).tasks(max(records - len(ids), 0)):
+        tasks.put(task)
+    lock = threading.Lock()
+    def insert():
+        while True:
+            try:
+                task = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            response = run_request(base_url, "/tasks.json", method="POST", \
+                data=json.dumps(task))
+            if response is not None and response.status_code == 200:
+                with lock:
+                    ids.append(response.json()["id"])
+    threads = []
+    for _ in range(workers if not tasks.empty() else 0):
+        thread = threading.Thread(target=insert)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return ids
+
+def workload_worker(base_url, operations, keys, stats, counter, seed):
+    """
+    Run operations drawn from the profile until the counter is exhausted.
+    """
+    random_generator = random.Random(seed)
+    generator = TaskGenerator(seed)
+    weights = []
+    total_weight = 0.0
+    for _, weight in operations:
+        total_weight += weight
+        weights.append(total_weight)
+    while counter.next() is not None:
+        operation = operations[bisect.bisect_right(weights, \
+            random_generator.random() * total_weight)][0]
+        method, url = WORKLOAD_OPERATIONS[operation]
+        data = None
+        if operation == "LIST":
+            pages = max(keys.size() // DEFAULT_WORKLOAD_PAGE_SIZE, 1)
+            url = "/tasks.json?page=%d&pageSize=%d" % \
+                (random_generator.randint(1, pages), DEFAULT_WORKLOAD_PAGE_SIZE)
+        elif operation in ("POST", "PUT"):
+            data = json.dumps(generator.task())
+        elif operation == "PATCH":
+            data = json.dumps({"description": generator.text( \
+                generator.length(DESCRIPTION_MIN_LENGTH, \
+                DESCRIPTION_MAX_LENGTH))})
+        if ":id" in url:
+            task_id = keys.choose(random_generator, \
+                remove=operation == "DELETE")
+            if task_id is None:
+                stats.record(method, url, False)
+                continue
+            url = url.replace(":id", str(task_id))
+        body = load_request(base_url, url, stats, method=method, data=data)
+        if operation == "POST" and isinstance(body, dict) and "id" in body:
+            keys.add(body["id"])
+
+def run_workload(base_url, operations, distribution="zipfian", \
+    records=DEFAULT_WORKLOAD_RECORDS, theta=ZIPFIAN_THETA, \
+    workers=DEFAULT_LOAD_WORKERS, duration=None, iterations=None, seed=0):
+    """
+    Load up to records tasks, then run the profile operations on concurrent
+    workers. Returns (stats, keys, elapsed).
+    """
+    if duration is None and iterations is None:
+        duration = DEFAULT_LOAD_DURATION
+    keys = KeySpace(workload_keys(base_url, records, workers, seed), \
+        distribution, theta)
+    # Only the run phase counts
+    LATENCY.reset()
+    stats = LoadStats()
+    counter = LoadCounter(duration=duration, iterations=iterations)
+    threads = []
+    start = time.time()
+    for index in range(workers):
+        thread = threading.Thread(target=workload_worker, \
+            args=(base_url, operations, keys, stats, counter, \
+            seed + index + 1))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return (stats, keys, time.time() - start)
+
+def print_workload_summary(stats, operations, distribution, keys, elapsed):
+    """
+    Print throughput, error rate and latency of every operation.
+    """
+    print_header("Workload summary")
+    print "Profile: %s Keys: %s over %d tasks Time: %.2fs" % \
+        (",".join("%s=%g" % operation for operation in operations), \
+        distribution, keys.size(), elapsed)
+    counts = dict(((method, route), count) \
+        for (method, route), count in stats.counts.items())
+    histograms = LATENCY.snapshot()
+    print "%-8s %9s %8s %8s %9s %8s %8s %8s" % ("Op", "Requests", \
+        "Errors", "Error %", "Ops/s", "p50 ms", "p99 ms", "max ms")
+    for operation, _ in operations:
+        method, route = WORKLOAD_OPERATIONS[operation]
+        requests_count, errors = counts.get((method, route), (0, 0))
+        histogram = histograms.get(method + " " + route, LatencyHistogram())
+        print "%-8s %9d %8d %8.2f %9.1f %8.2f %8.2f %8.2f" % (operation, \
+            requests_count, errors, \
+            100.0 * errors / requests_count if requests_count else 0.0, \
+            requests_count / elapsed if elapsed > 0 else 0.0, \
+            histogram.percentile(50.0) * 1000.0, \
+            histogram.percentile(99.0) * 1000.0, histogram.max * 1000.0)
+    print_cache_summary(CACHE)
+    print "------------------------------------------------------------------"
+
+class TaskGenerator(object):
+    """
+    Seeded generator of valid tasks.
+    """
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        words = [self.random.choice(SEED_WORDS) \
+            for _ in xrange(SEED_TEXT_WORDS)]
+        self.pool = " ".join(words) + " "
+        # Texts are slices of the pool starting at a word boundary
+        self.starts = [0]
+        for word in words[:-1]:
+            self.starts.append(self.starts[-1] + len(word) + 1)
+        self.last_start = len(self.pool) - DESCRIPTION_MAX_LENGTH - 1
+        self.starts = [start for start in self.starts \
+            if start <= self.last_start]
+
+    def length(self, minimum, maximum):
+        """
+        Return random length between minimum and maximum inclusive.
+        """
+        return minimum + int(self.random.random() * (maximum - minimum + 1))
+
+    def text(self, length):
+        """
+        Return text of random words cut to length.
+        """
+        start = self.starts[int(self.random.random() * len(self.starts))]
+        text = self.pool[start:start + length]
+        if text.endswith(" "):
+            text = text[:-1] + "s"
+        return text
+
+    def deadline(self):
+        """
+        Return random ISO 8601 deadline with a timezone offset.
+        """
+        moment = SEED_EPOCH + datetime.timedelta(seconds= \
+            int(self.random.random() * SEED_DEADLINE_SPAN))
+        hours = int(self.random.random() * 24) - 11
+        return "%s%s%02d:00" % (moment.strftime("%Y-%m-%dT%H:%M:%S"), \
+            "-" if hours < 0 else "+", abs(hours))
+
+    def task(self):
+        """
+        Return new task with title, description and deadline.
+        """
+        return {
+            "title": self.text(self.length(TITLE_MIN_LENGTH, \
+                TITLE_MAX_LENGTH)),
+            "description": self.text(self.length(DESCRIPTION_MIN_LENGTH, \
+                DESCRIPTION_MAX_LENGTH)),
+            "deadline": self.deadline()
+        }
+
+    def tasks(self, count):
+        """
+        Yield count new tasks.
+        """
+        for _ in xrange(count):
+            yield self.task()
+
+def seed_http(base_url, tasks, connections=DEFAULT_SEED_CONNECTIONS, \
+    timeout=DEFAULT_TIMEOUT, on_insert=None):
+    """
+    Insert tasks with concurrent POST requests and return inserted count.
+    on_insert(task, task_id) is called for every inserted task.
+    """
+    engine = AsyncEngine(connections=connections, timeout=timeout)
+    url = urlparse.urljoin(base_url, "/tasks.json")
+    counts = {"inserted": 0, "failed": 0}
+    def submit_next():
+        for task in tasks:
+            engine.submit("POST", url, data=json.dumps(task), \
+                callback=lambda response, error, task=task: \
+                callback(task, response))
+            return
+    def callback(task, response):
+        if response is not None and response.status_code == 200:
+            counts["inserted"] += 1
+            if on_insert is not None:
+                on_insert(task, response.json()["id"])
+        else:
+            counts["failed"] += 1
+        submit_next()
+    # Keep one request queued per connection, the rest stay in generator
+    for _ in range(connections):
+        submit_next()
+    engine.run()
+    return (counts["inserted"], counts["failed"])
+
+def seed_sqlite(path, tasks, batch_size=DEFAULT_SEED_BATCH, on_insert=None):
+    """
+    Insert tasks directly into tasks table in batched transactions.
+    on_insert(task, task_id) is called for every inserted task.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("CREATE TABLE IF NOT EXISTS tasks " + \
+            "(id INTEGER PRIMARY KEY, title TEXT, description TEXT, " + \
+            "deadline TEXT)")
+        # Ids are assigned here so callers know them without a query
+        task_id = connection.execute( \
+            "SELECT IFNULL(MAX(id), 0) FROM tasks").fetchone()[0]
+        inserted = 0
+        batch = []
+        for task in tasks:
+            task_id += 1
+            batch.append((task_id, task["title"], task["description"], \
+                task["deadline"]))
+            if on_insert is not None:
+                on_insert(task, task_id)
+            if len(batch) >= batch_size:
+                inserted += insert_batch(connection, batch)
+                batch = []
+        if batch:
+            inserted += insert_batch(connection, batch)
+        return (inserted, 0)
+    finally:
+        connection.close()
+
+def insert_batch(connection, batch):
+    """
+    Insert batch of rows in one transaction.
+    """
+    connection.executemany("INSERT INTO tasks (id, title, description, " + \
+        "deadline) VALUES (?, ?, ?, ?)", batch)
+    connection.commit()
+    return len(batch)
+
+def seed_main(argv):
+    """
+    Seed command, fills server or SQLite file with generated tasks.
+    """
+    parser = argparse.ArgumentParser(prog='test.py seed', \
+        description='fill node-challenge server with generated tasks', \
+        epilog='Example: ./test.py seed http://127.0.0.1:8080/ ' + \
+        '--count 100000')
+    parser.add_argument('target', \
+        help='server endpoint, or SQLite file path in sqlite mode')
+    parser.add_argument('--count', type=int, default=DEFAULT_SEED_COUNT, \
+        help='number of tasks to insert')
+    parser.add_argument('--mode', choices=('http', 'sqlite'), \
+        default='http', help='insert with POST requests or write ' + \
+        'directly into the SQLite tasks table')
+    parser.add_argument('--seed', type=int, default=0, \
+        help='random generator seed')
+    parser.add_argument('--connections', type=int, \
+        default=DEFAULT_SEED_CONNECTIONS, \
+        help='concurrent connections in http mode')
+    parser.add_argument('--batch', type=int, default=DEFAULT_SEED_BATCH, \
+        help='rows per transaction in sqlite mode')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, \
+        help='per-request timeout in seconds')
+    args = parser.parse_args(argv)
+    tasks = TaskGenerator(args.seed).tasks(args.count)
+    start = time.time()
+    if args.mode == "sqlite":
+        inserted, failed = seed_sqlite(args.target, tasks, \
+            batch_size=args.batch)
+    else:
+        inserted, failed = seed_http(args.target, tasks, \
+            connections=args.connections, timeout=args.timeout)
+    elapsed = time.time() - start
+    print_header("Seed summary")
+    print "Mode: %s Inserted: %d Failed: %d Time: %.2fs Rows/s: %.1f" % \
+        (args.mode, inserted, failed, elapsed, \
+        inserted / elapsed if elapsed > 0 else 0.0)
+    print "------------------------------------------------------------------"
+    return 0 if failed == 0 else 1
+
+def median(values):
+    """
+    Return median of values.
+    """
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+def linear_fit(xs, ys):
+    """
+    Return (intercept, slope) of least squares line through points.
+    """
+    count = float(len(xs))
+    mean_x = sum(xs) / count
+    mean_y = sum(ys) / count
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if variance == 0:
+        return (mean_y, 0.0)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / \
+        variance
+    return (mean_y - slope * mean_x, slope)
+
+def write_results(rows, fields, path=None, output_format="csv", extra=None):
+    """
+    Write result rows as CSV or JSON to path, or to stdout.
+    """
+    stream = sys.stdout if path is None or path == "-" else open(path, "w")
+    try:
+        if output_format == "json":
+            document = {"rows": rows}
+            if extra:
+                document.update(extra)
+            json.dump(document, stream, indent=2, sort_keys=True)
+            stream.write("\n")
+        else:
+            writer = csv.DictWriter(stream, fieldnames=fields, \
+                extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+class SummaryStream(object):
+    """
+    Prints to stderr while result rows are written to stdout, so the rows
+    stay valid CSV or JSON. With optional the rows are only written when a
+    path is given.
+    """
+    def __init__(self, path=None, optional=False):
+        self.redirect = path == "-" or (path is None and not optional)
+        self.stdout = None
+
+    def __enter__(self):
+        if self.redirect:
+            self.stdout = sys.stdout
+            sys.stdout = sys.stderr
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.redirect:
+            sys.stdout = self.stdout
+        return False
+
+def timed_request(base_url, url, method="GET", data=None, timeout=None):
+    """
+    Run request and return (response, seconds).
+    """
+    start = time.time()
+    response = run_request(base_url, url, method=method, data=data, \
+        timeout=timeout)
+    return (response, time.time() - start)
+
+def task_count(base_url, url="/tasks.json"):
+    """
+    Return X-Count reported by HEAD request or None.
+    """
+    response = run_request(base_url, url, method="HEAD")
+    if response is None or "x-count" not in response.headers:
+        return None
+    return int(response.headers["x-count"])
+
+def sweep_pages(last_page, points):
+    """
+    Return up to points page numbers spread evenly from 1 to last_page.
+    """
+    if last_page <= points:
+        return range(1, last_page + 1)
+    step = (last_page - 1) / float(points - 1)
+    return sorted(set(int(round(1 + step * i)) for i in range(points)))
+
+def fit_pagination(rows):
+    """
+    Fit latency against offset and return scaling summary.
+    """
+    points = [(row["offset"], row["latency_ms"]) for row in rows \
+        if row["offset"] > 0 and row["latency_ms"] > 0]
+    intercept, slope = linear_fit([row["offset"] for row in rows], \
+        [row["latency_ms"] for row in rows])
+    exponent = 0.0
+    if len(points) > 1:
+        exponent = linear_fit([math.log(offset) for offset, _ in points], \
+            [math.log(latency) for _, latency in points])[1]
+    first = rows[0]["latency_ms"]
+    last = rows[-1]["latency_ms"]
+    return {
+        "page_size": rows[0]["page_size"],
+        "intercept_ms": intercept,
+        "ms_per_1000_rows": slope * 1000.0,
+        "exponent": exponent,
+        "last_first_ratio": last / first if first > 0 else 0.0
+    }
+
+def measure_pages(base_url, page_size, count, points, samples):
+    """
+    Return rows of median page latency across the offsets, or None when a
+    request failed.
+    """
+    # Only full pages are measured so page sizes stay comparable
+    last_page = max(count // page_size, 1)
+    rows = []
+    for page in sweep_pages(last_page, points):
+        url = "/tasks.json?page=%d&pageSize=%d" % (page, page_size)
+        latencies = []
+        response = None
+        for _ in range(samples):
+            response, seconds = timed_request(base_url, url)
+            if response is None or response.status_code != 200:
+                print_error("Request %s failed" % (url))
+                return None
+            latencies.append(seconds * 1000.0)
+        rows.append({
+            "page_size": page_size,
+            "page": page,
+            "offset": (page - 1) * page_size,
+            "tasks": len(response.json()),
+            "bytes": len(response.content),
+            "latency_ms": median(latencies)
+        })
+    return rows
+
+def print_pagination_summary(count, fits):
+    """
+    Print latency scaling of every pageSize.
+    """
+    print_header("Pagination summary for %d tasks" % (count))
+    print "%10s %12s %16s %10s %10s" % ("pageSize", "base ms", \
+        "ms/1000 rows", "exponent", "last/first")
+    for fit in fits:
+        print "%10d %12.2f %16.3f %10.2f %10.2f" % (fit["page_size"], \
+            fit["intercept_ms"], fit["ms_per_1000_rows"], fit["exponent"], \
+            fit["last_first_ratio"])
+        if fit["superlinear"]:
+            print_error("pageSize=%d late pages slow down superlinearly" % \
+                (fit["page_size"]))
+    print "------------------------------------------------------------------"
+
+def pages_main(argv):
+    """
+    Pages command, measures latency of deep pages of /tasks.json.
+    """
+    parser = argparse.ArgumentParser(prog='test.py pages', \
+        description='measure /tasks.json latency against page offset', \
+        epilog='Example: ./test.py pages http://127.0.0.1:8080/ ' + \
+        '--page-sizes 10,100,1000 --output pages.csv')
+    parser.add_argument('endpoint', help='server endpoint')
+    parser.add_argument('--page-sizes', default=DEFAULT_PAGE_SIZES, \
+        help='comma separated pageSize values')
+    parser.add_argument('--points', type=int, default=DEFAULT_PAGE_POINTS, \
+        help='number of pages measured per pageSize')
+    parser.add_argument('--samples', type=int, \
+        default=DEFAULT_PAGE_SAMPLES, help='requests per page, the ' + \
+        'median latency is reported')
+    parser.add_argument('--threshold', type=float, \
+        default=DEFAULT_SUPERLINEAR_EXPONENT, help='flag pageSize when ' + \
+        'latency grows with offset faster than offset^threshold')
+    parser.add_argument('--format', choices=('csv', 'json'), \
+        default='csv', help='output format')
+    parser.add_argument('--output', help='output file, default stdout')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, \
+        help='per-request timeout in seconds')
+    args = parser.parse_args(argv)
+    with SummaryStream(args.output):
+        configure_transport(timeout=args.timeout)
+        count = task_count(args.endpoint)
+        if count is None:
+            print_error("Unable to read X-Count from %s" % (args.endpoint))
+            return 1
+        rows = []
+        fits = []
+        for page_size in [int(size) for size in args.page_sizes.split(",")]:
+            size_rows = measure_pages(args.endpoint, page_size, count, \
+                args.points, args.samples)
+            if size_rows is None:
+                return 1
+            fit = fit_pagination(size_rows)
+            fit["superlinear"] = fit["exponent"] > args.threshold
+            fits.append(fit)
+            rows.extend(size_rows)
+        print_pagination_summary(count, fits)
+    write_results(rows, PAGINATION_FIELDS, args.output, args.format, \
+        {"count": count, "fits": fits})
+    return 1 if any(fit["superlinear"] for fit in fits) else 0
+
+class SearchCorpus(object):
+    """
+    Generated tasks carrying search terms of known frequency, with an
+    inverted index of the task ids containing each term.
+    """
+    def __init__(self, selectivities, seed=0, tag=None):
+        if tag is None:
+            tag = binascii.hexlify(os.urandom(2))
+        self.generator = TaskGenerator(seed)
+        self.random = random.Random(seed + 1)
+        # Search words never contain q, so these terms match only themselves
+        self.terms = [("xq%s%02dqx" % (tag, index), selectivity) \
+            for index, selectivity in enumerate(selectivities)]
+        self.postings = dict((term, array.array("l")) \
+            for term, _ in self.terms)
+        self.size = 0
+
+    def tasks(self, count):
+        """
+        Yield count new tasks with search terms added to descriptions.
+        """
+        for _ in xrange(count):
+            task = self.generator.task()
+            terms = [term for term, selectivity in self.terms \
+                if self.random.random() < selectivity]
+            if terms:
+                suffix = " " + " ".join(terms)
+                task["description"] = task["description"] \
+                    [:DESCRIPTION_MAX_LENGTH - len(suffix)] + suffix
+            yield task
+
+    def add(self, task, task_id):
+        """
+        Index inserted task.
+        """
+        self.size += 1
+        for term, _ in self.terms:
+            if term in task["description"]:
+                self.postings[term].append(task_id)
+
+    def sort(self):
+        """
+        Sort postings, needed after tasks were inserted out of order.
+        """
+        for term in self.postings:
+            self.postings[term] = array.array("l", \
+                sorted(self.postings[term]))
+
+    def count(self, term):
+        """
+        Return number of tasks containing term.
+        """
+        return len(self.postings[term])
+
+    def contains(self, term, task_id):
+        """
+        Return True when task contains term.
+        """
+        postings = self.postings[term]
+        index = bisect.bisect_left(postings, task_id)
+        return index < len(postings) and postings[index] == task_id
+
+def verify_search(corpus, term, page_size, response):
+    """
+    Verify search response against the corpus index, return error or None.
+    """
+    if response.status_code != 200:
+        return "Status code %d != 200" % (response.status_code)
+    if "x-count" not in response.headers:
+        return "X-Count value is undefined"
+    expected = corpus.count(term)
+    if int(response.headers["x-count"]) != expected:
+        return "X-Count value %s != %d" % \
+            (response.headers["x-count"], expected)
+    tasks = response.json()
+    if len(tasks) != min(expected, page_size):
+        return "JSON array length missmatch %d != %d" % \
+            (len(tasks), min(expected, page_size))
+    for task in tasks:
+        if not corpus.contains(term, task["id"]):
+            return "Task %s doesn't contain %s" % (task["id"], term)
+    return None
+
+def measure_search(base_url, corpus, term, page_size, samples, connections, \
+    timeout=DEFAULT_TIMEOUT):
+    """
+    Run samples concurrent searches for term and return result row.
+    """
+    engine = AsyncEngine(connections=connections, timeout=timeout)
+    url = urlparse.urljoin(base_url, "/tasks.json?q=%s&pageSize=%d" % \
+        (term, page_size))
+    histogram = LatencyHistogram()
+    errors = []
+    def callback(response, error):
+        if response is None:
+            errors.append(str(error))
+            return
+        histogram.record(response.elapsed)
+        failure = verify_search(corpus, term, page_size, response)
+        if failure is not None:
+            errors.append(failure)
+    for _ in range(samples):
+        engine.submit("GET", url, callback=callback)
+    start = time.time()
+    engine.run()
+    elapsed = time.time() - start
+    return {
+        "matches": corpus.count(term),
+        "p50_ms": histogram.percentile(50.0) * 1000.0,
+        "p90_ms": histogram.percentile(90.0) * 1000.0,
+        "max_ms": histogram.max * 1000.0,
+        "queries_per_s": samples / elapsed if elapsed > 0 else 0.0,
+        "errors": len(errors),
+        "error": errors[0] if errors else ""
+    }
+
+def print_search_summary(rows):
+    """
+    Print search latency of every term and corpus size.
+    """
+    print_header("Search summary")
+    print "%10s %10s %12s %10s %9s %9s %9s %9s %7s" % ("corpus", "db", \
+        "selectivity", "matches", "p50 ms", "p90 ms", "max ms", "q/s", \
+        "errors")
+    for row in rows:
+        print "%10d %10s %12g %10d %9.2f %9.2f %9.2f %9.1f %7d" % \
+            (row["corpus_size"], row["db_size"], row["selectivity"], \
+            row["matches"], row["p50_ms"], row["p90_ms"], row["max_ms"], \
+            row["queries_per_s"], row["errors"])
+        if row["errors"]:
+            print_error("%s: %s" % (row["term"], row["error"]))
+    print "------------------------------------------------------------------"
+
+def search_main(argv):
+    """
+    Search command, measures search latency against selectivity and size.
+    """
+    parser = argparse.ArgumentParser(prog='test.py search', \
+        description='measure /tasks.json?q= latency for search terms of ' + \
+        'known frequency while the database grows', \
+        epilog='Example: ./test.py search http://127.0.0.1:8080/ ' + \
+        '--sizes 10000,100000 --mode sqlite --database mydb.db')
+    parser.add_argument('endpoint', help='server endpoint')
+    parser.add_argument('--sizes', default=DEFAULT_SEARCH_SIZES, \
+        help='comma separated corpus sizes measured in turn')
+    parser.add_argument('--selectivities', \
+        default=DEFAULT_SEARCH_SELECTIVITIES, \
+        help='comma separated fractions of tasks containing each term')
+    parser.add_argument('--mode', choices=('http', 'sqlite'), \
+        default='http', help='insert corpus with POST requests or ' + \
+        'directly into the SQLite database')
+    parser.add_argument('--database', default='mydb.db', \
+        help='SQLite file used by the server in sqlite mode')
+    parser.add_argument('--page-size', type=int, default=10, \
+        help='pageSize of search requests')
+    parser.add_argument('--samples', type=int, \
+        default=DEFAULT_SEARCH_SAMPLES, help='searches per term and size')
+    parser.add_argument('--connections', type=int, \
+        default=DEFAULT_SEED_CONNECTIONS, help='concurrent connections')
+    parser.add_argument('--seed', type=int, default=0, \
+        help='random generator seed')
+    parser.add_argument('--format', choices=('csv', 'json'), \
+        default='csv', help='output format')
+    parser.add_argument('--output', help='output file, default stdout')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, \
+        help='per-request timeout in seconds')
+    args = parser.parse_args(argv)
+    with SummaryStream(args.output):
+        configure_transport(timeout=args.timeout)
+        corpus = SearchCorpus([float(value) for value in \
+            args.selectivities.split(",")], seed=args.seed)
+        rows = []
+        for size in sorted(int(value) for value in args.sizes.split(",")):
+            tasks = corpus.tasks(size - corpus.size)
+            if args.mode == "sqlite":
+                seed_sqlite(args.database, tasks, on_insert=corpus.add)
+            else:
+                seed_http(args.endpoint, tasks, connections=args.connections, \
+                    timeout=args.timeout, on_insert=corpus.add)
+            corpus.sort()
+            db_size = task_count(args.endpoint)
+            for term, selectivity in corpus.terms:
+                row = measure_search(args.endpoint, corpus, term, \
+                    args.page_size, args.samples, args.connections, \
+                    timeout=args.timeout)
+                row.update({"corpus_size": corpus.size, "db_size": db_size, \
+                    "term": term, "selectivity": selectivity})
+                rows.append(row)
+        print_search_summary(rows)
+    write_results(rows, SEARCH_FIELDS, args.output, args.format)
+    return 1 if any(row["errors"] for row in rows) else 0
+
+def quantile(values, fraction):
+    """
+    Return value at fraction of the sorted values, nearest rank.
+    """
+    ordered = sorted(values)
+    rank = max(int(math.ceil(fraction * len(ordered))), 1)
+    return ordered[rank - 1]
+
+def mann_whitney(first, second):
+    """
+    Return one-sided p-value of the Mann-Whitney U test that values of
+    second tend to be larger than those of first. Uses the normal
+    approximation with tie and continuity correction.
+    """
+    values = sorted([(value, 0) for value in first] + \
+        [(value, 1) for value in second])
+    total = len(values)
+    rank_sum = 0.0
+    ties = 0.0
+    index = 0
+    while index < total:
+        end = index
+        while end + 1 < total and values[end + 1][0] == values[index][0]:
+            end += 1
+        # Tied values share the average of their ranks
+        rank = (index + end) / 2.0 + 1.0
+        size = end - index + 1
+        ties += size ** 3 - size
+        for position in range(index, end + 1):
+            if values[position][1] == 1:
+                rank_sum += rank
+        index = end + 1
+    count1 = len(first)
+    count2 = len(second)
+    u = rank_sum - count2 * (count2 + 1) / 2.0
+    mean = count1 * count2 / 2.0
+    variance = count1 * count2 / 12.0 * \
+        ((total + 1) - ties / (total * (total - 1)))
+    if variance <= 0:
+        return 0.5
+    z = (u - mean - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2.0))
+
+def bootstrap_ratio(first, second, rounds=BENCH_BOOTSTRAP_ROUNDS, \
+    confidence=BENCH_CONFIDENCE, seed=0):
+    """
+    Return (low, high) confidence interval of median(second) /
+    median(first) from a seeded percentile bootstrap.
+    """
+    random_generator = random.Random(seed)
+    ratios = []
+    for _ in range(rounds):
+        sample1 = [first[int(random_generator.random() * len(first))] \
+            for _ in first]
+        sample2 = [second[int(random_generator.random() * len(second))] \
+            for _ in second]
+        ratios.append(median(sample2) / median(sample1))
+    ratios.sort()
+    tail = (1.0 - confidence) / 2.0
+    return (ratios[int(tail * rounds)], \
+        ratios[min(int((1.0 - tail) * rounds), rounds - 1)])
+
+def bench_request(workload, random_generator, generator, ids, count):
+    """
+    Return (method, url, data) of the next request of a workload.
+    """
+    if workload == "list":
+        return ("GET", "/tasks.json", None)
+    if workload == "page":
+        return ("GET", "/tasks.json?page=%d&pageSize=%d" % \
+            (max(count // BENCH_PAGE_SIZE, 1), BENCH_PAGE_SIZE), None)
+    if workload == "search":
+        return ("GET", "/tasks.json?q=%s" % (BENCH_SEARCH_TERM), None)
+    if workload == "post":
+        return ("POST", "/tasks.json", json.dumps(generator.task()))
+    url = "/tasks/%s.json" % (ids[random_generator.randrange(len(ids))])
+    if workload == "patch":
+        return ("PATCH", url, json.dumps({"description": generator.text( \
+            generator.length(DESCRIPTION_MIN_LENGTH, \
+            DESCRIPTION_MAX_LENGTH))}))
+    return ("GET", url, None)
+
+def run_benchmark(base_url, workloads, samples=BENCH_SAMPLES, \
+    warmup=BENCH_WARMUP, count=BENCH_TASKS, seed=0):
+    """
+    Fill the server up to count tasks and run every workload sequentially.
+    Returns {workload: {"samples_ms": [...], "errors": n}} or None when
+    there are no tasks.
+    """
+    ids = workload_keys(base_url, count, seed=seed)
+    if not ids:
+        return None
+    results = collections.OrderedDict()
+    for workload in workloads:
+        random_generator = random.Random(seed)
+        generator = TaskGenerator(seed)
+        latencies = []
+        errors = 0
+        created = []
+        for number in range(warmup + samples):
+            method, url, data = bench_request(workload, random_generator, \
+                generator, ids, count)
+            response, seconds = timed_request(base_url, url, method=method, \
+                data=data)
+            if response is None or response.status_code != 200:
+                errors += 1
+                continue
+            if method == "POST":
+                created.append(response.json()["id"])
+            if number >= warmup:
+                latencies.append(seconds * 1000.0)
+        # Created tasks are removed so the next workload and run see the
+        # same database
+        for task_id in created:
+            run_request(base_url, "/tasks/%s.json" % (task_id), \
+                method="DELETE")
+        results[workload] = {"samples_ms": latencies, "errors": errors}
+    return results
+
+def compare_benchmark(results, baseline, threshold=BENCH_THRESHOLD, \
+    alpha=BENCH_ALPHA, seed=0):
+    """
+    Return result rows, compared with the baseline workloads when given.
+    A workload regressed when its median grew by more than threshold and
+    the Mann-Whitney test is significant at alpha.
+    """
+    rows = []
+    for workload, result in results.items():
+        latencies = result["samples_ms"]
+        row = collections.OrderedDict()
+        row["workload"] = workload
+        row["samples"] = len(latencies)
+        row["errors"] = result["errors"]
+        row["median_ms"] = median(latencies) if latencies else None
+        row["p90_ms"] = quantile(latencies, 0.9) if latencies else None
+        for field in BENCH_FIELDS[5:]:
+            row[field] = None
+        reference = None
+        if baseline is not None:
+            reference = baseline["workloads"].get(workload)
+        if result["errors"] or not latencies:
+            row["verdict"] = "errors"
+        elif reference is None or not reference["samples_ms"]:
+            row["verdict"] = "new" if baseline is not None else ""
+        else:
+            before = reference["samples_ms"]
+            row["baseline_ms"] = median(before)
+            row["ratio"] = row["median_ms"] / row["baseline_ms"]
+            row["ci_low"], row["ci_high"] = bootstrap_ratio(before, \
+                latencies, seed=seed)
+            row["p_value"] = mann_whitney(before, latencies)
+            row["verdict"] = "ok"
+            if row["ratio"] > 1.0 + threshold and row["p_value"] < alpha:
+                row["verdict"] = "regressed"
+            elif row["ratio"] < 1.0 / (1.0 + threshold) and \
+                mann_whitney(latencies, before) < alpha:
+                row["verdict"] = "improved"
+        rows.append(row)
+    return rows
+
+def print_benchmark_summary(rows, confidence=BENCH_CONFIDENCE):
+    """
+    Print medians of every workload and their change against a baseline.
+    """
+    print_header("Benchmark summary")
+    print "%-8s %7s %6s %9s %9s %9s %7s %15s %8s %s" % ("Workload", \
+        "Samples", "Errors", "Median ms", "p90 ms", "Base ms", "Ratio", \
+        "%d%% CI" % (confidence * 100), "p", "Verdict")
+    for row in rows:
+        compared = row["ratio"] is not None
+        print "%-8s %7d %6d %9s %9s %9s %7s %15s %8s %s" % (row["workload"], \
+            row["samples"], row["errors"], \
+            "%.3f" % (row["median_ms"]) if row["samples"] else "-", \
+            "%.3f" % (row["p90_ms"]) if row["samples"] else "-", \
+            "%.3f" % (row["baseline_ms"]) if compared else "-", \
+            "%.3f" % (row["ratio"]) if compared else "-", \
+            "%.3f-%.3f" % (row["ci_low"], row["ci_high"]) \
+            if compared else "-", \
+            "%.4f" % (row["p_value"]) if compared else "-", row["verdict"])
+    print "------------------------------------------------------------------"
+
+def bench_main(argv):
+    """
+    Bench command, runs seeded workloads and gates on regressions against a
+    stored baseline.
+    """
+    parser = argparse.ArgumentParser(prog='test.py bench', \
+        description='run seeded benchmark workloads, save them as a ' + \
+        'baseline or compare them with one', \
+        epilog='Example: ./test.py bench http://127.0.0.1:8080/ ' + \
+        '--baseline baseline.json --threshold 0.1')
+    parser.add_argument('endpoint', help='server endpoint')
+    parser.add_argument('--workloads', default=",".join(BENCH_WORKLOADS), \
+        help='comma separated workloads out of %s' % \
+        (", ".join(BENCH_WORKLOADS)))
+    parser.add_argument('--samples', type=int, default=BENCH_SAMPLES, \
+        help='measured requests per workload')
+    parser.add_argument('--warmup', type=int, default=BENCH_WARMUP, \
+        help='unmeasured requests before each workload')
+    parser.add_argument('--tasks', type=int, default=BENCH_TASKS, \
+        help='tasks in the database, missing ones are inserted first')
+    parser.add_argument('--seed', type=int, default=0, \
+        help='random generator seed')
+    parser.add_argument('--save', metavar='PATH', \
+        help='save the results as a baseline file')
+    parser.add_argument('--baseline', metavar='PATH', \
+        help='compare with this baseline file')
+    parser.add_argument('--threshold', type=float, default=BENCH_THRESHOLD, \
+        help='relative growth of the median latency that fails the run')
+    parser.add_argument('--alpha', type=float, default=BENCH_ALPHA, \
+        help='significance level of the Mann-Whitney test')
+    parser.add_argument('--format', choices=('csv', 'json'), \
+        default='csv', help='output format')
+    parser.add_argument('--output', help='write result rows to this file')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, \
+        help='per-request timeout in seconds')
+    args = parser.parse_args(argv)
+    workloads = [workload.strip() for workload in args.workloads.split(",")]
+    for workload in workloads:
+        if workload not in BENCH_WORKLOADS:
+            parser.error("unknown workload %s" % (workload))
+    with SummaryStream(args.output, optional=True):
+        baseline = None
+        if args.baseline is not None:
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        configure_transport(timeout=args.timeout)
+        results = run_benchmark(args.endpoint, workloads, \
+            samples=args.samples, warmup=args.warmup, count=args.tasks, \
+            seed=args.seed)
+        if results is None:
+            print_error("No tasks available at %s" % (args.endpoint))
+            return 1
+        rows = compare_benchmark(results, baseline, threshold=args.threshold, \
+            alpha=args.alpha, seed=args.seed)
+        print_benchmark_summary(rows)
+        if args.save is not None:
+            with open(args.save, "w") as baseline_file:
+                json.dump({"created": time.time(), "endpoint": args.endpoint, \
+                    "tasks": args.tasks, "seed": args.seed, \
+                    "samples": args.samples, "warmup": args.warmup, \
+                    "workloads": results}, baseline_file)
+        failed = [row for row in rows \
+            if row["verdict"] in ("errors", "regressed")]
+        for row in failed:
+            print_error("%s %s" % (row["workload"], row["verdict"]))
+    if args.output is not None:
+        write_results(rows, BENCH_FIELDS, args.output, args.format)
+    return 1 if failed else 0
+
+def encode_body(content, encoding, level=COMPRESSION_LEVEL):
+    """
+    Return content compressed with gzip or deflate, as is for identity.
+    """
+    if encoding == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, \
+            16 + zlib.MAX_WBITS)
+        return compressor.compress(content) + compressor.flush()
+    if encoding == "deflate":
+        return zlib.compress(content, level)
+    return content
+
+def decode_body(content, encoding):
+    """
+    Return content decompressed from gzip or deflate, as is for identity.
+    Deflate is accepted with and without the zlib header.
+    """
+    if encoding == "gzip":
+        return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(content)
+        except zlib.error:
+            return zlib.decompress(content, -zlib.MAX_WBITS)
+    return content
+
+def fetch_encoded(base_url, url, encoding, timeout=None):
+    """
+    Request url accepting only encoding and return (response, body as sent
+    on the wire, seconds to the last byte).
+    """
+    start = time.time()
+    response = run_request(base_url, url, timeout=timeout, stream=True, \
+        headers={"Accept-Encoding": encoding})
+    if response is None:
+        return (None, None, None)
+    chunks = []
+    while True:
+        chunk = response.raw.read(DEFAULT_STREAM_CHUNK, decode_content=False)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return (response, "".join(chunks), time.time() - start)
+
+def measure_encoding(base_url, url, encoding, samples, timeout=None):
+    """
+    Return row with the wire bytes, median time to last byte and median
+    decompression time of url requested with encoding, or None on errors.
+    When the server sends identity anyway the body is compressed by the
+    client and the row is an estimate.
+    """
+    ttlb = []
+    decompress = []
+    row = None
+    for _ in range(samples):
+        response, wire, seconds = fetch_encoded(base_url, url, encoding, \
+            timeout=timeout)
+        if response is None or response.status_code != 200:
+            return None
+        served = response.headers.get("Content-Encoding", "identity")
+        served = served.strip().lower()
+        if served not in COMPRESSION_ENCODINGS:
+            return None
+        source = "measured"
+        if served == "identity" and encoding != "identity":
+            wire = encode_body(wire, encoding)
+            source = "estimated"
+        start = time.clock()
+        body = decode_body(wire, encoding if source == "estimated" \
+            else served)
+        decompress.append((time.clock() - start) * 1000.0)
+        ttlb.append(seconds * 1000.0)
+        row = {
+            "encoding": encoding,
+            "served": served,
+            "source": source,
+            "tasks": len(json.loads(body)),
+            "identity_bytes": len(body),
+            "wire_bytes": len(wire),
+            "ratio": len(wire) / float(len(body)) if body else 1.0
+        }
+    row["ttlb_ms"] = median(ttlb)
+    row["decompress_ms"] = median(decompress)
+    return row
+
+def link_time(row, link):
+    """
+    Return projected ms to receive and decode row over a link of kbit/s.
+    """
+    return row["ttlb_ms"] + row["wire_bytes"] * 8.0 / link + \
+        row["decompress_ms"]
+
+def compression_break_even(rows, links):
+    """
+    Return {(request, encoding, source, link): page size} from which the
+    encoding is faster than identity at every larger page size, None when
+    never. Estimated rows leave out the compression time of the server, so
+    their break-even is kept apart from the measured one.
+    """
+    times = {}
+    for row in rows:
+        for link in links:
+            times[(row["request"], row["encoding"], row["source"], link, \
+                row["page_size"])] = link_time(row, link)
+    result = collections.OrderedDict()
+    for request in sorted(set(row["request"] for row in rows)):
+        sizes = sorted(set(row["page_size"] for row in rows \
+            if row["request"] == request))
+        for encoding in COMPRESSION_ENCODINGS[1:]:
+            for source in ("measured", "estimated"):
+                if not any(row["request"] == request and \
+                    row["encoding"] == encoding and row["source"] == source \
+                    for row in rows):
+                    continue
+                for link in links:
+                    start = None
+                    for page_size in sizes:
+                        compressed = times.get((request, encoding, source, \
+                            link, page_size))
+                        identity = times.get((request, "identity", \
+                            "measured", link, page_size))
+                        if compressed is None or identity is None:
+                            continue
+                        if compressed < identity:
+                            if start is None:
+                                start = page_size
+                        else:
+                            start = None
+                    result[(request, encoding, source, link)] = start
+    return result
+
+def print_compression_summary(rows, links, break_even):
+    """
+    Print wire bytes, timing and projected link times of every request
+    and encoding, and the page sizes where compression pays off.
+    """
+    print_header("Compression summary")
+    print "%-7s %8s %-9s %-9s %10s %6s %8s %9s" % ("Request", "pageSize", \
+        "Encoding", "Source", "Wire KB", "Ratio", "TTLB ms", "Decomp ms") + \
+        "".join(" %10s" % ("@%dk ms" % (link)) for link in links)
+    for row in rows:
+        print "%-7s %8d %-9s %-9s %10.1f %6.2f %8.2f %9.3f" % \
+            (row["request"], row["page_size"], row["encoding"], \
+            row["source"], row["wire_bytes"] / 1000.0, row["ratio"], \
+            row["ttlb_ms"], row["decompress_ms"]) + \
+            "".join(" %10.1f" % (link_time(row, link)) for link in links)
+    for (request, encoding, source, link), page_size in \
+        break_even.items():
+        label = " (estimated, without server compression time)" \
+            if source == "estimated" else ""
+        if page_size is None:
+            print "%s %s does not pay off at %d kbit/s%s" % (request, \
+                encoding, link, label)
+        else:
+            print "%s %s pays off at %d kbit/s from pageSize %d%s" % \
+                (request, encoding, link, page_size, label)
+    print "------------------------------------------------------------------"
+
+def compress_main(argv):
+    """
+    Compress command, compares identity, gzip and deflate responses of the
+    list and search requests by page size.
+    """
+    parser = argparse.ArgumentParser(prog='test.py compress', \
+        description='measure wire bytes, time to last byte and ' + \
+        'decompression cost of compressed /tasks.json responses', \
+        epilog='Example: ./test.py compress http://127.0.0.1:8080/ ' + \
+        '--page-sizes 1,10,100,1000 --links 500,2000')
+    parser.add_argument('endpoint', help='server endpoint')
+    parser.add_argument('--page-sizes', \
+        default=DEFAULT_COMPRESSION_PAGE_SIZES, \
+        help='comma separated pageSize values')
+    parser.add_argument('--encodings', \
+        default=",".join(COMPRESSION_ENCODINGS), help='comma separated ' + \
+        'encodings out of %s, identity is always measured' % \
+        (", ".join(COMPRESSION_ENCODINGS)))
+    parser.add_argument('--search', default=BENCH_SEARCH_TERM, \
+        help='search term of the search requests, empty to skip them')
+    parser.add_argument('--links', default=DEFAULT_COMPRESSION_LINKS, \
+        help='comma separated link speeds in kbit/s to project times for')
+    parser.add_argument('--samples', type=int, \
+        default=DEFAULT_COMPRESSION_SAMPLES, help='requests per row, ' + \
+        'medians are reported')
+    parser.add_argument('--tasks', type=int, help='tasks in the ' + \
+        'database, missing ones are inserted first, default the largest ' + \
+        'pageSize')
+    parser.add_argument('--seed', type=int, default=0, \
+        help='random generator seed of inserted tasks')
+    parser.add_argument('--format', choices=('csv', 'json'), \
+        default='csv', help='output format')
+    parser.add_argument('--output', help='write result rows to this file')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, \
+        help='per-request timeout in seconds')
+    args = parser.parse_args(argv)
+    try:
+        page_sizes = [int(size) for size in args.page_sizes.split(",")]
+        links = [int(link) for link in args.links.split(",")]
+    except ValueError:
+        parser.error("page sizes and links must be integers")
+    if min(page_sizes) <= 0 or min(links) <= 0:
+        parser.error("page sizes and links must be positive")
+    encodings = ["identity"]
+    for encoding in args.encodings.split(","):
+        encoding = encoding.strip()
+        if encoding not in COMPRESSION_ENCODINGS:
+            parser.error("unknown encoding %s" % (encoding))
+        if encoding not in encodings:
+            encodings.append(encoding)
+    with SummaryStream(args.output, optional=True):
+        configure_transport(timeout=args.timeout)
+        tasks = args.tasks if args.tasks is not None else max(page_sizes)
+        if not workload_keys(args.endpoint, tasks, seed=args.seed):
+            print_error("No tasks available at %s" % (args.endpoint))
+            return 1
+        targets = [("list", "/tasks.json?pageSize=%d")]
+        if args.search:
+            targets.append(("search", "/tasks.json?q=%s&pageSize=%%d" % \
+                (args.search)))
+        rows = []
+        for request, url in targets:
+            for page_size in page_sizes:
+                for encoding in encodings:
+                    row = measure_encoding(args.endpoint, url % (page_size), \
+                        encoding, args.samples, timeout=args.timeout)
+                    if row is None:
+                        print_error("Request %s with %s failed" % \
+                            (url % (page_size), encoding))
+                        return 1
+                    row["request"] = request
+                    row["page_size"] = page_size
+                    for link in links:
+                        row["link_%d_ms" % (link)] = link_time(row, link)
+                    rows.append(row)
+        break_even = compression_break_even(rows, links)
+        print_compression_summary(rows, links, break_even)
+    if args.output is not None:
+        write_results(rows, COMPRESSION_FIELDS + tuple("link_%d_ms" % \
+            (link) for link in links), args.output, args.format, \
+            {"break_even": [{"request": request, "encoding": encoding, \
+            "source": source, "link_kbps": link, "page_size": page_size} \
+            for (request, encoding, source, link), page_size in \
+            break_even.items()]})
+    return 0
+
+class CrawlPages(object):
+    """
+    Hands out page numbers to crawl workers and returns their results in
+    page order. Workers never run more than window pages ahead of the
+    merge, so at most window pages are held in memory.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.next = 1
+        self.merged = 0
+        self.results = {}
+        self.peak = 0
+        self.done = False
+        self.condition = threading.Condition()
+
+    def take(self):
+        """
+        Return the next page to fetch, None once the crawl is done.
+        """
+        with self.condition:
+            while not self.done and self.next > self.merged + self.window:
+                self.condition.wait()
+            if self.done:
+                return None
+            page = self.next
+            self.next += 1
+            return page
+
+    def put(self, page, result):
+        """
+        Keep result of a fetched page for the merge.
+        """
+        with self.condition:
+            if not self.done:
+                self.results[page] = result
+                self.peak = max(self.peak, len(self.results))
+            self.condition.notify_all()
+
+    def pop(self):
+        """
+        Wait for the result of the next page in order and return it.
+        """
+        with self.condition:
+            while self.merged + 1 not in self.results:
+                self.condition.wait()
+            self.merged += 1
+            result = self.results.pop(self.merged)
+            self.condition.notify_all()
+            return result
+
+    def finish(self):
+        """
+        Stop handing out pages and drop results past the last page.
+        """
+        with self.condition:
+            self.done = True
+            self.results = {}
+            self.condition.notify_all()
+
+def crawl_worker(base_url, page_size, pages):
+    """
+    Fetch pages until the crawl is done. Results are (tasks, X-Count,
+    seconds, error).
+    """
+    while True:
+        page = pages.take()
+        if page is None:
+            return
+        response, seconds = timed_request(base_url, \
+            "/tasks.json?page=%d&pageSize=%d" % (page, page_size))
+        if response is None or response.status_code != 200:
+            pages.put(page, (None, None, seconds, "Request for page %d " % \
+                (page) + "failed"))
+            continue
+        try:
+            tasks = [(task["id"], parse_deadline(task["deadline"])) \
+                for task in response.json()]
+            x_count = int(response.headers["X-Count"])
+        except (ValueError, KeyError, TypeError):
+            pages.put(page, (None, None, seconds, "Invalid page %d" % (page)))
+            continue
+        pages.put(page, (tasks, x_count, seconds, None))
+
+class CrawlVerifier(object):
+    """
+    Checks the merged pages as one stream, latest deadline first, and
+    remembers seen ids in a bitmap.
+    """
+    def __init__(self):
+        self.seen = bytearray()
+        self.tasks = 0
+        self.unique = 0
+        self.duplicates = 0
+        self.violations = 0
+        self.first_violation = None
+        self.previous = None
+        self.counts = []
+
+    def contains(self, task_id):
+        """
+        Return True when task_id was seen.
+        """
+        index = task_id >> 3
+        return index < len(self.seen) and \
+            bool(self.seen[index] & (1 << (task_id & 7)))
+
+    def add(self, page, tasks, x_count):
+        """
+        Check tasks of the next page, given as (id, deadline) pairs.
+        """
+        self.counts.append(x_count)
+        for position, (task_id, deadline) in enumerate(tasks):
+            self.tasks += 1
+            if self.contains(task_id):
+                self.duplicates += 1
+            else:
+                index = task_id >> 3
+                if index >= len(self.seen):
+                    self.seen.extend(bytearray(index + 1 - len(self.seen)))
+                self.seen[index] |= 1 << (task_id & 7)
+                self.unique += 1
+            # The comparison of verify_order, across page boundaries too
+            if self.previous is not None and self.previous < deadline:
+                self.violations += 1
+                if self.first_violation is None:
+                    self.first_violation = (page, position)
+            self.previous = deadline
+
+class CrawlWriter(object):
+    """
+    Background writer that inserts tasks and deletes the ones it inserted
+    at a fixed rate while the crawl runs.
+    """
+    def __init__(self, base_url, rate, seed=0):
+        self.base_url = base_url
+        self.interval = 1.0 / rate
+        self.random = random.Random(seed)
+        self.generator = TaskGenerator(seed)
+        self.inserted = []
+        self.live = []
+        self.inserts = 0
+        self.deletes = 0
+        self.errors = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def write(self):
+        """
+        Delete one of the live tasks or insert a new one, half and half.
+        """
+        if self.live and self.random.random() < 0.5:
+            index = int(self.random.random() * len(self.live))
+            task_id = self.live[index]
+            self.live[index] = self.live[-1]
+            self.live.pop()
+            response = run_request(self.base_url, "/tasks/%d.json" % \
+                (task_id), method="DELETE")
+            if response is None or response.status_code != 200:
+                self.errors += 1
+            else:
+                self.deletes += 1
+            return
+        response = run_request(self.base_url, "/tasks.json", method="POST", \
+            data=json.dumps(self.generator.task()))
+        if response is None or response.status_code != 200:
+            self.errors += 1
+            return
+        task_id = response.json()["id"]
+        self.inserted.append(task_id)
+        self.live.append(task_id)
+        self.inserts += 1
+
+    def run(self):
+        """
+        Write at the configured rate until stopped.
+        """
+        scheduled = time.time()
+        while not self.stopped.is_set():
+            self.write()
+            scheduled += self.interval
+            wait = scheduled - time.time()
+            if wait > 0:
+                self.stopped.wait(wait)
+
+    def start(self):
+        """
+        Start writing in the background.
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop writing and delete the tasks that are still live.
+        """
+        self.stopped.set()
+        self.thread.join()
+        for task_id in self.live:
+            run_request(self.base_url, "/tasks/%d.json" % (task_id), \
+                method="DELETE")
+        self.live = []
+
+def run_crawl(base_url, page_size=DEFAULT_CRAWL_PAGE_SIZE, \
+    concurrency=DEFAULT_CRAWL_CONCURRENCY, writer=None):
+    """
+    Crawl /tasks.json page by page with concurrent requests and check the
+    merged pages. Returns (summary, rows of every page).
+    """
+    initial = task_count(base_url)
+    if initial is None:
+        return (None, [])
+    pages = CrawlPages(concurrency)
+    verifier = CrawlVerifier()
+    rows = []
+    errors = []
+    if writer is not None:
+        writer.start()
+    start = time.time()
+    threads = []
+    for _ in range(concurrency):
+        thread = threading.Thread(target=crawl_worker, \
+            args=(base_url, page_size, pages))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    try:
+        while True:
+            tasks, x_count, seconds, error = pages.pop()
+            page = pages.merged
+            if error is not None:
+                errors.append(error)
+                break
+            duplicates = verifier.duplicates
+            violations = verifier.violations
+            verifier.add(page, tasks, x_count)
+            rows.append({
+                "page": page,
+                "tasks": len(tasks),
+                "x_count": x_count,
+                "latency_ms": seconds * 1000.0,
+                "duplicates": verifier.duplicates - duplicates,
+                "order_violations": verifier.violations - violations
+            })
+            # A short page is the last one
+            if len(tasks) < page_size:
+                break
+    finally:
+        pages.finish()
+        for thread in threads:
+            thread.join()
+    elapsed = time.time() - start
+    inserted = []
+    if writer is not None:
+        writer.stop()
+        inserted = writer.inserted
+    # Tasks present before the crawl that the writer left alone must all
+    # be seen once, tasks of the writer may or may not be
+    seen_inserted = sum(1 for task_id in inserted \
+        if verifier.contains(task_id))
+    counts = verifier.counts or [initial]
+    summary = {
+        "page_size": page_size,
+        "concurrency": concurrency,
+        "pages": len(rows),
+        "tasks": verifier.tasks,
+        "unique": verifier.unique,
+        "duplicates": verifier.duplicates,
+        "gaps": max(initial - (verifier.unique - seen_inserted), 0),
+        "order_violations": verifier.violations,
+        "first_violation": verifier.first_violation,
+        "x_count_initial": initial,
+        "x_count_min": min(counts),
+        "x_count_max": max(counts),
+        "x_count_drift": max(counts) - min(counts),
+        "peak_buffered_pages": pages.peak,
+        "elapsed": elapsed,
+        "pages_per_second": len(rows) / elapsed if elapsed > 0 else 0.0,
+        "tasks_per_second": verifier.tasks / elapsed if elapsed > 0 else 0.0,
+        "errors": errors,
+        "writer_inserts": writer.inserts if writer is not None else 0,
+        "writer_deletes": writer.deletes if writer is not None else 0,
+        "writer_errors": writer.errors if writer is not None else 0
+    }
+    return (summary, rows)
+
+def print_crawl_summary(summary):
+    """
+    Print consistency findings and speed of a crawl.
+    """
+    print_header("Crawl summary")
+    print "Pages: %d of %d tasks with %d at once Time: %.2fs " % \
+        (summary["pages"], summary["page_size"], summary["concurrency"], \
+        summary["elapsed"]) + "Pages/s: %.1f Tasks/s: %.1f" % \
+        (summary["pages_per_second"], summary["tasks_per_second"])
+    print "Tasks: %d Unique: %d Duplicates: %d Gaps: %d " % \
+        (summary["tasks"], summary["unique"], summary["duplicates"], \
+        summary["gaps"]) + "Order violations: %d" % \
+        (summary["order_violations"])
+    if summary["first_violation"] is not None:
+        print "First order violation on page %d at position %d" % \
+            tuple(summary["first_violation"])
+    print "X-Count initial: %d min: %d max: %d drift: %d" % \
+        (summary["x_count_initial"], summary["x_count_min"], \
+        summary["x_count_max"], summary["x_count_drift"])
+    print "Peak pages buffered: %d" % (summary["peak_buffered_pages"])
+    if summary["writer_inserts"] or summary["writer_deletes"] or \
+        summary["writer_errors"]:
+        print "Writer inserts: %d deletes: %d errors: %d" % \
+            (summary["writer_inserts"], summary["writer_deletes"], \
+            summary["writer_errors"])
+    for error in summary["errors"]:
+        print_error(error)
+    print "------------------------------------------------------------------"
+
+def crawl_main(argv):
+    """
+    Crawl command, walks every page of /tasks.json concurrently and checks
+    that every task comes exactly once in deadline order.
+    """
+    parser = argparse.ArgumentParser(prog='test.py crawl', \
+        description='crawl all pages of /tasks.json concurrently and ' + \
+        'check for duplicates, gaps, order and X-Count drift', \
+        epilog='Example: ./test.py crawl http://127.0.0.1:8080/ ' + \
+        '--page-size 100 --concurrency 8 --write-rate 50')
+    parser.add_argument('endpoint', help='server endpoint')
+    parser.add_argument('--page-size', type=int, \
+        default=DEFAULT_CRAWL_PAGE_SIZE, help='pageSize of every request')
+    parser.add_argument('--concurrency', type=int, \
+        default=DEFAULT_CRAWL_CONCURRENCY, help='pages fetched at once ' + \
+        'and held for the merge at most')
+    parser.add_argument('--write-rate', type=float, help='insert and ' + \
+        'delete tasks at this many per second during the crawl')
+    parser.add_argument('--seed', type=int, default=0, \
+        help='random generator seed of the writer')
+    parser.add_argument('--format', choices=('csv', 'json'), \
+        default='csv', help='output format')
+    parser.add_argument('--output', help='write a row for every page to ' + \
+        'this file')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, \
+        help='per-request timeout in seconds')
+    args = parser.parse_args(argv)
+    if args.page_size <= 0 or args.concurrency <= 0:
+        parser.error("page size and concurrency must be positive")
+    if args.write_rate is not None and args.write_rate <= 0:
+        parser.error("write rate must be positive")
+    with SummaryStream(args.output, optional=True):
+        configure_transport(pool_size=args.concurrency + 1, \
+            timeout=args.timeout)
+        writer = None
+        if args.write_rate is not None:
+            writer = CrawlWriter(args.endpoint, args.write_rate, seed=args.seed)
+        summary, rows = run_crawl(args.endpoint, page_size=args.page_size, \
+            concurrency=args.concurrency, writer=writer)
+        if summary is None:
+            print_error("Unable to read X-Count from %s" % (args.endpoint))
+            return 1
+        print_crawl_summary(summary)
+    if args.output is not None:
+        write_results(rows, CRAWL_FIELDS, args.output, args.format, \
+            {"summary": summary})
+    return 1 if summary["errors"] or summary["duplicates"] or \
+        summary["gaps"] or summary["order_violations"] else 0
+
+class PipelineConnection(object):
+    """
+    Blocking keep-alive connection that writes batches of requests back to
+    back and parses the responses in order as they arrive.
+    """
+    def __init__(self, address, timeout=DEFAULT_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self.socket = None
+        self.parser = None
+        self.opened = 0
+
+    def connect(self):
+        """
+        Open a new connection with an empty parser.
+        """
+        self.socket = socket.create_connection(self.address, self.timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.parser = HTTPResponseParser()
+        self.opened += 1
+
+    def close(self):
+        """
+        Close the connection, the next batch opens a new one.
+        """
+        if self.socket is not None:
+            self.socket.close()
+        self.socket = None
+        self.parser = None
+
+    def send_batch(self, batch):
+        """
+        Send batch of (method, payload) requests at once. Returns (results,
+        closed) with (response, seconds since the batch was sent) of the
+        responses received in order, which are fewer than the requests
+        when the server closed the connection or failed.
+        """
+        if self.socket is None:
+            self.connect()
+        for method, _ in batch:
+            self.parser.expect(method)
+        results = []
+        start = time.time()
+        try:
+            self.socket.sendall("".join(payload for _, payload in batch))
+            while len(results) < len(batch):
+                data = self.socket.recv(DEFAULT_STREAM_CHUNK)
+                responses = self.parser.feed(data) if data \
+                    else self.parser.eof()
+                now = time.time()
+                for response in responses:
+                    results.append((response, now - start))
+                if not data or any(response.headers.get("connection", \
+                    "").lower() == "close" for response in responses):
+                    break
+        except (socket.error, ValueError):
+            pass
+        closed = len(results) < len(batch) or (results and \
+            results[-1][0].headers.get("connection", "").lower() == "close")
+        if closed:
+            self.close()
+        return (results[:len(batch)], closed)
+
+class PipelineStats(object):
+    """
+    Outcome of pipelined requests at one depth.
+    """
+    def __init__(self, depth, connections):
+        self.depth = depth
+        self.connections = connections
+        self.latency = LatencyHistogram()
+        self.routes = LatencyRecorder()
+        self.requests = 0
+        self.errors = 0
+        self.closes = 0
+        self.fallbacks = 0
+        self.opened = 0
+        self.final_depth = depth
+        self.lock = threading.Lock()
+
+    def record(self, method, url, response, seconds):
+        """
+        Record response to a request of the route.
+        """
+        with self.lock:
+            self.requests += 1
+            if response.status_code >= 400:
+                self.errors += 1
+            self.latency.record(seconds)
+        self.routes.record(method, url, seconds)
+
+    def row(self, elapsed):
+        """
+        Return result row of this depth.
+        """
+        return {
+            "depth": self.depth,
+            "connections": self.connections,
+            "requests": self.requests,
+            "errors": self.errors,
+            "elapsed": elapsed,
+            "req_per_s": self.requests / elapsed if elapsed > 0 else 0.0,
+            "p50_ms": self.latency.percentile(50.0) * 1000.0,
+            "p90_ms": self.latency.percentile(90.0) * 1000.0,
+            "p99_ms": self.latency.percentile(99.0) * 1000.0,
+            "max_ms": self.latency.max * 1000.0,
+            "opened": self.opened,
+            "closes": self.closes,
+            "fallbacks": self.fallbacks,
+            "final_depth": self.final_depth
+        }
+
+def pipeline_worker(address, host, requests_list, depth, timeout, stats):
+    """
+    Send requests in batches of depth on one connection. Requests left
+    unanswered when the server closes the connection are sent again on a
+    new one, which is safe for GET and HEAD. When not even the first
+    request of a batch is answered the depth falls back to one.
+    """
+    connection = PipelineConnection(address, timeout)
+    pending = collections.deque(requests_list)
+    failures = 0
+    while pending:
+        batch = [pending.popleft() for _ in range(min(depth, len(pending)))]
+        results, closed = connection.send_batch([(method, \
+            build_request(method, url, host)) for method, url in batch])
+        for (method, url), (response, seconds) in zip(batch, results):
+            stats.record(method, url, response, seconds)
+        unanswered = batch[len(results):]
+        if closed:
+            with stats.lock:
+                stats.closes += 1
+        if not unanswered:
+            failures = 0
+            continue
+        if results:
+            failures = 0
+        elif depth > 1:
+            depth = 1
+            with stats.lock:
+                stats.fallbacks += 1
+        else:
+            failures += 1
+            if failures > 1:
+                # Not even single requests get through, give up on one
+                with stats.lock:
+                    stats.requests += 1
+                    stats.errors += 1
+                unanswered = unanswered[1:]
+                failures = 0
+        pending.extendleft(reversed(unanswered))
+    connection.close()
+    with stats.lock:
+        stats.opened += connection.opened
+        stats.final_depth = min(stats.final_depth, depth)
+
+def pipeline_requests(mix, count, ids, seed=0):
+    """
+    Return count (method, path) requests drawn from the weighted mix.
+    """
+    random_generator = random.Random(seed)
+    weights = []
+    total_weight = 0.0
+    for _, _, weight in mix:
+        total_weight += weight
+        weights.append(total_weight)
+    result = []
+    for _ in xrange(count):
+        method, url, _ = mix[bisect.bisect_right(weights, \
+            random_generator.random() * total_weight)]
+        if ":id" in url:
+            url = url.replace(":id", str(random_generator.choice(ids)))
+        result.append((method, url))
+    return result
+
+def run_pipeline(base_url, mix, depth, count, connections=1, \
+    timeout=DEFAULT_TIMEOUT, ids=None, seed=0):
+    """
+    Send count requests of the mix pipelined depth deep, spread over
+    connections each with its own thread. Returns (stats, elapsed).
+    """
+    parts = urlparse.urlsplit(base_url)
+    address = (parts.hostname, parts.port or 80)
+    prefix = parts.path.rstrip("/")
+    requests_list = [(method, prefix + url) for method, url in \
+        pipeline_requests(mix, count, ids or [], seed)]
+    stats = PipelineStats(depth, connections)
+    threads = []
+    start = time.time()
+    for number in range(connections):
+        thread = threading.Thread(target=pipeline_worker, args=(address, \
+            parts.netloc, requests_list[number::connections], depth, \
+            timeout, stats))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return (stats, time.time() - start)
+
+def print_pipeline_summary(rows):
+    """
+    Print throughput and latency of every pipelining depth.
+    """
+    print_header("Pipelining summary")
+    print "%6s %9s %7s %9s %8s %8s %8s %8s %7s %9s %6s" % ("Depth", \
+        "Requests", "Errors", "Req/s", "p50 ms", "p90 ms", "p99 ms", \
+        "max ms", "Opened", "Fallbacks", "Final")
+    for row in rows:
+        print "%6d %9d %7d %9.1f %8.2f %8.2f %8.2f %8.2f %7d %9d %6d" % \
+            (row["depth"], row["requests"], row["errors"], \
+            row["req_per_s"], row["p50_ms"], row["p90_ms"], row["p99_ms"], \
+            row["max_ms"], row["opened"], row["fallbacks"], \
+            row["final_depth"])
+    print "------------------------------------------------------------------"
+
+def pipeline_main(argv):
+    """
+    Pipeline command, sends GET and HEAD bursts back to back on keep-alive
+    connections at several pipelining depths.
+    """
+    parser = argparse.ArgumentParser(prog='test.py pipeline', \
+        description='measure throughput and latency of HTTP/1.1 ' + \
+        'pipelined GET and HEAD requests', \
+        epilog='Example: ./test.py pipeline http://127.0.0.1:8080/ ' + \
+        '--depths 1,8,32,128 --requests 10000')
+    parser.add_argument('endpoint', help='server endpoint')
+    parser.add_argument('--depths', default=DEFAULT_PIPELINE_DEPTHS, \
+        help='comma separated numbers of requests sent back to back')
+    parser.add_argument('--requests', type=int, \
+        default=DEFAULT_PIPELINE_REQUESTS, help='requests per depth')
+    parser.add_argument('--connections', type=int, default=1, \
+        help='pipelined connections, each on its own thread')
+    parser.add_argument('--mix', default=DEFAULT_PIPELINE_MIX, \
+        help='weighted GET and HEAD route mix as "METHOD url=weight,...", ' + \
+        ':id stands for an existing task')
+    parser.add_argument('--seed', type=int, default=0, \
+        help='random generator seed')
+    parser.add_argument('--format', choices=('csv', 'json'), \
+        default='csv', help='output format')
+    parser.add_argument('--output', help='write result rows to this file')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, \
+        help='socket timeout in seconds')
+    args = parser.parse_args(argv)
+    try:
+        mix = parse_mix(args.mix)
+        depths = [int(depth) for depth in args.depths.split(",")]
+    except ValueError as error:
+        parser.error(str(error))
+    if any(method not in ("GET", "HEAD") for method, _, _ in mix):
+        parser.error("only GET and HEAD requests can be pipelined")
+    if min(depths) <= 0 or args.requests <= 0 or args.connections <= 0:
+        parser.error("depths, requests and connections must be positive")
+    if urlparse.urlsplit(args.endpoint).scheme != "http":
+        parser.error("pipelining needs an http:// endpoint")
+    with SummaryStream(args.output, optional=True):
+        configure_transport(timeout=args.timeout)
+        ids = []
+        if any(":id" in url for _, url, _ in mix):
+            ids = open_loop_ids(get_transport(), args.endpoint, \
+                PIPELINE_TASKS, args.seed)
+            if not ids:
+                print_error("No tasks available at %s" % (args.endpoint))
+                return 1
+        rows = []
+        for depth in depths:
+            stats, elapsed = run_pipeline(args.endpoint, mix, depth, \
+                args.requests, connections=args.connections, \
+                timeout=args.timeout, ids=ids, seed=args.seed)
+            rows.append(stats.row(elapsed))
+        print_pipeline_summary(rows)
+    if args.output is not None:
+        write_results(rows, PIPELINE_FIELDS, args.output, args.format)
+    return 1 if any(row["errors"] for row in rows) else 0
+
+def stream_main(argv):
+    """
+    Stream command, verifies one large task list with bounded memory.
+    """
+    parser = argparse.ArgumentParser(prog='test.py stream', \
+        description='stream and verify a large /tasks.json page', \
+        epilog='Example: ./test.py stream http://127.0.0.1:8080/ ' + \
+        '--page-size 100000')
+    parser.add_argument('endpoint', help='server endpoint')
+    parser.add_argument('--page-size', type=int, default=10000, \
+        help='pageSize of the request')
+    parser.add_argument('--verbose', '-v', \
+        help='print verbose information during execution', \
+        action='store_true')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, \
+        help='per-request timeout in seconds')
+    args = parser.parse_args(argv)
+    configure_transport(timeout=args.timeout)
+    count = task_count(args.endpoint)
+    if count is None:
+        print_error("Unable to read X-Count from %s" % (args.endpoint))
+        return 1
+    failed, succeeded = stream_get_test("Streamed GET request with " + \
+        "pageSize=%d" % (args.page_size), args.endpoint, \
+        "/tasks.json?pageSize=%d" % (args.page_size), count, \
+        min(count, args.page_size), verbose=args.verbose)
+    print_test_summary(failed, succeeded)
+    return failed
+
+def load_trace(path):
+    """
+    Return recorded exchanges of trace file ordered by send time.
+    """
+    entries = []
+    with open(path) as trace:
+        for line in trace:
+            if line.strip():
+                entries.append(json.loads(line))
+    entries.sort(key=lambda entry: entry["t"])
+    return entries
+
+class ReplayIds(object):
+    """
+    Maps task ids of the recording to ids created during replay. Lookups
+    of ids that another lane has yet to create wait for it.
+    """
+    def __init__(self, entries, timeout=DEFAULT_TIMEOUT):
+        self.created = set(str(entry["id"]) for entry in entries \
+            if "id" in entry)
+        self.ids = {}
+        self.timeout = timeout
+        self.condition = threading.Condition()
+
+    def set(self, recorded, replayed):
+        """
+        Map recorded id to replayed id.
+        """
+        with self.condition:
+            self.ids[str(recorded)] = str(replayed)
+            self.condition.notify_all()
+
+    def get(self, recorded):
+        """
+        Return replayed id of recorded id, ids never created in the
+        recording map to themselves.
+        """
+        deadline = time.time() + self.timeout
+        with self.condition:
+            while recorded in self.created and recorded not in self.ids:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return self.ids.get(recorded, recorded)
+
+    def url(self, url):
+        """
+        Return url with the task id replaced by its replayed id.
+        """
+        match = REPLAY_PATH_PATTERN.match(url)
+        if match is None:
+            return url
+        return "/tasks/%s.json%s" % (self.get(match.group(1)), \
+            match.group(2))
+
+class ReplayStats(object):
+    """
+    Thread safe comparison of replayed exchanges with the recording, keyed
+    by method and route template.
+    """
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def record(self, entry, response, elapsed):
+        """
+        Compare replayed response with the recorded one.
+        """
+        key = "%s %s" % (entry["method"], entry["template"])
+        status_code = None if response is None else response.status_code
+        with self.lock:
+            route = self.routes.get(key)
+            if route is None:
+                route = {"count": 0, "errors": 0, "status_diff": 0, \
+                    "body_diff": 0, "recorded": LatencyHistogram(), \
+                    "replayed": LatencyHistogram()}
+                self.routes[key] = route
+            route["count"] += 1
+            if entry["ms"] is not None:
+                route["recorded"].record(entry["ms"] / 1000.0)
+            if response is None:
+                route["errors"] += 1
+            else:
+                route["replayed"].record(elapsed)
+            if status_code != entry["status"]:
+                route["status_diff"] += 1
+            elif entry["hash"] is not None and \
+                body_hash(response.content) != entry["hash"]:
+                route["body_diff"] += 1
+
+    def rows(self):
+        """
+        Return result rows ordered by route.
+        """
+        rows = []
+        for key in sorted(self.routes):
+            route = self.routes[key]
+            rows.append({
+                "route": key,
+                "count": route["count"],
+                "errors": route["errors"],
+                "status_diff": route["status_diff"],
+                "body_diff": route["body_diff"],
+                "recorded_p50_ms": route["recorded"].percentile(50.0) * 1000.0,
+                "replayed_p50_ms": route["replayed"].percentile(50.0) * 1000.0,
+                "recorded_p99_ms": route["recorded"].percentile(99.0) * 1000.0,
+                "replayed_p99_ms": route["replayed"].percentile(99.0) * 1000.0
+            })
+        return rows
+
+def replay_lane(base_url, entries, start, speed, ids, stats):
+    """
+    Replay exchanges of one lane in order, at speed times the recorded
+    pace or as fast as possible when speed is 0.
+    """
+    for entry in entries:
+        if speed > 0:
+            delay = start + entry["t"] / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        url = ids.url(entry["url"])
+        sent = time.time()
+        response = run_request(base_url, url, method=entry["method"], \
+            data=entry["body"])
+        elapsed = time.time() - sent
+        if "id" in entry:
+            replayed = None
+            if response is not None and response.status_code == 200:
+                try:
+                    replayed = response.json()["id"]
+                except (ValueError, KeyError, TypeError):
+                    pass
+            ids.set(entry["id"], entry["id"] if replayed is None else replayed)
+        stats.record(entry, response, elapsed)
+
+def run_replay(base_url, entries, speed=1.0, timeout=DEFAULT_TIMEOUT):
+    """
+    Replay recorded exchanges with one thread per recorded lane and return
+    (stats, elapsed).
+    """
+    lanes = collections.OrderedDict()
+    for entry in entries:
+        lanes.setdefault(entry["lane"], []).append(entry)
+    ids = ReplayIds(entries, timeout=timeout)
+    stats = ReplayStats()
+    first = entries[0]["t"] if entries else 0.0
+    for entry in entries:
+        entry["t"] -= first
+    start = time.time()
+    threads = []
+    for lane in lanes.values():
+        thread = threading.Thread(target=replay_lane, \
+            args=(base_url, lane, start, speed, ids, stats))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return (stats, time.time() - start)
+
+def print_replay_summary(rows, entries, elapsed, speed):
+    """
+    Print differences and latencies of the replay against the recording.
+    """
+    print_header("Replay summary")
+    span = entries[-1]["t"] - entries[0]["t"] if entries else 0.0
+    print "Recorded %d requests over %.2fs, replayed in %.2fs at %s" % \
+        (len(entries), span, elapsed, \
+        "full speed" if speed == 0 else "%gx" % (speed))
+    print "%-28s %7s %6s %6s %6s %9s %9s %9s %9s" % ("Route", "Count", \
+        "Errors", "Status", "Body", "Rec p50", "Rep p50", "Rec p99", \
+        "Rep p99")
+    for row in rows:
+        print "%-28s %7d %6d %6d %6d %9.2f %9.2f %9.2f %9.2f" % \
+            (row["route"], row["count"], row["errors"], row["status_diff"], \
+            row["body_diff"], row["recorded_p50_ms"], row["replayed_p50_ms"], \
+            row["recorded_p99_ms"], row["replayed_p99_ms"])
+    print "------------------------------------------------------------------"
+
+def replay_main(argv):
+    """
+    Replay command, plays a recorded trace back against an endpoint and
+    compares the responses.
+    """
+    parser = argparse.ArgumentParser(prog='test.py replay', \
+        description='replay a trace recorded with --record and compare ' + \
+        'status codes and bodies', \
+        epilog='Example: ./test.py replay trace.jsonl ' + \
+        'http://127.0.0.1:8080/ --speed 4')
+    parser.add_argument('trace', help='trace file')
+    parser.add_argument('endpoint', help='server endpoint')
+    parser.add_argument('--speed', default=DEFAULT_REPLAY_SPEED, \
+        help='multiple of the recorded pace or max, default %s' % \
+        (DEFAULT_REPLAY_SPEED))
+    parser.add_argument('--format', choices=('csv', 'json'), \
+        default='csv', help='output format')
+    parser.add_argument('--output', help='write result rows to this file')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, \
+        help='per-request timeout in seconds')
+    args = parser.parse_args(argv)
+    if args.speed == "max":
+        speed = 0.0
+    else:
+        try:
+            speed = float(args.speed)
+        except ValueError:
+            parser.error("invalid speed %s" % (args.speed))
+        if speed <= 0:
+            parser.error("speed must be positive or max")
+    with SummaryStream(args.output, optional=True):
+        entries = load_trace(args.trace)
+        lanes = len(set(entry["lane"] for entry in entries))
+        configure_transport(pool_size=max(DEFAULT_POOL_SIZE, lanes), \
+            timeout=args.timeout)
+        stats, elapsed = run_replay(args.endpoint, entries, speed=speed, \
+            timeout=args.timeout)
+        rows = stats.rows()
+        print_replay_summary(rows, entries, elapsed, speed)
+    if args.output is not None:
+        write_results(rows, REPLAY_FIELDS, args.output, args.format)
+    differences = sum(row["errors"] + row["status_diff"] + row["body_diff"] \
+        for row in rows)
+    return 1 if differences else 0
+
+def parse_int(value):
+    """
+    Return leading integer of value like JavaScript parseInt, or None.
+    """
+    match = REFERENCE_INT_PATTERN.match(value or "")
+    if match is None:
+        return None
+    return int(match.group(1))
+
+def utf16_length(text):
+    """
+    Return length of text in UTF-16 code units like JavaScript counts it.
+    """
+    if isinstance(text, unicode):
+        return len(text.encode("utf-16-le")) // 2
+    return len(text)
+
+def validate_task(task):
+    """
+    Return validation error messages of task, empty when it is valid.
+    """
+    messages = []
+    title = task.get("title")
+    if not isinstance(title, basestring) or \
+        not TITLE_MIN_LENGTH <= utf16_length(title) <= TITLE_MAX_LENGTH:
+        messages.append(REFERENCE_TITLE_ERROR)
+    description = task.get("description")
+    if not isinstance(description, basestring) or \
+        not DESCRIPTION_MIN_LENGTH <= utf16_length(description) <= \
+        DESCRIPTION_MAX_LENGTH:
+        messages.append(REFERENCE_DESCRIPTION_ERROR)
+    deadline = task.get("deadline")
+    valid = isinstance(deadline, basestring) and \
+        REFERENCE_DEADLINE_PATTERN.match(deadline) is not None
+    if valid:
+        try:
+            parse_deadline(deadline)
+        except (ValueError, OverflowError):
+            valid = False
+    if not valid:
+        messages.append(REFERENCE_DEADLINE_ERROR)
+    return messages
+
+class TaskStore(object):
+    """
+    Thread safe in-memory tasks. The index holds (-deadline, id) keys in
+    order, so list requests read pages without sorting.
+    """
+    def __init__(self):
+        self.tasks = {}
+        self.index = []
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def key(self, task):
+        """
+        Return index key of task, latest deadline first.
+        """
+        return (-parse_deadline(task["deadline"]), task["id"])
+
+    def count(self):
+        """
+        Return number of tasks.
+        """
+        return len(self.tasks)
+
+    def get(self, task_id):
+        """
+        Return copy of task or None.
+        """
+        with self.lock:
+            task = self.tasks.get(task_id)
+            return None if task is None else dict(task)
+
+    def add(self, title, description, deadline):
+        """
+        Insert task and return it with its new id.
+        """
+        with self.lock:
+            task = {"id": self.next_id, "title": title, \
+                "description": description, "deadline": deadline}
+            self.next_id += 1
+            self.tasks[task["id"]] = task
+            bisect.insort(self.index, self.key(task))
+            return dict(task)
+
+    def update(self, task_id, fields):
+        """
+        Update task fields and return the task, or None if it is missing.
+        """
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return None
+            key = self.key(task)
+            task.update(fields)
+            if self.key(task) != key:
+                del self.index[bisect.bisect_left(self.index, key)]
+                bisect.insort(self.index, self.key(task))
+            return dict(task)
+
+    def delete(self, task_id):
+        """
+        Remove task and return it, or None if it is missing.
+        """
+        with self.lock:
+            task = self.tasks.pop(task_id, None)
+            if task is not None:
+                del self.index[bisect.bisect_left(self.index, self.key(task))]
+            return task
+
+    def page(self, offset, limit=None, query=None):
+        """
+        Return (count, tasks) of tasks containing query in title or
+        description, latest deadline first. Without limit all tasks from
+        offset are returned.
+        """
+        end = None if limit is None else offset + limit
+        with self.lock:
+            if not query:
+                return (len(self.tasks), [dict(self.tasks[key[1]]) \
+                    for key in self.index[offset:end]])
+            query = query.lower()
+            count = 0
+            tasks = []
+            for key in self.index:
+                task = self.tasks[key[1]]
+                if query in task["title"].lower() or \
+                    query in task["description"].lower():
+                    if count >= offset and (end is None or count < end):
+                        tasks.append(dict(task))
+                    count += 1
+            return (count, tasks)
+
+class ReferenceServer(object):
+    """
+    Python reference implementation of the tasks API with the validation,
+    error format and headers of the node server, kept in memory.
+    """
+    def __init__(self, compress=False):
+        self.store = TaskStore()
+        self.compress = compress
+        self.list_methods = {
+            "HEAD": self.head_tasks,
+            "OPTIONS": self.options_tasks,
+            "GET": self.get_tasks,
+            "POST": self.post_tasks
+        }
+        self.task_methods = {
+            "OPTIONS": self.options_task,
+            "GET": self.get_task,
+            "PUT": self.put_task,
+            "PATCH": self.patch_task,
+            "DELETE": self.delete_task
+        }
+
+    def handle(self, method, path, body="", headers=None):
+        """
+        Handle request and return (status, headers, body). HEAD without a
+        handler of its own is answered by GET, the caller drops the body.
+        GET and HEAD answer 304 when If-None-Match matches the ETag.
+        """
+        parsed = urlparse.urlparse(path)
+        if parsed.path == "/tasks.json":
+            methods = self.list_methods
+            args = (urlparse.parse_qs(parsed.query), body)
+        else:
+            match = REFERENCE_TASK_PATTERN.match(parsed.path)
+            methods = self.task_methods if match is not None else {}
+            args = (match.group(1) if match is not None else None, body)
+        handler = methods.get(method)
+        if handler is None and method == "HEAD":
+            handler = methods.get("GET")
+        if handler is None:
+            return (404, {"Content-Type": "text/html; charset=utf-8"}, \
+                "Cannot %s %s\n" % (method, parsed.path))
+        status, response_headers, content = handler(*args)
+        if method in ("GET", "HEAD") and 200 <= status < 300 and \
+            self.fresh((headers or {}).get("If-None-Match"), \
+            response_headers.get("ETag")):
+            return (304, dict((name, value) \
+                for name, value in response_headers.items() \
+                if name.lower() not in CACHE_ENTITY_HEADERS), "")
+        if self.compress and status != 204 and \
+            len(content) >= COMPRESSION_THRESHOLD:
+            encoding = self.negotiate((headers or {}).get("Accept-Encoding"))
+            response_headers["Vary"] = "Accept-Encoding"
+            if encoding is not None:
+                response_headers["Content-Encoding"] = encoding
+                content = encode_body(content, encoding)
+        return (status, response_headers, content)
+
+    def negotiate(self, accept):
+        """
+        Return gzip or deflate when Accept-Encoding allows it, gzip first,
+        or None for identity.
+        """
+        accepted = set()
+        for item in (accept or "").split(","):
+            name, _, params = item.partition(";")
+            quality = params.strip()
+            if quality.startswith("q="):
+                try:
+                    if float(quality[2:]) <= 0:
+                        continue
+                except ValueError:
+                    continue
+            accepted.add(name.strip().lower())
+        for encoding in ("gzip", "deflate"):
+            if encoding in accepted or "*" in accepted:
+                return encoding
+        return None
+
+    def fresh(self, tags, etag):
+        """
+        Return True when If-None-Match tags match etag, compared weakly.
+        """
+        if not tags or etag is None:
+            return False
+        if tags.strip() == "*":
+            return True
+        etag = etag[2:] if etag.startswith("W/") else etag
+        for tag in tags.split(","):
+            tag = tag.strip()
+            if (tag[2:] if tag.startswith("W/") else tag) == etag:
+                return True
+        return False
+
+    def etag(self, content):
+        """
+        Return weak ETag of content, built like Express 4 builds it.
+        """
+        digest = base64.b64encode(hashlib.md5(content).digest()).rstrip("=")
+        return 'W/"%x-%s"' % (len(content), digest)
+
+    def json(self, status, value, headers=None):
+        """
+        Return JSON response with its ETag.
+        """
+        headers = dict(headers or {})
+        content = json.dumps(value, separators=(",", ":"))
+        headers["Content-Type"] = "application/json; charset=utf-8"
+        headers["ETag"] = self.etag(content)
+        return (status, headers, content)
+
+    def error(self, status, messages):
+        """
+        Return error response.
+        """
+        return self.json(status, {"errorCode": status, \
+            "errorMessages": messages})
+
+    def task_body(self, body):
+        """
+        Return request body as an object, None if it isn't JSON.
+        """
+        if not body:
+            return {}
+        try:
+            value = json.loads(body)
+        except ValueError:
+            return None
+        return value if isinstance(value, dict) else {}
+
+    def head_tasks(self, query, body):
+        return (204, {"X-Count": str(self.store.count())}, "")
+
+    def options_tasks(self, query, body):
+        return (204, {"Allow": REFERENCE_ALLOW_LIST}, "")
+
+    def get_tasks(self, query, body):
+        page = parse_int(query.get("page", [""])[0]) or 1
+        page_size = parse_int(query.get("pageSize", [""])[0]) or 10
+        search = query.get("q", [""])[0].replace("'", "")
+        # A negative LIMIT means no limit in SQLite
+        count, tasks = self.store.page(max((page - 1) * page_size, 0), \
+            page_size if page_size > 0 else None, search)
+        return self.json(200, tasks, {"X-Count": str(count)})
+
+    def post_tasks(self, query, body):
+        task = self.task_body(body)
+        if task is None:
+            return self.error(400, [REFERENCE_BODY_ERROR])
+        messages = validate_task(task)
+        if messages:
+            return self.error(400, messages)
+        return self.json(200, self.store.add(task["title"], \
+            task["description"], task["deadline"]))
+
+    def options_task(self, text_id, body):
+        task_id = parse_int(text_id)
+        if self.store.get(task_id) is None:
+            return self.error(404, ["Task %s does not exist!" % \
+                ("NaN" if task_id is None else task_id)])
+        return (204, {"Allow": REFERENCE_ALLOW_TASK}, "")
+
+    def get_task(self, text_id, body):
+        task_id = parse_int(text_id)
+        task = self.store.get(task_id)
+        if task is None:
+            return self.error(404, ["Task %s does not exist!" % \
+                ("NaN" if task_id is None else task_id)])
+        return self.json(200, task)
+
+    def put_task(self, text_id, body):
+        task_id = parse_int(text_id)
+        task = self.task_body(body)
+        if task is None:
+            return self.error(400, [REFERENCE_BODY_ERROR])
+        messages = validate_task(task)
+        if messages:
+            return self.error(400, messages)
+        task = self.store.update(task_id, dict((field, task[field]) \
+            for field in ("title", "description", "deadline")))
+        if task is None:
+            return self.error(404, ["Task %s not found." % \
+                ("NaN" if task_id is None else task_id)])
+        return self.json(200, task)
+
+    def patch_task(self, text_id, body):
+        task_id = parse_int(text_id)
+        task = self.store.get(task_id)
+        if task is None:
+            return self.error(404, ["Task %s not found." % \
+                ("NaN" if task_id is None else task_id)])
+        fields = self.task_body(body)
+        if fields is None:
+            return self.error(400, [REFERENCE_BODY_ERROR])
+        for field in ("title", "description", "deadline"):
+            if fields.get(field) is not None:
+                task[field] = fields[field]
+        messages = validate_task(task)
+        if messages:
+            return self.error(400, messages)
+        task = self.store.update(task_id, task)
+        if task is None:
+            return self.error(404, ["Task %s not found." % (task_id)])
+        return self.json(200, task)
+
+    def delete_task(self, text_id, body):
+        task_id = parse_int(text_id) if text_id.isdigit() else None
+        task = self.store.delete(task_id)
+        if task is None:
+            return self.error(404, ["Task %s not found." % (text_id)])
+        return self.json(200, task)
+
+class ReferenceRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the reference server over keep-alive HTTP/1.1 connections.
+    """
+    protocol_version = "HTTP/1.1"
+    # Headers and body leave in one segment when the handler flushes, and
+    # responses to pipelined requests aren't held back by Nagle
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def handle_request(self):
+        length = int(self.headers.getheader("content-length") or 0)
+        body = self.rfile.read(length) if length else ""
+        status, headers, content = self.server.reference.handle( \
+            self.command, self.path, body, self.headers)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    do_GET = do_HEAD = do_OPTIONS = do_POST = do_PUT = do_PATCH = \
+        do_DELETE = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+class ReferenceHTTPServer(SocketServer.ThreadingMixIn, \
+    BaseHTTPServer.HTTPServer):
+    """
+    Threaded HTTP server in front of a reference server.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address, reference):
+        BaseHTTPServer.HTTPServer.__init__(self, address, \
+            ReferenceRequestHandler)
+        self.reference = reference
+
+    def handle_error(self, request, client_address):
+        # Clients closing their connection early are not server errors
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, \
+                client_address)
+
+class ReferenceAdapter(object):
+    """
+    Transport adapter that hands requests straight to an in-process
+    reference server, no sockets involved. It has the send and close
+    methods of requests.adapters.BaseAdapter.
+    """
+    def __init__(self, reference):
+        self.reference = reference
+
+    def send(self, request, stream=False, timeout=None, verify=True, \
+        cert=None, proxies=None):
+        parts = urlparse.urlsplit(request.url)
+        path = parts.path
+        if parts.query:
+            path += "?" + parts.query
+        status, headers, content = self.reference.handle(request.method, \
+            path, request.body or "", request.headers)
+        response = requests.models.Response()
+        response.status_code = status
+        response.reason = \
+            BaseHTTPServer.BaseHTTPRequestHandler.responses[status][0]
+        response.headers = requests.structures.CaseInsensitiveDict(headers)
+        if status != 304:
+            response.headers["Content-Length"] = str(len(content))
+        response._content = "" if request.method == "HEAD" else content
+        response._content_consumed = True
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+# Reference server of the current run, see start_reference
+REFERENCE = None
+
+def start_reference(mode="inprocess", host="127.0.0.1", port=0):
+    """
+    Start a fresh reference server and return its endpoint. In process it
+    is reached through the pooled transport without sockets, on loopback
+    through a threaded HTTP server.
+    """
+    global REFERENCE
+    REFERENCE = ReferenceServer()
+    if mode == "inprocess":
+        return REFERENCE_URL
+    server = ReferenceHTTPServer((host, port), REFERENCE)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return "http://%s:%d/" % (host, server.server_address[1])
+
+def serve_main(argv):
+    """
+    Serve command, runs the reference server in the foreground.
+    """
+    parser = argparse.ArgumentParser(prog='test.py serve', \
+        description='serve the Python reference implementation of the ' + \
+        'tasks API from memory', \
+        epilog='Example: ./test.py serve --port 8080')
+    parser.add_argument('--host', default='127.0.0.1', \
+        help='address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_SERVE_PORT, \
+        help='port to listen on')
+    parser.add_argument('--compress', action='store_true', \
+        help='compress bodies of %d bytes and more with gzip or ' % \
+        (COMPRESSION_THRESHOLD) + 'deflate when the client accepts it')
+    args = parser.parse_args(argv)
+    server = ReferenceHTTPServer((args.host, args.port), \
+        ReferenceServer(compress=args.compress))
+    print_info("Reference server listening on http://%s:%d/" % \
+        (args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def read_proc_stat(pid):
+    """
+    Return (state, cpu seconds, threads, rss bytes) of process from
+    /proc/<pid>/stat.
+    """
+    with open("/proc/%d/stat" % (pid)) as stat:
+        text = stat.read()
+    # The command name may contain spaces and parentheses
+    fields = text[text.rindex(")") + 2:].split()
+    ticks = float(os.sysconf("SC_CLK_TCK"))
+    return (fields[0], (int(fields[11]) + int(fields[12])) / ticks, \
+        int(fields[17]), int(fields[21]) * os.sysconf("SC_PAGE_SIZE"))
+
+def read_proc_fields(path, names):
+    """
+    Return integer values of "name: value" lines of a /proc file, None for
+    missing names or when the file can't be read.
+    """
+    values = dict((name, None) for name in names)
+    try:
+        with open(path) as status:
+            for line in status:
+                name, _, value = line.partition(":")
+                if name in values:
+                    values[name] = int(value.split()[0])
+    except (IOError, OSError, ValueError):
+        pass
+    return values
+
+def database_size(path):
+    """
+    Return size of SQLite database with its journal and WAL files.
+    """
+    size = 0
+    for suffix in ("", "-journal", "-wal"):
+        try:
+            size += os.path.getsize(path + suffix)
+        except OSError:
+            pass
+    return size
+
+class ResourceSampler(object):
+    """
+    Samples a server process, its database file and the client latency
+    recorder at a fixed interval on a background thread. Every row holds
+    both sides so they can be plotted on one time line.
+    """
+    def __init__(self, pid=None, database=None, \
+        interval=DEFAULT_SAMPLE_INTERVAL, recorder=None):
+        self.pid = pid
+        self.database = database
+        self.interval = interval
+        self.recorder = LATENCY if recorder is None else recorder
+        self.rows = []
+        self.stopped = threading.Event()
+        self.thread = None
+        self.start = None
+        self.previous = None
+
+    def client(self):
+        """
+        Return latency histogram of all routes of the recorder.
+        """
+        histogram = LatencyHistogram()
+        for route_histogram in self.recorder.snapshot().values():
+            histogram.merge(route_histogram)
+        return histogram
+
+    def sample(self):
+        """
+        Return one row of server and client measurements.
+        """
+        now = time.time()
+        row = collections.OrderedDict()
+        row["time"] = round(now, 3)
+        row["elapsed"] = round(now - self.start, 3)
+        histogram = self.client()
+        previous = self.previous
+        if previous is None:
+            previous = {"time": self.start, "client": LatencyHistogram(), \
+                "cpu": None, "io": None}
+        elif histogram.count < previous["client"].count:
+            # The recorder was reset, e.g. between load and run phases
+            previous = dict(previous, client=LatencyHistogram())
+        interval = histogram.since(previous["client"])
+        seconds = max(now - previous["time"], 1e-9)
+        row["requests"] = interval.count
+        row["req_per_s"] = round(interval.count / seconds, 1)
+        row["p50_ms"] = round(interval.percentile(50.0) * 1000.0, 3)
+        row["p99_ms"] = round(interval.percentile(99.0) * 1000.0, 3)
+        cpu = None
+        io = None
+        if self.pid is not None:
+            try:
+                state, cpu, threads, rss = read_proc_stat(self.pid)
+            except (IOError, OSError, ValueError, IndexError):
+                state, threads, rss = ("gone", None, None)
+            status = read_proc_fields("/proc/%d/status" % (self.pid), \
+                ("voluntary_ctxt_switches", "nonvoluntary_ctxt_switches"))
+            io = read_proc_fields("/proc/%d/io" % (self.pid), \
+                ("read_bytes", "write_bytes"))
+            row["state"] = state
+            row["cpu_percent"] = None
+            if cpu is not None and previous["cpu"] is not None:
+                row["cpu_percent"] = round(100.0 * \
+                    (cpu - previous["cpu"]) / seconds, 1)
+            row["threads"] = threads
+            row["rss_bytes"] = rss
+            row["voluntary_ctxt"] = status["voluntary_ctxt_switches"]
+            row["nonvoluntary_ctxt"] = status["nonvoluntary_ctxt_switches"]
+            for name in ("read_bytes", "write_bytes"):
+                row[name + "_per_s"] = None
+                if io[name] is not None and previous["io"] is not None and \
+                    previous["io"][name] is not None:
+                    row[name + "_per_s"] = round((io[name] - \
+                        previous["io"][name]) / seconds, 1)
+        if self.database is not None:
+            row["db_bytes"] = database_size(self.database)
+        self.previous = {"time": now, "client": histogram, "cpu": cpu, \
+            "io": io}
+        return row
+
+    def run(self):
+        """
+        Sample until stopped.
+        """
+        while not self.stopped.wait(self.interval):
+            self.rows.append(self.sample())
+
+    def begin(self):
+        """
+        Start sampling.
+        """
+        self.start = time.time()
+        self.previous = None
+        self.sample()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def end(self):
+        """
+        Take a last sample, stop sampling and return the rows.
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.rows.append(self.sample())
+        return self.rows
+
+def print_sampler_summary(rows):
+    """
+    Print peaks of the resource samples.
+    """
+    print_header("Resource summary")
+    print "Samples: %d" % (len(rows))
+    for name, label, scale in (("req_per_s", "Client req/s", 1.0), \
+        ("p99_ms", "Client p99 ms", 1.0), \
+        ("cpu_percent", "Server CPU %", 1.0), \
+        ("rss_bytes", "Server RSS MB", 1000000.0), \
+        ("threads", "Server threads", 1.0), \
+        ("write_bytes_per_s", "Server writes MB/s", 1000000.0), \
+        ("db_bytes", "Database MB", 1000000.0)):
+        values = [row[name] for row in rows \
+            if row.get(name) is not None]
+        if values:
+            print "%-20s min %10.2f max %10.2f last %10.2f" % (label, \
+                min(values) / scale, max(values) / scale, values[-1] / scale)
+    print "------------------------------------------------------------------"
+
+class FuzzGenerator(object):
+    """
+    Seeded generator of task bodies around the validation rules. Every
+    field is valid or of one of the fuzz kinds, and cases are labelled
+    field:kind.
+    """
+    def __init__(self, methods=FUZZ_METHODS, kinds=FUZZ_KINDS, seed=0):
+        self.methods = methods
+        self.kinds = kinds
+        self.random = random.Random(seed)
+        self.generator = TaskGenerator(seed)
+
+    def text(self, length, alphabet=None):
+        """
+        Return text of length UTF-16 code units, from alphabet when given.
+        """
+        if alphabet is None:
+            text = self.generator.text(length) if length > 0 else ""
+            return text + "x" * (length - len(text))
+        characters = []
+        while length > 0:
+            character = self.random.choice(alphabet)
+            if utf16_length(character) > length:
+                character = u"a"
+            characters.append(character)
+            length -= utf16_length(character)
+        return u"".join(characters)
+
+    def deadline(self):
+        """
+        Return valid deadline in one of the ISO 8601 variants.
+        """
+        moment = datetime.datetime(self.random.randint(1970, 2037), \
+            self.random.randint(1, 12), self.random.randint(1, 28), \
+            self.random.randint(0, 23), self.random.randint(0, 59), \
+            self.random.randint(0, 59), self.random.randint(0, 999999))
+        return moment.strftime(self.random.choice(FUZZ_DEADLINE_FORMATS))
+
+    def value(self, field, kind):
+        """
+        Return value of field for kind, FUZZ_MISSING to leave it out.
+        """
+        if kind == "missing":
+            return FUZZ_MISSING
+        if kind == "type":
+            return self.random.choice(FUZZ_WRONG_TYPES)
+        if field == "deadline":
+            if kind == "valid":
+                return self.deadline()
+            if kind == "unicode":
+                return self.random.choice(FUZZ_UNICODE_DEADLINES)
+            return self.random.choice(FUZZ_INVALID_DEADLINES)
+        minimum, maximum = (TITLE_MIN_LENGTH, TITLE_MAX_LENGTH) \
+            if field == "title" else \
+            (DESCRIPTION_MIN_LENGTH, DESCRIPTION_MAX_LENGTH)
+        if kind == "valid":
+            return self.text(self.random.randint(minimum, maximum))
+        # Lengths at and around both limits
+        length = max(self.random.choice((minimum - 1, minimum, minimum + 1, \
+            maximum - 1, maximum, maximum + 1, maximum + 2, 2 * maximum)), 0)
+        if kind == "unicode":
+            return self.text(length, FUZZ_UNICODE_ALPHABET)
+        return self.text(length)
+
+    def case(self):
+        """
+        Return (method, body, labels) of a new case.
+        """
+        method = self.random.choice(self.methods)
+        body = {}
+        labels = []
+        for field in ("title", "description", "deadline"):
+            kind = "valid"
+            if self.random.random() >= FUZZ_VALID_SHARE:
+                kind = self.random.choice(self.kinds)
+            value = self.value(field, kind)
+            if value is not FUZZ_MISSING:
+                body[field] = value
+            labels.append("%s:%s" % (field, kind))
+        return (method, body, tuple(labels))
+
+class FuzzFixture(object):
+    """
+    Task that PUT and PATCH cases of one worker run against, with the
+    values the server is expected to hold.
+    """
+    def __init__(self, base_url, seed=0):
+        self.base_url = base_url
+        self.generator = TaskGenerator(seed)
+        self.id = None
+        self.task = None
+
+    def create(self):
+        """
+        Insert the task, returns False when the server refused.
+        """
+        task = self.generator.task()
+        response = run_request(self.base_url, "/tasks.json", method="POST", \
+            data=json.dumps(task))
+        if response is None or response.status_code != 200:
+            return False
+        self.id = response.json()["id"]
+        self.task = task
+        return True
+
+    def restore(self, task=None):
+        """
+        Put valid values back with a PUT, by default the expected ones, so
+        an invalid update the server accepted doesn't affect later cases.
+        A new task is created when the server refuses them, returns False
+        when that fails too.
+        """
+        task = dict(self.task if task is None else task)
+        response = run_request(self.base_url, "/tasks/%s.json" % \
+            (self.id), method="PUT", data=json.dumps(task))
+        if response is not None and response.status_code == 200:
+            self.task = task
+            return True
+        self.delete()
+        return self.create()
+
+    def delete(self):
+        """
+        Remove the task.
+        """
+        if self.id is not None:
+            run_request(self.base_url, "/tasks/%s.json" % (self.id), \
+                method="DELETE")
+            self.id = None
+
+def run_fuzz_case(base_url, method, body, fixture):
+    """
+    Send case and return (expected number of error messages, problem or
+    None). PATCH is predicted on the fixture values merged with the body,
+    the way the server merges them. The fixture only takes over values of
+    valid updates, it has to be restored after a problem.
+    """
+    if method == "POST":
+        url = "/tasks.json"
+        task = body
+    else:
+        url = "/tasks/%s.json" % (fixture.id)
+        task = body
+        if method == "PATCH":
+            task = dict(fixture.task)
+            for field in ("title", "description", "deadline"):
+                if body.get(field) is not None:
+                    task[field] = body[field]
+    messages = len(validate_task(task))
+    response = run_request(base_url, url, method=method, \
+        data=json.dumps(body))
+    if messages:
+        problem = error_problem(response, messages, 400)
+    elif response is None:
+        problem = "HTTP request didn't succeed"
+    elif response.status_code != 200:
+        problem = "Status code %d != 200" % (response.status_code)
+    else:
+        problem = None
+    if response is not None and response.status_code == 200:
+        if method == "POST":
+            try:
+                run_request(base_url, "/tasks/%s.json" % \
+                    (response.json()["id"]), method="DELETE")
+            except (ValueError, KeyError, TypeError):
+                pass
+        elif problem is None:
+            fixture.task = dict((field, task.get(field)) \
+                for field in ("title", "description", "deadline"))
+    return (messages, problem)
+
+class FuzzStats(object):
+    """
+    Thread safe fuzz outcomes by method and label.
+    """
+    def __init__(self, failures=DEFAULT_FUZZ_FAILURES):
+        self.methods = {}
+        self.labels = {}
+        self.failures = collections.OrderedDict()
+        self.limit = failures
+        self.minimal = []
+        self.duplicates = 0
+        self.seen = set()
+        self.start = time.time()
+        self.lock = threading.Lock()
+
+    def first(self, method, body):
+        """
+        Return True when the case wasn't sent before. The digests are
+        dropped when there are too many, like the deadline cache.
+        """
+        digest = hashlib.md5(method + json.dumps(body, \
+            sort_keys=True)).digest()[:8]
+        with self.lock:
+            if digest in self.seen:
+                self.duplicates += 1
+                return False
+            if len(self.seen) >= FUZZ_DEDUP_SIZE:
+                self.seen.clear()
+            self.seen.add(digest)
+            return True
+
+    def record(self, method, body, labels, messages, problem):
+        """
+        Count case and keep the first failure of each method and labels,
+        with the number of mismatches of the same method and labels.
+        """
+        with self.lock:
+            counts = self.methods.setdefault(method, [0, 0, 0, 0])
+            counts[0] += 1
+            counts[1 if messages == 0 else 2] += 1
+            if problem is None:
+                return
+            counts[3] += 1
+            for label in labels:
+                self.labels[label] = self.labels.get(label, 0) + 1
+            key = (method, labels)
+            if key in self.failures:
+                self.failures[key]["cases"] += 1
+            elif len(self.failures) < self.limit:
+                self.failures[key] = {"method": method, "body": body, \
+                    "labels": list(labels), "messages": messages, \
+                    "problem": problem, "cases": 1}
+
+    def totals(self):
+        """
+        Return (cases, mismatches).
+        """
+        with self.lock:
+            return (sum(counts[0] for counts in self.methods.values()), \
+                sum(counts[3] for counts in self.methods.values()))
+
+def fuzz_worker(base_url, generator, stats, counter, fixture):
+    """
+    Send unique cases until the counter is exhausted.
+    """
+    while True:
+        for _ in range(FUZZ_DEDUP_ATTEMPTS):
+            method, body, labels = generator.case()
+            if stats.first(method, body):
+                break
+        else:
+            return
+        if counter.next() is None:
+            return
+        messages, problem = run_fuzz_case(base_url, method, body, fixture)
+        stats.record(method, body, labels, messages, problem)
+        if problem is not None and method != "POST" and \
+            not fixture.restore():
+            return
+
+def fuzz_candidates(body):
+    """
+    Yield simpler bodies, fields left out first, then plainer and shorter
+    values. Plain text keeps the UTF-16 length of the original.
+    """
+    for field in sorted(body.keys()):
+        smaller = dict(body)
+        del smaller[field]
+        yield smaller
+    for field in sorted(body.keys()):
+        value = body[field]
+        replacements = []
+        if isinstance(value, basestring):
+            replacements = ["".join(character if ord(character) < 128 \
+                else "a" * utf16_length(character) for character in value), \
+                value[:len(value) // 2], value[len(value) // 2:], value[:-1]]
+        elif isinstance(value, (list, dict)) and value:
+            replacements = [type(value)()]
+        elif value is not None and not isinstance(value, bool) and value != 0:
+            replacements = [0]
+        for replacement in replacements:
+            if replacement != value:
+                smaller = dict(body)
+                smaller[field] = replacement
+                yield smaller
+
+def check_fuzz_case(base_url, method, body, seed=0):
+    """
+    Send case against a fresh fixture task and return (expected number of
+    error messages, problem or None), None when no fixture was created.
+    """
+    fixture = FuzzFixture(base_url, seed)
+    if method != "POST" and not fixture.create():
+        return None
+    try:
+        return run_fuzz_case(base_url, method, body, fixture)
+    finally:
+        fixture.delete()
+
+def shrink_fuzz_case(base_url, method, body, seed=0):
+    """
+    Return the simplest body that still fails, with the expected number of
+    messages and the problem, by greedy removal and shortening. Every
+    candidate starts from the same fixture values, and the result is sent
+    once more against a fresh fixture. The problem is None when the body
+    doesn't fail on its own.
+    """
+    fixture = FuzzFixture(base_url, seed)
+    if method != "POST" and not fixture.create():
+        return (body, None, None)
+    try:
+        original = fixture.task
+        messages, problem = run_fuzz_case(base_url, method, body, fixture)
+        steps = 0
+        shrinking = problem is not None
+        while shrinking and steps < FUZZ_SHRINK_STEPS:
+            shrinking = False
+            for candidate in fuzz_candidates(body):
+                steps += 1
+                if method != "POST" and not fixture.restore(original):
+                    return (body, messages, None)
+                result = run_fuzz_case(base_url, method, candidate, fixture)
+                if result[1] is not None:
+                    body = candidate
+                    messages, problem = result
+                    shrinking = True
+                    break
+                if steps >= FUZZ_SHRINK_STEPS:
+                    break
+    finally:
+        fixture.delete()
+    if problem is not None:
+        result = check_fuzz_case(base_url, method, body, seed)
+        if result is None or result[1] is None:
+            return (body, messages, None)
+        messages, problem = result
+    return (body, messages, problem)
+
+def run_fuzz(base_url, methods=FUZZ_METHODS, kinds=FUZZ_KINDS, \
+    workers=DEFAULT_FUZZ_WORKERS, cases=None, duration=None, seed=0, \
+    failures=DEFAULT_FUZZ_FAILURES):
+    """
+    Send generated cases on concurrent workers, each with its own fixture
+    task, and shrink the first failures. Returns (stats, elapsed) or None
+    when no fixture could be created.
+    """
+    if cases is None and duration is None:
+        cases = DEFAULT_FUZZ_CASES
+    stats = FuzzStats(failures)
+    counter = LoadCounter(duration=duration, iterations=cases)
+    fixtures = []
+    for index in range(workers):
+        fixture = FuzzFixture(base_url, seed + index)
+        if not fixture.create():
+            for fixture in fixtures:
+                fixture.delete()
+            return None
+        fixtures.append(fixture)
+    threads = []
+    start = stats.start = time.time()
+    try:
+        for index, fixture in enumerate(fixtures):
+            thread = threading.Thread(target=fuzz_worker, args=(base_url, \
+                FuzzGenerator(methods, kinds, seed + index), stats, \
+                counter, fixture))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        for fixture in fixtures:
+            fixture.delete()
+    for failure in stats.failures.values():
+        body, messages, problem = shrink_fuzz_case(base_url, \
+            failure["method"], failure["body"], seed)
+        failure["shrunk"] = body
+        failure["shrunk_messages"] = messages
+        failure["shrunk_problem"] = problem
+    stats.minimal = collapse_fuzz_failures(stats.failures.values())
+    return (stats, elapsed)
+
+def collapse_fuzz_failures(failures):
+    """
+    Return distinct minimal failures out of the shrunk failures, keyed by
+    method, body and problem, with the labels and the number of cases that
+    led to each. Failures that didn't reproduce on a fresh task keep their
+    original body.
+    """
+    result = collections.OrderedDict()
+    for failure in failures:
+        reproduced = failure["shrunk_problem"] is not None
+        if reproduced:
+            body = failure["shrunk"]
+            messages = failure["shrunk_messages"]
+            problem = failure["shrunk_problem"]
+        else:
+            body = failure["body"]
+            messages = failure["messages"]
+            problem = failure["problem"]
+        key = (failure["method"], json.dumps(body, sort_keys=True), problem)
+        minimal = result.get(key)
+        if minimal is None:
+            minimal = result[key] = {"method": failure["method"], \
+                "body": body, "messages": messages, "problem": problem, \
+                "reproduced": reproduced, "labels": [], "cases": 0}
+        minimal["labels"].append(failure["labels"])
+        minimal["cases"] += failure["cases"]
+    return result.values()
+
+def print_fuzz_summary(stats, elapsed):
+    """
+    Print throughput, outcomes by method, the labels of mismatches and the
+    shrunk failures.
+    """
+    cases, mismatches = stats.totals()
+    print_header("Fuzz summary")
+    print "Cases: %d Duplicates skipped: %d Time: %.2fs Cases/s: %.1f " % \
+        (cases, stats.duplicates, elapsed, cases / elapsed \
+        if elapsed > 0 else 0.0) + "Mismatches: %d" % (mismatches)
+    print "%-8s %9s %9s %9s %11s" % ("Method", "Cases", "Valid", \
+        "Invalid", "Mismatches")
+    for method in sorted(stats.methods.keys()):
+        print "%-8s %9d %9d %9d %11d" % tuple([method] + \
+            stats.methods[method])
+    if stats.labels:
+        print "%-24s %11s" % ("Label", "Mismatches")
+        for label, count in sorted(stats.labels.items(), \
+            key=lambda item: (-item[1], item[0])):
+            print "%-24s %11d" % (label, count)
+    for failure in stats.minimal:
+        print_error("%s %s expected %d messages: %s (%d cases%s)" % \
+            (failure["method"], json.dumps(failure["body"], \
+            sort_keys=True), failure["messages"], failure["problem"], \
+            failure["cases"], "" if failure["reproduced"] else \
+            ", not reproduced on a fresh task"))
+    print_latency_summary(LATENCY)
+    print "------------------------------------------------------------------"
+
+def fuzz_main(argv):
+    """
+    Fuzz command, checks the validation of generated task bodies against
+    the predicted error messages.
+    """
+    parser = argparse.ArgumentParser(prog='test.py fuzz', \
+        description='send generated valid and invalid task bodies in ' + \
+        'parallel and check the number of validation errors', \
+        epilog='Example: ./test.py fuzz http://127.0.0.1:8080/ ' + \
+        '--cases 1000000 --workers 32 --output failures.jsonl')
+    parser.add_argument('endpoint', help='server endpoint')
+    parser.add_argument('--cases', type=int, help='number of unique ' + \
+        'cases, default %d without --duration' % (DEFAULT_FUZZ_CASES))
+    parser.add_argument('--duration', type=float, \
+        help='send cases for this many seconds')
+    parser.add_argument('--workers', type=int, \
+        default=DEFAULT_FUZZ_WORKERS, help='concurrent workers')
+    parser.add_argument('--methods', default=",".join(FUZZ_METHODS), \
+        help='comma separated methods out of %s' % (", ".join(FUZZ_METHODS)))
+    parser.add_argument('--kinds', default=",".join(FUZZ_KINDS), \
+        help='comma separated kinds of invalid fields out of %s' % \
+        (", ".join(FUZZ_KINDS)))
+    parser.add_argument('--failures', type=int, \
+        default=DEFAULT_FUZZ_FAILURES, help='distinct failures kept ' + \
+        'and shrunk')
+    parser.add_argument('--seed', type=int, default=0, \
+        help='random generator seed')
+    parser.add_argument('--output', help='write the failures as JSON ' + \
+        'lines to this file')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, \
+        help='per-request timeout in seconds')
+    args = parser.parse_args(argv)
+    methods = tuple(method.strip().upper() \
+        for method in args.methods.split(","))
+    kinds = tuple(kind.strip() for kind in args.kinds.split(","))
+    if any(method not in FUZZ_METHODS for method in methods):
+        parser.error("methods must be out of %s" % (", ".join(FUZZ_METHODS)))
+    if any(kind not in FUZZ_KINDS for kind in kinds):
+        parser.error("kinds must be out of %s" % (", ".join(FUZZ_KINDS)))
+    if args.workers <= 0:
+        parser.error("workers must be positive")
+    configure_transport(pool_size=args.workers, timeout=args.timeout)
+    result = run_fuzz(args.endpoint, methods, kinds, workers=args.workers, \
+        cases=args.cases, duration=args.duration, seed=args.seed, \
+        failures=args.failures)
+    if result is None:
+        print_error("Unable to create fixture tasks at %s" % (args.endpoint))
+        return 1
+    stats, elapsed = result
+    print_fuzz_summary(stats, elapsed)
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            for failure in stats.minimal:
+                output.write(json.dumps(failure, sort_keys=True) + "\n")
+    return 1 if stats.totals()[1] else 0
+
+def probe_request(connection, method, url):
+    """
+    Send request on a httplib connection and return (status, headers,
+    body, seconds).
+    """
+    start = time.time()
+    connection.request(method, url, headers={"Connection": "keep-alive"})
+    response = connection.getresponse()
+    body = response.read()
+    return (response.status, dict(response.getheaders()), body, \
+        time.time() - start)
+
+def probe_check(connection, prefix):
+    """
+    Check HEAD /tasks.json and GET /tasks.json?pageSize=1. Returns (list
+    of (method, status, seconds), X-Count, failure reason or None).
+    """
+    status, headers, _, seconds = probe_request(connection, "HEAD", \
+        prefix + "/tasks.json")
+    timings = [("HEAD", status, seconds)]
+    if status not in (200, 204):
+        return (timings, None, "HEAD /tasks.json returned %d" % (status))
+    count = parse_int(headers.get("x-count", ""))
+    if count is None or count < 0:
+        return (timings, None, "HEAD /tasks.json has no valid X-Count")
+    status, headers, body, seconds = probe_request(connection, "GET", \
+        prefix + "/tasks.json?pageSize=1")
+    timings.append(("GET", status, seconds))
+    if status != 200:
+        return (timings, count, "GET /tasks.json returned %d" % (status))
+    try:
+        tasks = json.loads(body)
+    except ValueError:
+        return (timings, count, "GET /tasks.json returned invalid JSON")
+    if not isinstance(tasks, list) or len(tasks) > 1:
+        return (timings, count, "GET /tasks.json?pageSize=1 did not " + \
+            "return at most one task")
+    # Tasks may come and go between the two requests, the count of the GET
+    # response tells whether one is due
+    if parse_int(headers.get("x-count", "")) > 0 and (len(tasks) != 1 or \
+        not isinstance(tasks[0], dict) or "id" not in tasks[0] or \
+        "deadline" not in tasks[0]):
+        return (timings, count, "GET /tasks.json?pageSize=1 did not " + \
+            "return a task")
+    return (timings, count, None)
+
+def probe_main(argv):
+    """
+    Probe command, a liveness check fast enough to run every few seconds.
+    Arguments are parsed by hand and requests sent with httplib, so none
+    of the heavy modules is imported. Exits 0 when healthy, 1 when not and
+    2 on usage errors.
+    """
+    usage = "usage: test.py probe endpoint [--timeout SECONDS]"
+    endpoint = None
+    timeout = DEFAULT_PROBE_TIMEOUT
+    arguments = list(argv)
+    while arguments:
+        argument = arguments.pop(0)
+        if argument in ("-h", "--help"):
+            print usage
+            print "Example: ./test.py probe http://127.0.0.1:8080/ " + \
+                "--timeout 0.5"
+            return 0
+        if argument == "--timeout" and arguments:
+            argument = "--timeout=" + arguments.pop(0)
+        if argument.startswith("--timeout="):
+            try:
+                timeout = float(argument[len("--timeout="):])
+            except ValueError:
+                timeout = 0
+        elif endpoint is None and not argument.startswith("-"):
+            endpoint = argument
+        else:
+            endpoint = None
+            break
+    parts = urlparse.urlsplit(endpoint or "")
+    if endpoint is None or timeout <= 0 or parts.scheme != "http" or \
+        not parts.hostname:
+        sys.stderr.write(usage + "\n")
+        return 2
+    start = time.time()
+    connection = httplib.HTTPConnection(parts.hostname, parts.port or 80, \
+        timeout=timeout)
+    try:
+        timings, count, reason = probe_check(connection, \
+            parts.path.rstrip("/"))
+    except (socket.error, httplib.HTTPException) as error:
+        timings, count = ([], None)
+        reason = "Connection timed out" if isinstance(error, \
+            socket.timeout) else "Network problem occurred"
+    finally:
+        connection.close()
+    line = " ".join(["%s %d %.1f ms" % (method, status, seconds * 1000.0) \
+        for method, status, seconds in timings])
+    if count is not None:
+        line += " X-Count %d" % (count)
+    line += " total %.1f ms" % ((time.time() - start) * 1000.0)
+    if reason is not None:
+        print "FAIL %s %s: %s" % (endpoint, line.strip(), reason)
+        return 1
+    print "OK %s %s" % (endpoint, line)
+    return 0
+
+# Subcommands, the default command runs the test suite
+COMMANDS = {
+    "seed": seed_main,
+    "pages": pages_main,
+    "search": search_main,
+    "stream": stream_main,
+    "replay": replay_main,
+    "serve": serve_main,
+    "bench": bench_main,
+    "compress": compress_main,
+    "crawl": crawl_main,
+    "pipeline": pipeline_main,
+    "probe": probe_main,
+    "fuzz": fuzz_main
+}
+
+def run_mode(args, endpoint):
+    """
+    Run selected mode against endpoint, print its summary and return
+    (failed, succeeded).
+    """
+    if args.rate:
+        duration = args.duration or DEFAULT_LOAD_DURATION
+        stats = run_open_loop(endpoint, args.rate, args.mix, \
+            duration=duration, connections=args.connections, \
+            timeout=args.timeout, seed=args.seed)
+        print_open_loop_summary(stats, args.rate, duration)
+        return (stats.errors, stats.completed - stats.errors)
+    if args.profile:
+        configure_transport(pool_size=max(args.pool_size, args.workers), \
+            timeout=args.timeout)
+        stats, keys, elapsed = run_workload(endpoint, args.profile, \
+            distribution=args.keys, records=args.records, theta=args.theta, \
+            workers=args.workers, duration=args.duration, \
+            iterations=args.iterations, seed=args.seed)
+        print_workload_summary(stats, args.profile, args.keys, keys, elapsed)
+        requests_count = 0
+        errors = 0
+        for count in stats.totals(0).values():
+            requests_count += count[0]
+            errors += count[1]
+        return (errors, requests_count - errors)
+    if args.load:
+        configure_transport(pool_size=max(args.pool_size, args.workers), \
+            timeout=args.timeout)
+        stats = run_load(endpoint, workers=args.workers, \
+            duration=args.duration, iterations=args.iterations)
+        requests_count = 0
+        errors = 0
+        for count in stats.totals(0).values():
+            requests_count += count[0]
+            errors += count[1]
+        return (errors, requests_count - errors)
+    if args.clients:
+        configure_transport(timeout=args.timeout, engine="async", \
+            connections=args.connections)
+        failed_tests, succeeded_tests = run_async_conformance(endpoint, \
+            args.clients, verbose=args.verbose)
+        print_test_summary(failed_tests, succeeded_tests)
+        return (failed_tests, succeeded_tests)
+    configure_transport(pool_size=args.pool_size, timeout=args.timeout, \
+        engine=args.engine, connections=args.connections)
+    list_test = stream_get_test if args.stream else get_test
+    # The async engine serves one thread at a time
+    workers = 1 if args.engine == "async" else args.parallel
+    failed_tests, succeeded_tests = run_suite(build_suite(list_test), \
+        endpoint, workers=workers, verbose=args.verbose)
+    # Print summary
+    print_test_summary(failed_tests, succeeded_tests)
+    return (failed_tests, succeeded_tests)
+
+def run_endpoint(job):
+    """
+    Run mode against one endpoint in a worker process and return its
+    tallies, timing data, result records and output.
+    """
+    global SINK
+    args, endpoint = job
+    records = ListSink()
+    SINK = MultiSink([records] if args.quiet else [TerminalSink(), records])
+    output = StringIO.StringIO()
+    sys.stdout = output
+    start = time.time()
+    try:
+        failed_tests, succeeded_tests = run_mode(args, endpoint)
+    except Exception:
+        output.write(traceback.format_exc())
+        failed_tests, succeeded_tests = (1, 0)
+    finally:
+        SINK.flush()
+        if RECORDER is not None:
+            RECORDER.flush()
+        sys.stdout = sys.__stdout__
+    connections = (0, 0)
+    if TRANSPORT is not None:
+        connections = TRANSPORT.connection_stats()
+    return {
+        "endpoint": endpoint,
+        "failed": failed_tests,
+        "succeeded": succeeded_tests,
+        "elapsed": time.time() - start,
+        "connections": connections,
+        "latency": LATENCY.snapshot(),
+        "records": records.records,
+        "output": output.getvalue()
+    }
+
+def print_endpoint_summary(results):
+    """
+    Print tallies and latency of every endpoint.
+    """
+    print_header("Endpoint summary")
+    print "%-32s %7s %9s %8s %9s %8s %8s" % ("Endpoint", "Failed", \
+        "Succeeded", "Time s", "Req/s", "p50 ms", "p99 ms")
+    for result in results:
+        histogram = LatencyHistogram()
+        for route_histogram in result["latency"].values():
+            histogram.merge(route_histogram)
+        print "%-32s %7d %9d %8.2f %9.1f %8.2f %8.2f" % (result["endpoint"], \
+            result["failed"], result["succeeded"], result["elapsed"], \
+            histogram.throughput(), histogram.percentile(50.0) * 1000.0, \
+            histogram.percentile(99.0) * 1000.0)
+
+def run_sharded(args, processes=None):
+    """
+    Run an isolated copy of the mode against every endpoint in a process
+    pool and print a merged summary. Returns (failed, succeeded).
+    """
+    # Every endpoint gets a fresh worker, the latency histograms, caches and
+    # transport of an earlier endpoint would otherwise leak into its result
+    pool = multiprocessing.Pool(processes or len(args.endpoint), \
+        maxtasksperchild=1)
+    try:
+        results = pool.map(run_endpoint, \
+            [(args, endpoint) for endpoint in args.endpoint], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    failed_tests = 0
+    succeeded_tests = 0
+    for result in results:
+        print_header("Endpoint %s" % (result["endpoint"]))
+        sys.stdout.write(result["output"])
+        for record in result["records"]:
+            record["endpoint"] = result["endpoint"]
+            SINK.add(record, terminal=False)
+        failed_tests += result["failed"]
+        succeeded_tests += result["succeeded"]
+        LATENCY.merge(result["latency"])
+    print_endpoint_summary(results)
+    opened = sum(result["connections"][0] for result in results)
+    reused = sum(result["connections"][1] for result in results)
+    print_test_summary(failed_tests, succeeded_tests, \
+        connections=(opened, reused))
+    return (failed_tests, succeeded_tests)
+
+def build_parser():
+    """
+    Return parser of the test client flags.
+    """
+    parser = argparse.ArgumentParser(description='node-challenge test client', \
+        epilog='Example: ./test.py http://127.0.0.1:8080/')
+    parser.add_argument('endpoint', nargs='*', help='server endpoint, ' + \
+        'several endpoints are run at once in a process pool')
+    parser.add_argument('--reference', choices=('inprocess', 'loopback'), \
+        help='run against a fresh Python reference server instead of ' + \
+        'an endpoint, in process or over loopback')
+    parser.add_argument('--processes', type=int, \
+        help='size of the process pool, default one per endpoint')
+    parser.add_argument('--verbose', '-v', \
+        help='print verbose information during execution', action='store_true')
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE, \
+        help='number of pooled keep-alive connections per host')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, \
+        help='per-request timeout in seconds')
+    parser.add_argument('--engine', choices=('pool', 'async'), \
+        default='pool', help='request engine, pooled sessions or async ' + \
+        'sockets multiplexed on a single thread')
+    parser.add_argument('--connections', type=int, \
+        default=DEFAULT_ENGINE_CONNECTIONS, \
+        help='maximum open sockets of the async engine')
+    parser.add_argument('--clients', type=int, \
+        help='run task checks for this many concurrent clients on the ' + \
+        'async engine')
+    parser.add_argument('--parallel', type=int, \
+        default=DEFAULT_SUITE_WORKERS, help='number of test cases run ' + \
+        'at once, cases that depend on each other still run in order')
+    parser.add_argument('--stream', action='store_true', \
+        help='parse task arrays incrementally while they are received')
+    parser.add_argument('--load', action='store_true', \
+        help='replay the task lifecycle concurrently instead of testing')
+    parser.add_argument('--workers', type=int, default=DEFAULT_LOAD_WORKERS, \
+        help='number of concurrent lifecycles in load mode')
+    parser.add_argument('--duration', type=float, \
+        help='load mode duration in seconds')
+    parser.add_argument('--iterations', type=int, \
+        help='number of lifecycles to run in load mode')
+    parser.add_argument('--rate', type=float, \
+        help='send requests of the route mix at this many per second ' + \
+        'for --duration seconds, whatever the response times')
+    parser.add_argument('--mix', default=DEFAULT_OPEN_LOOP_MIX, \
+        help='weighted route mix of --rate as "METHOD url=weight,...", ' + \
+        ':id stands for an existing task')
+    parser.add_argument('--profile', \
+        help='run a workload profile instead of testing, one of %s or ' % \
+        (", ".join(sorted(WORKLOAD_PROFILES))) + '"OPERATION=weight,..." ' + \
+        'with operations %s' % (", ".join(sorted(WORKLOAD_OPERATIONS))))
+    parser.add_argument('--keys', choices=KEY_DISTRIBUTIONS, \
+        default='zipfian', help='distribution of task ids of --profile')
+    parser.add_argument('--records', type=int, \
+        default=DEFAULT_WORKLOAD_RECORDS, help='number of tasks of ' + \
+        '--profile, missing ones are inserted first')
+    parser.add_argument('--theta', type=float, default=ZIPFIAN_THETA, \
+        help='skew of the zipfian and latest distributions, below 1')
+    parser.add_argument('--seed', type=int, default=0, \
+        help='random generator seed of --rate and --profile')
+    parser.add_argument('--pid', type=int, \
+        help='sample CPU, memory, threads and disk I/O of the server ' + \
+        'process with this pid during the run')
+    parser.add_argument('--database', \
+        help='sample the size of this SQLite database file during the run')
+    parser.add_argument('--sample-interval', type=float, \
+        default=DEFAULT_SAMPLE_INTERVAL, help='seconds between samples')
+    parser.add_argument('--samples', metavar='PATH', \
+        help='write the samples with client req/s and latency to PATH')
+    parser.add_argument('--samples-format', choices=('csv', 'json'), \
+        default='csv', help='format of --samples')
+    parser.add_argument('--trace', type=int, nargs='?', metavar='N', \
+        const=DEFAULT_TRACE_SIZE, help='keep the last N exchanges, ' + \
+        'default %d, and print them when a check fails' % \
+        (DEFAULT_TRACE_SIZE))
+    parser.add_argument('--trace-bytes', type=int, \
+        default=DEFAULT_TRACE_BYTES, help='bytes of each traced body kept')
+    parser.add_argument('--cache', type=int, nargs='?', metavar='N', \
+        const=DEFAULT_CACHE_SIZE, help='revalidate repeated GETs with ' + \
+        'If-None-Match from a cache of the last N responses, default ' + \
+        '%d, and report the savings' % (DEFAULT_CACHE_SIZE))
+    parser.add_argument('--record', metavar='PATH', \
+        help='append every exchange to a trace file for the replay command')
+    parser.add_argument('--jsonl', metavar='PATH', \
+        help='write test results as JSON lines to PATH, - for stdout')
+    parser.add_argument('--junit', metavar='PATH', \
+        help='write test results as JUnit XML to PATH')
+    parser.add_argument('--quiet', '-q', action='store_true', \
+        help='do not print test results, only summaries')
+    parser.add_argument('--version', action='version', \
+        version='%(prog)s ' + __version__, help='display version information')
+    return parser
+
+def main():
+    """
+    Main function for test client.
+    """
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+    # Setup flags
+    parser = build_parser()
+    # Parse command line arguments
+    args = parser.parse_args(sys.argv[1:])
+    if args.reference is not None:
+        if args.endpoint:
+            parser.error("--reference replaces the endpoint")
+        if args.reference == "inprocess" and (args.engine == "async" or \
+            args.clients or args.rate):
+            parser.error("the in-process reference server needs the " + \
+                "pooled engine, use --reference loopback")
+        args.endpoint = [start_reference(args.reference)]
+    elif not args.endpoint:
+        parser.error("endpoint is required")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("rate must be positive")
+    if args.cache is not None and args.cache <= 0:
+        parser.error("cache size must be positive")
+    if not 0 < args.theta < 1:
+        parser.error("theta must be between 0 and 1")
+    try:
+        args.mix = parse_mix(args.mix)
+        if args.profile is not None:
+            args.profile = parse_profile(args.profile)
+    except ValueError as error:
+        parser.error(str(error))
+    configure_sink(quiet=args.quiet, jsonl=args.jsonl, junit=args.junit)
+    configure_trace(args.trace, args.trace_bytes)
+    configure_recorder(args.record)
+    configure_cache(args.cache)
+    sampler = None
+    if args.pid is not None or args.database is not None:
+        if len(args.endpoint) > 1:
+            parser.error("resource sampling needs a single endpoint")
+        if args.pid is not None and not os.path.exists("/proc/%d/stat" % \
+            (args.pid)):
+            parser.error("no process with pid %d" % (args.pid))
+        sampler = ResourceSampler(args.pid, args.database, \
+            interval=args.sample_interval)
+        sampler.begin()
+    try:
+        if len(args.endpoint) > 1:
+            run_sharded(args, processes=args.processes)
+        else:
+            run_mode(args, args.endpoint[0])
+        if sampler is not None:
+            rows = sampler.end()
+            print_sampler_summary(rows)
+            if args.samples is not None:
+                write_results(rows, rows[0].keys(), args.samples, \
+                    args.samples_format)
+    finally:
+        SINK.close()
+        if RECORDER is not None:
+            RECORDER.close()
     return 0
 
 if __name__ == "__main__":
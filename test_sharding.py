@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Checks of the sharded runs of the test client.
+
+Run: python test_sharding.py
+"""
+
+import imp
+import os
+import StringIO
+import sys
+import unittest
+
+# Loaded by path, the name test belongs to the standard library package
+client = imp.load_source("client", os.path.join( \
+    os.path.dirname(os.path.abspath(__file__)), "test.py"))
+
+def route_counts(snapshot):
+    """
+    Return number of requests by method and route of a latency snapshot.
+    """
+    return dict((key, histogram.count) \
+        for key, histogram in snapshot.items())
+
+def run_sharded(endpoints, processes):
+    """
+    Run the conformance suite quietly against endpoints and return the
+    merged request counts.
+    """
+    args = client.build_parser().parse_args(endpoints + ["-q"])
+    client.LATENCY.reset()
+    output = StringIO.StringIO()
+    sys.stdout = output
+    try:
+        failed, succeeded = client.run_sharded(args, processes=processes)
+    finally:
+        sys.stdout = sys.__stdout__
+    return (failed, succeeded, route_counts(client.LATENCY.snapshot()))
+
+class ShardedTest(unittest.TestCase):
+    """
+    Endpoints sharing a pool worker are measured independently.
+    """
+    def test_endpoints_on_one_process(self):
+        failed, succeeded, single = run_sharded( \
+            [client.start_reference("loopback")], 1)
+        self.assertEqual(failed, 0)
+        failed, succeeded, merged = run_sharded( \
+            [client.start_reference("loopback"), \
+            client.start_reference("loopback")], 1)
+        self.assertEqual(failed, 0)
+        self.assertEqual(merged, dict((key, 2 * count) \
+            for key, count in single.items()))
+
+if __name__ == "__main__":
+    unittest.main()